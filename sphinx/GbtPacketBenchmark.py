@@ -0,0 +1,196 @@
+'''
+GbtPacketBenchmark checks that every way of making a GBT packet is decoded back into the hits it was made from, and measures how fast
+packets are encoded and decoded. Run it before and after changing GbtPacketMaker or GbtPacketChecker::
+
+
+    python GbtPacketBenchmark.py
+
+    # or
+    GbtPacketBenchmark.conformance()
+    GbtPacketBenchmark.benchmark(100000)
+
+
+conformance() sweeps every single hit (4 planes x 8 vmm's x 64 channels), every number of hits from 1 to 8 with channels 0 to 63 on
+every position, and random packets of HitGenerator. Each packet goes through make_gbt(), encode() and encode_batch(), is compared with
+the string pipeline GbtPacketMaker.read_packet() that does not share lookup tables with the decoder, and is read back
+with GbtPacketChecker.decode_words() and with read_hitmap() / read_artdata() from a GBT packet file. The code exits with status 1
+at the first packet that does not round trip. The decode cache of GbtPacketChecker is turned off while the sweep and the benchmark
+run, so that every packet is really decoded, and benchmark() measures decode_words() with the cache separately.
+'''
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+import GbtPacketMaker
+from GbtPacketChecker import GbtPacketChecker
+from HitGenerator import HitGenerator
+from HitSet import HitSet
+from PacketStats import PacketStats
+
+
+class GbtPacketBenchmark:
+    '''
+    This is a class of the round-trip conformance sweep and the encode/decode benchmark.
+    '''
+    @staticmethod
+    def cases(num_random=10000, seed=0):
+        '''
+        Yields (name, HitSet) of every case of the sweep: "single" hits, hits of every "multiplicity" and "random" packets.
+        Hits of a packet are on different vmm's since Hit Map has one bit per vmm.
+        '''
+        for plane in range(4):
+            for vmm in range(8):
+                for channel in range(64):
+                    yield "single", HitSet([plane], [vmm], [channel])
+
+        for num_hit in range(1, 9):
+            for shift in range(8):                                          # vmm's shift + 0, shift + 4, ... cover all 32 vmm's
+                vmms = sorted((shift + 4 * i) % 32 for i in range(num_hit))
+                for pos in range(num_hit):
+                    for channel in range(0, 64, 7 if pos else 1):           # every channel on the first position
+                        channels = [(channel + 11 * i) % 64 for i in range(num_hit)]
+                        channels[pos] = channel
+                        yield "multiplicity", HitSet.from_packed([vmm << 6 | ch for vmm, ch in zip(vmms, channels)])
+
+        generator = HitGenerator(seed, multiplicity=[1] * 8)
+        for _, _, hit_set in HitGenerator.hit_sets(generator.generate(num_random)):
+            yield "random", hit_set
+
+    @staticmethod
+    def fail(name, hit_set, BCID, message):
+        '''
+        Prints a case that does not round trip and exits with status 1.
+        '''
+        print("FAILED %s case %s at BC %s: %s" % (name, hit_set, BCID, message))
+        sys.exit(1)
+
+    @staticmethod
+    def conformance(num_random=10000, seed=0):
+        '''
+        Runs the round-trip sweep of cases(). Prints the number of cases of each kind if all of them round trip.
+
+        :return dict: {"single": int, "multiplicity": int, "random": int} numbers of cases checked
+        '''
+        directory = tempfile.mkdtemp() + "/"
+        counts = {}
+        batch = {"Plane": [], "VMM": [], "Channel": [], "Packet index": [], "BCID": [], "Region": []}
+        expected = []
+        decode_cache = GbtPacketChecker.decode_cache
+        GbtPacketChecker.set_decode_cache(0)            # cases repeat payloads, which the cache would not decode again
+        try:
+            for index, (name, hit_set) in enumerate(GbtPacketBenchmark.cases(num_random, seed)):
+                counts[name] = counts.get(name, 0) + 1
+                BCID = (32 * index) % 4096
+                region = 20 + index % 10
+                maker = GbtPacketMaker.GbtPacketMaker(hit_set)
+                words = maker.encode(BCID)
+                lines = maker.make_gbt(BCID, region, "benchmark", make=False)
+                if lines != GbtPacketMaker.GbtPacketMaker.format_words(words, region):
+                    GbtPacketBenchmark.fail(name, hit_set, BCID, "make_gbt() and encode() disagree")
+                if "".join("%08X" % word for word in words) != maker.read_packet(BCID):     # string pipeline without lookup tables
+                    GbtPacketBenchmark.fail(name, hit_set, BCID, "encode() gives %s, but the string pipeline gives %s" % (list(words), maker.read_packet(BCID)))
+
+                BCID_read, vmms, channels, problems = GbtPacketChecker.decode_words(words)
+                if BCID_read != BCID or problems or GbtPacketChecker.to_hit_set(vmms, channels) != hit_set:
+                    GbtPacketBenchmark.fail(name, hit_set, BCID, "decode_words() gives BC %s %s %s %s" % (BCID_read, vmms, channels, problems))
+
+                with open(directory + "packet", 'w') as f:
+                    f.write(lines + '00000001 01')
+                checker = GbtPacketChecker(directory, "packet")
+                if checker.read_hitmap() != hit_set.vmm_list() or checker.read_artdata() != hit_set.channel_list():
+                    GbtPacketBenchmark.fail(name, hit_set, BCID, "read_hitmap() and read_artdata() give %s %s" % (checker.read_hitmap(), checker.read_artdata()))
+
+                for plane, vmm, channel in hit_set:
+                    batch["Plane"].append(plane)
+                    batch["VMM"].append(vmm)
+                    batch["Channel"].append(channel)
+                    batch["Packet index"].append(index)
+                batch["BCID"].append(BCID)
+                batch["Region"].append(region)
+                expected.append((name, hit_set, BCID, list(words)))
+        finally:
+            shutil.rmtree(directory)
+            GbtPacketChecker.decode_cache = decode_cache
+
+        words = HitGenerator.encode(batch)["Words"].tolist()
+        for (name, hit_set, BCID, encoded), batch_words in zip(expected, words):
+            if batch_words != encoded:
+                GbtPacketBenchmark.fail(name, hit_set, BCID, "encode_batch() gives %s instead of %s" % (batch_words, encoded))
+
+        print("All cases round trip: %s" % ", ".join("%s %s" % (counts[name], name) for name in ["single", "multiplicity", "random"] if name in counts))
+        return counts
+
+    @staticmethod
+    def measure(function, num_packets, setup=None):
+        '''
+        Runs function() once and returns (packets/sec, bytes of memory allocated at the peak per packet).
+        setup() is called before each run, e.g. to clear a cache so that the second run does not measure what the first one cached.
+        '''
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if setup is not None:
+            setup()
+        start = time.perf_counter()                     # tracemalloc slows allocation down, so time a second run without it
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+        return num_packets / seconds, peak / float(num_packets)
+
+    @staticmethod
+    def benchmark(num_packets=100000, seed=0):
+        '''
+        Measures packets/sec and memory per packet of encoding and decoding num_packets random packets of 1 to 8 hits::
+
+
+                GbtPacketBenchmark.benchmark(100000)
+
+
+        :return dict: {stage: (packets/sec, bytes/packet)} for "make_gbt", "encode", "encode_batch", "decode_words", "decode_words cached"
+            and "read file". "decode_words cached" starts each run with an empty decode cache of the default size, and the other
+            stages run without the cache.
+        '''
+        batch = HitGenerator(seed, multiplicity=[1] * 8).generate(num_packets)
+        packets = list(HitGenerator.hit_sets(batch))
+        words = [list(packet) for packet in HitGenerator.encode(batch)["Words"].tolist()]
+        makers = [GbtPacketMaker.GbtPacketMaker(hit_set) for _, _, hit_set in packets]
+
+        result = {}
+        result["make_gbt"] = GbtPacketBenchmark.measure(
+            lambda: [maker.make_gbt(BCID, region, "benchmark", make=False) for maker, (BCID, region, _) in zip(makers, packets)], num_packets)
+        result["encode"] = GbtPacketBenchmark.measure(
+            lambda: [maker.encode(BCID) for maker, (BCID, _, _) in zip(makers, packets)], num_packets)
+        result["encode_batch"] = GbtPacketBenchmark.measure(lambda: HitGenerator.encode(batch), num_packets)
+        decode = lambda: [GbtPacketChecker.to_hit_set(*GbtPacketChecker.decode_words(packet_words)[1:3]) for packet_words in words]
+        decode_cache = GbtPacketChecker.decode_cache
+        directory = tempfile.mkdtemp() + "/"
+        try:
+            result["decode_words cached"] = GbtPacketBenchmark.measure(decode, num_packets, setup=GbtPacketChecker.set_decode_cache)
+            GbtPacketChecker.set_decode_cache(0)
+            result["decode_words"] = GbtPacketBenchmark.measure(decode, num_packets)
+
+            num_files = min(num_packets, 2000)          # one GBT packet file per packet is slow, so fewer packets are read from files
+            for i in range(num_files):
+                with open(directory + str(i), 'w') as f:
+                    f.write(GbtPacketMaker.GbtPacketMaker.format_words(words[i], packets[i][1]) + '00000001 01')
+            result["read file"] = GbtPacketBenchmark.measure(
+                lambda: [GbtPacketChecker(directory, str(i)).read_hit_set() for i in range(num_files)], num_files)
+        finally:
+            shutil.rmtree(directory)
+            GbtPacketChecker.decode_cache = decode_cache
+
+        print("%-20s %14s %14s" % ("stage", "packets/sec", "bytes/packet"))
+        for stage in ["make_gbt", "encode", "encode_batch", "decode_words", "decode_words cached", "read file"]:
+            print("%-20s %14.0f %14.1f" % (stage, result[stage][0], result[stage][1]))
+        return result
+
+
+if __name__ == "__main__":
+    PacketStats.configure_logging()
+    GbtPacketBenchmark.conformance()
+    GbtPacketBenchmark.benchmark()
@@ -0,0 +1,147 @@
+'''
+GbtPacketBinary is a class that stores GBT packets in a compact binary format next to the text format of GBT packet files,
+where every 32-bit word takes a line "XXXXXXXX RR" of 12 bytes.
+
+A binary GBT packet file starts with an 8-byte header: the magic bytes "GBTB", a little-endian uint16 version and a uint16 of flags
+(bit 0 is set if the text file ends with the finish command line '00000001 01'). The header is followed by one 17-byte record per packet:
+four little-endian uint32 words and one uint8 region. Packets therefore take about a third of the space they take as text, and
+packet i is found at byte 8 + 17 * i.
+
+For instance::
+
+
+    # Converts a combined file to binary and back
+    GbtPacketBinary.text_to_binary("combined_GBT_packet_dir_test", "combined_GBT_packet_dir_test.gbtb")
+    GbtPacketBinary.binary_to_text("combined_GBT_packet_dir_test.gbtb", "combined_GBT_packet_dir_test_copy")
+
+    # Reads the binary file without copying it into memory
+    records, finished = GbtPacketBinary.read("combined_GBT_packet_dir_test.gbtb")
+    records["words"][10], records["region"][10]
+'''
+import os
+import struct
+import sys
+import numpy as np
+from PacketSink import CombinedFileSink
+
+
+class GbtPacketBinary:
+    '''
+    This is a class to write, read and convert binary GBT packet files.
+    '''
+    magic = b"GBTB"
+    version = 1
+    header_format = '<4sHH'             # magic, version, flags
+    header_size = struct.calcsize(header_format)
+    record_format = '<4IB'              # four words, region
+    record_dtype = np.dtype([('words', '<u4', (4,)), ('region', 'u1')])
+    finish_line = '00000001 01'
+
+    @staticmethod
+    def pack_header(finished):
+        '''
+        Returns the 8-byte header. finished tells whether the finish command line follows the packets.
+        '''
+        return struct.pack(GbtPacketBinary.header_format, GbtPacketBinary.magic, GbtPacketBinary.version, 1 if finished else 0)
+
+    @staticmethod
+    def pack_lines(lines):
+        '''
+        Converts lines of GBT packets "XXXXXXXX RR" (four lines per packet, without the finish command line) into binary records.
+
+        :param str lines: lines of GBT packets
+        :return bytes: 17 bytes per packet
+        '''
+        split = lines.split()
+        if len(split) % 8 != 0:
+            print("Lines of GBT packets are not in groups of four lines of 'XXXXXXXX RR'.")
+            sys.exit()
+
+        records = []
+        for i in range(0, len(split), 8):
+            region = split[i + 1]
+            if split[i + 3] != region or split[i + 5] != region or split[i + 7] != region:
+                print("Lines of one GBT packet have different regions: %s" % " ".join(split[i:i + 8]))
+                sys.exit()
+            records.append(struct.pack(GbtPacketBinary.record_format, int(split[i], 16), int(split[i + 2], 16),
+                                       int(split[i + 4], 16), int(split[i + 6], 16), int(region)))
+        return b"".join(records)
+
+    @staticmethod
+    def pack_text(text):
+        '''
+        Converts the whole content of a text GBT packet file, including an optional finish command line, into a binary file content.
+        '''
+        finished = text.endswith(GbtPacketBinary.finish_line)
+        if finished:
+            text = text[:-len(GbtPacketBinary.finish_line)]
+        return GbtPacketBinary.pack_header(finished) + GbtPacketBinary.pack_lines(text)
+
+    @staticmethod
+    def read(file_name):
+        '''
+        Maps a binary GBT packet file into memory with numpy.memmap without reading or copying it.
+
+        :param str file_name: binary GBT packet file
+        :return numpy.memmap, bool: records with fields "words" (N x 4 uint32) and "region" (N uint8), and whether the file is finished
+        '''
+        with open(file_name, 'rb') as f:
+            magic, version, flags = struct.unpack(GbtPacketBinary.header_format, f.read(GbtPacketBinary.header_size))
+        if magic != GbtPacketBinary.magic or version != GbtPacketBinary.version:
+            print("%s is not a binary GBT packet file of version %s." % (file_name, GbtPacketBinary.version))
+            sys.exit()
+
+        if os.path.getsize(file_name) == GbtPacketBinary.header_size:     # numpy.memmap can't map zero bytes
+            return np.zeros(0, dtype=GbtPacketBinary.record_dtype), bool(flags & 1)
+        records = np.memmap(file_name, dtype=GbtPacketBinary.record_dtype, mode='r', offset=GbtPacketBinary.header_size)
+        return records, bool(flags & 1)
+
+    @staticmethod
+    def format_records(records, finished=False):
+        '''
+        Converts binary records back into the text format of GBT packet files.
+        '''
+        lines = []
+        for words, region in zip(records["words"].tolist(), records["region"].tolist()):
+            add = str(region)
+            for word in words:
+                lines.append("%08X %s\n" % (word, add))
+        if finished:
+            lines.append(GbtPacketBinary.finish_line)
+        return "".join(lines)
+
+    @staticmethod
+    def text_to_binary(text_file, binary_file):
+        '''
+        Converts a text GBT packet file (single packet or combined) into a binary GBT packet file.
+        '''
+        with open(text_file, 'r') as f:
+            content = GbtPacketBinary.pack_text(f.read())
+        with open(binary_file, 'wb') as f:
+            f.write(content)
+
+    @staticmethod
+    def binary_to_text(binary_file, text_file):
+        '''
+        Converts a binary GBT packet file back into the text GBT packet file it was made from.
+        '''
+        records, finished = GbtPacketBinary.read(binary_file)
+        with open(text_file, 'w') as f:
+            f.write(GbtPacketBinary.format_records(records, finished))
+
+
+class BinaryFileSink(CombinedFileSink):
+    '''
+    Same as CombinedFileSink, but writes binary GBT packet files. The finish command line is stored as the header flag.
+    '''
+    def start_file(self, file_name):
+        out_file = open(file_name, 'wb')
+        out_file.write(GbtPacketBinary.pack_header(self.add_line))
+        out_file.write(GbtPacketBinary.pack_lines(self.head))
+        return out_file
+
+    def write_lines(self, out_file, lines):
+        out_file.write(GbtPacketBinary.pack_lines(lines))
+
+    def end_file(self, out_file):
+        out_file.close()
@@ -1,56 +1,62 @@
 '''
 GbtPacketChecker has two main functions. It can read a GBT packet before its simulation to check whether the intended hit data, which the user feeds in as an input, matches with the user's GBT packet data. GbtPacketChecker's second function includes determining and returning which planes, vmms, and channels are hit in a give GBT packet and comparing them  with the intended hit data. 
-Currently, GbtPacketChecker can only check mismatch of one GBT packet hit track within one region.
+A checker object checks one GBT packet file, and check_combined() checks every packet of a combined file against a manifest of expected hits.
+verify_tree() checks every combined file and GBT packet directory of a directory tree that has a manifest in a pool of worker processes.
 '''
 #!usr/bin/python3
 from collections import Counter
+import functools
+import math
 import GbtPacketMaker
+from GbtPacketBinary import GbtPacketBinary
+from HitGenerator import HitGenerator
+from HitSet import HitSet
+from PacketStats import stats, logger
 import random
 import itertools
+import numpy as np
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import sys
+import time
 
 
 class GbtPacketChecker:
+    decode_cache = None                         # least recently used cache of decode_payload(), see set_decode_cache()
+
     def __init__(self, directory, input_gbt):
         self.directory = directory
         self.input_gbt = input_gbt
+        self.decoded = None                     # (BCID, region, vmm's, channels, problems) once decode() is called
 
     @staticmethod
-    def simulate(make=False, dir_name='test', region=20, repeat=0):
+    def simulate(make=False, dir_name='test', region=20, repeat=0, seed=None):
         '''
-        Option 1: Prints hit track information by simulates a GBT packet by randomly generating a possible number of hit channels and hit track information.
-        Option 2: Generates a GBT packet with printed hit track information.
-        Recursive if asked to be repeated.::
+        Option 1: Simulates GBT packets by randomly generating a possible number of hit channels and hit track information with HitGenerator.
+        Option 2: Also generates a GBT packet file of each of them.
+        For many packets, use HitGenerator directly.::
 
-                # Generates five possible hit track
-                GbtPacketChecker.simulate(repeat=5)
+                # Generates six possible hit tracks
+                GbtPacketChecker.simulate(repeat=5, seed=1)
 
 
         :param False/bool/optional make: If True, makes an actual GBT packet in a directory
         :param "test"/string/optional dir_name: default value is "test" (path is then "./GBT_packet_dir_test" as path is "GBT_packet_dir_%s/" % dir_name )
         :param 20/int/optional region: region number
-        :param 0/int/optional repeat: number of packets to be simulated/generated
-        :return list, list: a list of vmm's hit and channels' hit in a format of [plane.vmm, ...], [channel_hit,...]
+        :param 0/int/optional repeat: number of packets to be simulated/generated in addition to the first one
+        :param None/int/optional seed: seed of the random generator to repeat the same packets
+        :return list, list: a list of vmm's hit and channels' hit of the first packet in a format of [plane.vmm, ...], [channel_hit,...]
         '''
-        vmm_list = []
-        channel_list = []
-        num_hit = random.choice(range(1, 8))
-        for i in range(num_hit):
-            vmm_random = random.choice(range(8))
-            pl_random = random.choice(range(4))
-            ch_random = random.choice(range(64))
-            vmm_list.append(pl_random + round(vmm_random * .1, 1))
-            channel_list.append(ch_random)
-
-        vmm_list, channel_list = zip(*sorted(zip(vmm_list, channel_list)))
-        vmm_list, channel_list = list(vmm_list), list(channel_list)
-        if make:
-            GbtPacketMaker(vmm_list, channel_list).make_gbt(32, region, dir_name, add_line=True) # True for adding the finish line
+        generator = HitGenerator(seed, regions=[region], distinct_vmm=False, bc_gap=0)
+        hit_sets = [hit_set for _, _, hit_set in HitGenerator.hit_sets(generator.generate(repeat + 1))]
+        for hit_set in hit_sets:
+            if make:
+                GbtPacketMaker.GbtPacketMaker(hit_set).make_gbt(32, region, dir_name, add_line=True) # True for adding the finish line
+            logger.debug("%s %s", hit_set.vmm_list(), hit_set.channel_list())
 
-        if repeat != 0:                                                  # recursive if asked to be repeated
-            GbtPacketChecker.simulate(make, repeat=repeat-1)
-
-        print(vmm_list, channel_list)
-        return vmm_list, channel_list
+        return hit_sets[0].vmm_list(), hit_sets[0].channel_list()
 
     @staticmethod
     def simulate_cable_swap(input_vmm_list):
@@ -61,8 +67,19 @@ class GbtPacketChecker:
             GbtPacketChecker.simulate_swap([0.5, 0.7, 2.1, 3.7])
 
 
+        :param list/HitSet input_vmm_list: [plane.vmm, ...] or a HitSet
         :return: a list of strings that explain cable swapping in a format of '<a list of original indices> ->  <a list of indices after swapping>'
+            and a list of swapped [plane.vmm, ...] lists, or of swapped HitSets if input_vmm_list is a HitSet
         '''
+        if isinstance(input_vmm_list, HitSet):
+            change_idx_list = []
+            sim_hit_sets = []
+            for each_comb in itertools.islice(itertools.permutations([0, 1, 2, 3]), 1, None):   # skips original order [0,1,2,3]
+                orig = [i for i in range(4) if each_comb[i] != i]
+                change_idx_list.append(str(orig) + "->" + str([each_comb[i] for i in orig]))
+                sim_hit_sets.append(HitSet.from_packed([each_comb[hit >> 9] << 9 | (hit & 511) for hit in input_vmm_list.hits]))
+            return change_idx_list, sim_hit_sets
+
         # input_vmm_list would be vmm_read or simulated
         # count how many fibers are swapped
         # find all possible swaps
@@ -101,10 +118,13 @@ class GbtPacketChecker:
     @staticmethod
     def track_pl_hit(input_pl_ls):                          # returns a dictionary of planes that have more than one hits
         '''
-        Builds and returns a dictionary of planes that have more than one hits
+        Builds and returns a dictionary of planes that have more than one hits from [plane.vmm, ...] or a HitSet
         :return dict: format - {pl: hit_counts, ...} e.g. if on the first plane, there are two hits, then {1: 2, ...}
         '''
-        pl_ls = [int(pl) for pl in input_pl_ls]
+        if isinstance(input_pl_ls, HitSet):
+            pl_ls = input_pl_ls.planes()
+        else:
+            pl_ls = [int(pl) for pl in input_pl_ls]
         count = Counter(pl_ls)
         multiple_hit_pl = {}
         for pl in list(set(pl_ls)):
@@ -112,6 +132,308 @@ class GbtPacketChecker:
                 multiple_hit_pl[pl] = count[pl]
         return multiple_hit_pl                  # {pl: count, ...}
 
+    @staticmethod
+    def fiber_hits(hit_set, region=None):
+        '''
+        Returns hits of a HitSet as [(fiber, vmm << 6 | channel), ...] for find_swaps(), where fiber is the plane,
+        or (region, plane) if region is given so that fibers of several regions can be searched together.
+        '''
+        if region is None:
+            return [(hit >> 9, hit & 511) for hit in hit_set.hits]
+        return [((region, hit >> 9), hit & 511) for hit in hit_set.hits]
+
+    @staticmethod
+    def fiber_signatures(hits, fibers):
+        '''
+        Returns {fiber: signature} where the signature of a fiber is the sorted tuple of its hits without the fiber, e.g. (4, 70) for
+        vmm 0 channel 4 and vmm 1 channel 6. A fiber without hits has the signature (). Two fibers can be swapped without changing a
+        packet exactly when their signatures are the same.
+        '''
+        signatures = dict((fiber, []) for fiber in fibers)
+        for fiber, hit in hits:
+            signatures[fiber].append(hit)
+        return dict((fiber, tuple(sorted(hit_list))) for fiber, hit_list in signatures.items())
+
+    @staticmethod
+    def swap_classes(intended, read, fibers=None):
+        '''
+        Groups fibers into classes of fibers that can replace each other in a swap that turns the intended hits into the hits read from
+        a GBT packet. Fibers are first compared by their numbers of hits (as in track_pl_hit()) and then indexed by signature
+        (see fiber_signatures()): a swap must send each intended fiber with hits to a read fiber with the same signature, so every
+        bijection between the intended and read fibers of a class is a swap and the classes are independent of each other.
+        Fibers without hits are not constrained by the packet and are left out of the classes. This works for any number of fibers,
+        e.g. 8 planes or the planes of several regions (see fiber_hits()).
+
+        :param HitSet/list intended: intended hits as a HitSet or [(fiber, hit), ...]
+        :param HitSet/list read: hits read from GBT packets in the same format
+        :param None/list/optional fibers: order of the fibers. Default is the sorted fibers of the hits.
+        :return list: [(intended fibers, read fibers), ...] of each signature in the order of the first intended fiber, or None if no swap fits
+        '''
+        if isinstance(intended, HitSet):
+            intended = GbtPacketChecker.fiber_hits(intended)
+        if isinstance(read, HitSet):
+            read = GbtPacketChecker.fiber_hits(read)
+        hit_fibers = set(fiber for fiber, _ in intended) | set(fiber for fiber, _ in read)
+        fibers = [fiber for fiber in (sorted(hit_fibers) if fibers is None else fibers) if fiber in hit_fibers]
+
+        if len(intended) != len(read) or Counter(Counter(fiber for fiber, _ in intended).values()) != Counter(Counter(fiber for fiber, _ in read).values()):
+            return None                                 # numbers of hits per fiber don't match up for any swap
+        intended_signatures = GbtPacketChecker.fiber_signatures(intended, fibers)
+        read_signatures = GbtPacketChecker.fiber_signatures(read, fibers)
+        index = {}                                      # signature -> read fibers with that signature
+        for fiber in fibers:
+            if read_signatures[fiber]:
+                index.setdefault(read_signatures[fiber], []).append(fiber)
+        groups = {}                                     # signature -> intended fibers with that signature
+        for fiber in fibers:
+            if intended_signatures[fiber]:
+                groups.setdefault(intended_signatures[fiber], []).append(fiber)
+        if any(len(index.get(signature, [])) != len(group) for signature, group in groups.items()):
+            return None
+        return [(tuple(group), tuple(index[signature])) for signature, group in groups.items()]
+
+    @staticmethod
+    def count_swaps(classes, fibers=None):
+        '''
+        Returns the number of swaps find_swaps() yields for classes of swap_classes() without listing them. If fibers is given, the
+        fibers without hits among them can be sent to each other in any order, which multiplies the count as in find_swaps().
+        '''
+        if classes is None:
+            return 0
+        count = 1
+        for group, targets in classes:
+            count *= math.factorial(len(group))
+        if fibers is not None:
+            count *= math.factorial(len(fibers) - sum(len(group) for group, _ in classes))
+        identity = all(set(group) == set(targets) for group, targets in classes)
+        return count - 1 if identity else count
+
+    @staticmethod
+    def find_swaps(intended, read, fibers=None):
+        '''
+        Yields every swap of fibers that turns the intended hits into the hits read from a GBT packet, one at a time, built from the
+        classes of swap_classes(). Each swap is completed into a permutation of all fibers by sending the intended fibers without hits
+        to the read fibers without hits in every order. Use count_swaps(swap_classes(...), fibers) for the number of swaps, which grows
+        with the factorial of the class sizes::
+
+
+                # Yields {0: 0, 1: 2, 2: 1, 3: 3}: cables of planes 1 and 2 are swapped
+                list(GbtPacketChecker.find_swaps(HitSet.from_floats([0.1, 1.2, 2.3, 3.4],[1, 2, 3, 4]),
+                                                 HitSet.from_floats([0.1, 1.3, 2.2, 3.4],[1, 3, 2, 4]), [0, 1, 2, 3]))
+
+
+        :param HitSet/list intended: Look swap_classes documentation.
+        :param HitSet/list read: Look swap_classes documentation.
+        :param None/list/optional fibers: Look swap_classes documentation.
+        :return: generator of {intended fiber: read fiber} of every fiber for every swap except the identity, in the order of
+            itertools.permutations of each class
+        '''
+        if isinstance(intended, HitSet):
+            intended = GbtPacketChecker.fiber_hits(intended)
+        if isinstance(read, HitSet):
+            read = GbtPacketChecker.fiber_hits(read)
+        classes = GbtPacketChecker.swap_classes(intended, read, fibers)
+        if classes is None:
+            return
+        if fibers is None:
+            fibers = sorted(set(fiber for fiber, _ in intended) | set(fiber for fiber, _ in read))
+        groups = set(fiber for group, _ in classes for fiber in group)
+        targets = set(fiber for _, target in classes for fiber in target)
+        empty = (tuple(fiber for fiber in fibers if fiber not in groups), tuple(fiber for fiber in fibers if fiber not in targets))
+        for swap in GbtPacketChecker.class_bijections(classes + [empty]):
+            if any(target != fiber for fiber, target in swap.items()):
+                yield swap
+
+    @staticmethod
+    def class_bijections(classes):
+        '''
+        Yields {intended fiber: read fiber} of every combination of bijections within classes of swap_classes(). Unlike
+        itertools.product(), the permutations of a class are not stored, so only the current swap is kept in memory.
+        '''
+        if len(classes) == 0:
+            yield {}
+            return
+        group, targets = classes[0]
+        for permutation in itertools.permutations(targets):
+            for rest in GbtPacketChecker.class_bijections(classes[1:]):
+                swap = dict(zip(group, permutation))
+                swap.update(rest)
+                yield swap
+
+    @staticmethod
+    def swap_string(swap, fibers=(0, 1, 2, 3)):
+        '''
+        Describes a swap of find_swaps() like simulate_cable_swap(), e.g. "[1, 2]->[2, 1]".
+        '''
+        orig = [fiber for fiber in fibers if swap.get(fiber, fiber) != fiber]
+        return str(orig) + "->" + str([swap[fiber] for fiber in orig])
+
+    @staticmethod
+    def read_hit_sets(path, bc_delay=0, report=None):
+        '''
+        Yields (BCID, region, HitSet, problems) of every packet of a combined file (without its delay packets) or of the GBT packet files
+        of a directory, ordered by BC ID and region. HitSet is None if a packet can't be decoded into a HitSet. The files of a directory
+        are ordered by their first packet like GbtPacketMaker.file_packets(), and packets out of order in a combined file are left out
+        like in check_combined().
+
+        :param str path: combined file, or directory ending with "/"
+        :param 0/int/optional bc_delay: Look check_combined documentation.
+        :param None/dict/optional report: report of check_combined() where scan_combined() records the packets left out of a combined file
+        '''
+        if os.path.isdir(path):
+            index = []
+            for name in os.listdir(path):
+                packet = next(GbtPacketChecker.iter_packets(os.path.join(path, name)), None)
+                if packet is not None:
+                    index.append((packet[0][0] & 0xFFF, packet[1], GbtPacketMaker.GbtPacketMaker.alphanumeric_key(name), name))
+            index.sort()
+            for _, _, _, name in index:
+                for packet in GbtPacketChecker.iter_packets(os.path.join(path, name)):
+                    if packet is None:
+                        continue
+                    if len(packet[0]) != 4:
+                        yield packet[0][0] & 0xFFF, packet[1], None, ["The file ends after %s words of a packet." % len(packet[0])]
+                        continue
+                    BCID, vmms, channels, problems = GbtPacketChecker.decode_words(packet[0])
+                    yield BCID, packet[1], GbtPacketChecker.to_hit_set(vmms, channels), problems
+            return
+
+        if report is None:
+            report = {"file": path, "packets": 0, "expected": 0, "matched": 0, "finished": False, "mismatches": []}
+        for packet in GbtPacketChecker.scan_combined(path, report, bc_delay):
+            yield packet
+
+    @staticmethod
+    def diagnose_swaps(path, expected, bc_delay=0, chunk_size=65536):
+        '''
+        Scores every swap of the four plane cables of each region against all packets of a combined file or directory at once.
+        Packets are joined with the expected packets by BC ID and region in one pass like in check_combined(), and the packed hits of
+        each region are scored chunk_size packets at a time, so memory does not grow with the packets. Each of the 24 permutations of
+        planes is applied to the intended hits of a chunk with NumPy, and a packet supports a permutation if the permuted intended hits
+        equal the hits read. Unlike identify_swaps(), nothing is printed and exit() is never called::
+
+
+                GbtPacketMaker.GbtPacketMaker.vertical_pattern("upper", [20, 21], 4)
+                diagnosis = GbtPacketChecker.diagnose_swaps("combined_GBT_packet_dir_vert_upper_[20, 21]_offset4_bc_delay_0_gap_32_0_bc_gap_pl_1",
+                                                            GbtPacketMaker.GbtPacketMaker.vertical_hits("upper", [20, 21], 4))
+                print(GbtPacketChecker.format_diagnosis(diagnosis))
+
+
+        :param str path: combined file, or directory ending with "/"
+        :param iterable expected: (BCID, region, HitSet) of the intended packets like in check_combined()
+        :param 0/int/optional bc_delay: Look check_combined documentation.
+        :param 65536/int/optional chunk_size: number of packets of a region scored at a time, which limits memory to about 24 * 8 * chunk_size hits
+        :return list: {"region", "swap", "swap_string", "support", "packets", "undecoded", "unpaired", "unexpected", "consistent"} of
+            every permutation with support, ranked by region and then by support. swap is {intended plane: read plane}, support is the
+            number of packets that fit the swap, packets is the number of packets of the region paired with a packet read, undecoded is
+            the number of packets read that can't be decoded into hits (they fit no swap), unpaired is the number of intended packets
+            without exactly one packet read for each, unexpected is the number of packets read at a BC ID and region without intended
+            packets or out of the order of the file, and consistent is True if every packet fits and no packet is undecoded, unpaired or
+            unexpected. A region where no packet fits any swap has one entry with swap None and support 0.
+        '''
+        permutations = np.array(list(itertools.permutations(range(4))), dtype=np.int32)   # (24, 4), identity first
+        regions = {}                                    # region -> {"intended", "read": packed hits of the chunk, "support", counts}
+
+        def region_counts(region):
+            if region not in regions:
+                regions[region] = {"intended": [], "read": [], "support": np.zeros(len(permutations), dtype=np.int64),
+                                   "packets": 0, "undecoded": 0, "unpaired": 0, "unexpected": 0}
+            return regions[region]
+
+        report = {"file": path, "packets": 0, "expected": 0, "matched": 0, "finished": False, "mismatches": []}
+        key = lambda packet: (packet[0], packet[1])
+        found_groups = itertools.groupby(GbtPacketChecker.read_hit_sets(path, bc_delay, report), key)
+        expected_groups = itertools.groupby(expected, key)
+        found_key, found_packets = next(found_groups, (None, None))
+        expected_key, expected_packets = next(expected_groups, (None, None))
+        while found_key is not None or expected_key is not None:
+            if found_key is not None and (expected_key is None or found_key < expected_key):
+                region_counts(found_key[1])["unexpected"] += sum(1 for _ in found_packets)
+                found_key, found_packets = next(found_groups, (None, None))
+                continue
+            counts = region_counts(expected_key[1])
+            intended = [packet[2] for packet in expected_packets]
+            found = [packet[2] for packet in found_packets] if found_key == expected_key else []
+            if len(found) != len(intended):             # packets of the same BC ID and region can only be paired one to one
+                counts["unpaired"] += len(intended)
+            else:
+                for intended_hit_set, read_hit_set in zip(intended, found):
+                    counts["packets"] += 1
+                    if read_hit_set is None:
+                        counts["undecoded"] += 1
+                        continue
+                    counts["intended"].append(intended_hit_set.hits)
+                    counts["read"].append(read_hit_set.hits)
+                if len(counts["intended"]) >= chunk_size:
+                    counts["support"] += GbtPacketChecker.score_swaps(counts["intended"], counts["read"], permutations)
+                    counts["intended"], counts["read"] = [], []
+            if found_key == expected_key:
+                found_key, found_packets = next(found_groups, (None, None))
+            expected_key, expected_packets = next(expected_groups, (None, None))
+        for mismatch in report["mismatches"]:           # packets scan_combined() left out of a combined file
+            if mismatch["kind"] in ("order", "after finish"):
+                region_counts(mismatch["region"])["unexpected"] += 1
+            elif mismatch["kind"] == "incomplete":
+                region_counts(mismatch["region"])["undecoded"] += 1
+
+        diagnosis = []
+        for region in sorted(regions):
+            counts = regions[region]
+            if counts["intended"]:
+                counts["support"] += GbtPacketChecker.score_swaps(counts["intended"], counts["read"], permutations)
+            entry = {"region": region, "packets": counts["packets"], "undecoded": counts["undecoded"], "unpaired": counts["unpaired"],
+                     "unexpected": counts["unexpected"]}
+            complete = counts["undecoded"] == 0 and counts["unpaired"] == 0 and counts["unexpected"] == 0
+            ranked = [i for i in np.argsort(-counts["support"], kind="stable") if counts["support"][i] > 0]
+            for i in ranked:
+                swap = dict((plane, int(permutations[i][plane])) for plane in range(4))
+                diagnosis.append(dict(entry, swap=swap, swap_string=GbtPacketChecker.swap_string(swap), support=int(counts["support"][i]),
+                                      consistent=int(counts["support"][i]) == counts["packets"] and complete))
+            if not ranked:
+                diagnosis.append(dict(entry, swap=None, swap_string=None, support=0, consistent=False))
+        return diagnosis
+
+    @staticmethod
+    def score_swaps(intended_hits, read_hits, permutations):
+        '''
+        Returns the number of packets that fit each permutation of planes, given the HitSet.hits arrays of intended and read packets.
+        '''
+        pad = np.int32(1 << 12)                         # larger than any packed hit
+        intended = GbtPacketChecker.pad_hits(intended_hits, pad)   # (N, 8)
+        found = GbtPacketChecker.pad_hits(read_hits, pad)
+        is_hit = intended != pad
+        plane = np.where(is_hit, intended >> 9, 0)
+        swapped = np.where(is_hit, permutations[:, plane] << 9 | (intended & 511), pad)     # (24, N, 8)
+        swapped.sort(axis=2)
+        return (swapped == found).all(axis=2).sum(axis=1)
+
+    @staticmethod
+    def pad_hits(hits_list, pad):
+        '''
+        Returns an (N, 8) int32 array of the sorted packed hits of N HitSet.hits arrays, padded with pad.
+        '''
+        padded = np.full((len(hits_list), 8), pad, dtype=np.int32)
+        for i, hits in enumerate(hits_list):
+            padded[i, :len(hits)] = hits
+        return padded
+
+    @staticmethod
+    def format_diagnosis(diagnosis):
+        '''
+        Returns the result of diagnose_swaps() as text, e.g. "region 20: [1, 2]->[2, 1] fits 250/256 packets, 6 undecoded".
+        '''
+        lines = []
+        for hypothesis in diagnosis:
+            if hypothesis["swap"] is None:
+                name = "no permutation"
+            else:
+                name = "no swap" if hypothesis["swap_string"] == "[]->[]" else hypothesis["swap_string"]
+            unmatched = ["%s %s" % (hypothesis[kind], kind) for kind in ("undecoded", "unpaired", "unexpected") if hypothesis[kind]]
+            lines.append("region %s: %s fits %s/%s packets%s%s" % (hypothesis["region"], name, hypothesis["support"], hypothesis["packets"],
+                                                                  "".join(", " + text for text in unmatched),
+                                                                  " (consistent)" if hypothesis["consistent"] else ""))
+        return "\n".join(lines)
+
     def extract(self):
         '''
         Extracts specific bits and make them into corresponding lists of Hit Map, ART data, and region number.
@@ -128,34 +450,156 @@ class GbtPacketChecker:
         region = copy[0][-2:]
         return hitmap, artdata, region
 
+    @staticmethod
+    def decode_payload(word1, word2, word3):
+        '''
+        Decodes the three words after the header of a GBT packet with shifts and masks; the inverse of GbtPacketMaker.pack_words().
+        Hit vmm's are the set bits of Hit Map in ascending order, i.e. sorted by plane and vmm like the hits of GbtPacketMaker.
+        The number of channels is read from ART data and parity together, so a hit on channel 0 (ART code 000000, parity bit 1) is not lost.
+        Error byte and parity bits are validated::
+
+
+                # Returns ((0, 4, 13, 22, 31), (1, 2, 4, 8, 13), ())
+                GbtPacketChecker.decode_payload(0x00804020, 0x11000000, 0x0D204081)
+
+
+        :param int word1: second word of the packet
+        :param int word2: third word of the packet
+        :param int word3: fourth word of the packet
+        :return tuple, tuple, tuple: hit vmm's as plane * 8 + vmm, hit channels and messages of problems found (empty if the packet is valid)
+        '''
+        error = word1 >> 24
+        hit_map = (word1 & 0xFFFFFF) << 8 | word2 >> 24
+        parity = (word2 >> 16) & 0xFF
+        art_data = (word2 & 0xFFFF) << 32 | word3
+
+        vmms = tuple(bit for bit in range(32) if hit_map >> bit & 1)
+        num_channels = max((art_data.bit_length() + 5) // 6, parity.bit_length())  # last hit has a non-zero code or parity bit 1
+        channels = tuple((art_data >> (6 * i)) & 63 for i in range(num_channels))
+
+        problems = []
+        if error != 0:
+            problems.append("Error byte is %02X instead of 00." % error)
+        if num_channels > 8:
+            problems.append("ART data has %s channels, but at most 8 fit into a GBT packet." % num_channels)
+        parity_table = GbtPacketMaker.GbtPacketMaker.parity_table
+        for i in range(num_channels):
+            if parity >> i & 1 != parity_table[channels[i]]:
+                problems.append("Parity bit %s is %s, but channel %s has parity %s." % (i, parity >> i & 1, channels[i], parity_table[channels[i]]))
+        if len(vmms) != num_channels:
+            problems.append("Hit Map has %s vmm's, but ART data has %s channels." % (len(vmms), num_channels))
+        return vmms, channels, tuple(problems)
+
+    @staticmethod
+    def decode_words(words):
+        '''
+        Decodes the four 32-bit words of a GBT packet. Same as decode_payload(), but the header is also read and validated.
+
+        :param list words: four words e.g. [0x0000A020, 0x00804020, 0x11000000, 0x0D204081]
+        :return int, tuple, tuple, tuple: BC ID, hit vmm's as plane * 8 + vmm, hit channels and problems
+        '''
+        header = words[0]
+        decode = GbtPacketChecker.decode_cache or GbtPacketChecker.decode_payload
+        vmms, channels, problems = decode(words[1], words[2], words[3])
+        if header >> 12 != 0xA:
+            problems = ("Header %08X does not start with 0000A." % header,) + problems
+        return header & 0xFFF, vmms, channels, problems
+
+    @staticmethod
+    def set_decode_cache(size=4096):
+        '''
+        Sets the size of the least recently used cache of decode_payload() that decode_words() and every decoder built on it use.
+        Patterns repeat the same hits at different BC ID's, so the payload words after the header repeat too. The cache is cleared.
+
+        :param 4096/int/optional size: maximum number of payloads kept. 0 disables the cache and None keeps every payload.
+        '''
+        GbtPacketChecker.decode_cache = None if size == 0 else functools.lru_cache(maxsize=size)(GbtPacketChecker.decode_payload)
+
+    @staticmethod
+    def decode_cache_info():
+        '''
+        Returns statistics of the decode cache as {"hits", "misses", "size", "max_size", "enabled"}.
+        '''
+        if GbtPacketChecker.decode_cache is None:
+            return {"hits": 0, "misses": 0, "size": 0, "max_size": 0, "enabled": False}
+        info = GbtPacketChecker.decode_cache.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize, "enabled": True}
+
+    @staticmethod
+    def to_hit_set(vmms, channels):
+        '''
+        Pairs decoded hit vmm's and channels into a HitSet. Returns None if their numbers are different.
+        '''
+        if len(vmms) != len(channels):
+            return None
+        return HitSet.from_packed([vmm << 6 | channel for vmm, channel in zip(vmms, channels)])   # vmm is plane * 8 + vmm
+
+    @staticmethod
+    def check_decoder(num_cases=10000, seed=0):
+        '''
+        Checks that the decoder inverts GbtPacketMaker.encode() for every single hit (32 vmm's x 64 channels), for channels 0 and 63
+        on every position of every number of hits, and for num_cases random packets of 1 to 8 hits on different vmm's.
+        The code exits at the first packet that does not round trip::
+
+
+                GbtPacketChecker.check_decoder()
+
+
+        :return bool: True if all cases round trip
+        '''
+        rng = random.Random(seed)
+        cases = [[(vmm, channel)] for vmm in range(32) for channel in range(64)]
+        for num_hit in range(1, 9):
+            for pos in range(num_hit):
+                for channel in [0, 63]:
+                    hits = [(vmm, rng.randrange(64)) for vmm in sorted(rng.sample(range(32), num_hit))]
+                    hits[pos] = (hits[pos][0], channel)
+                    cases.append(hits)
+        for _ in range(num_cases):
+            cases.append([(vmm, rng.randrange(64)) for vmm in rng.sample(range(32), rng.randint(1, 8))])
+
+        for hits in cases:
+            hit_set = HitSet.from_packed([vmm << 6 | channel for vmm, channel in hits])
+            BCID = rng.randrange(4096)
+            BCID_read, vmms, channels, problems = GbtPacketChecker.decode_words(GbtPacketMaker.GbtPacketMaker(hit_set).encode(BCID))
+            if BCID_read != BCID or problems or GbtPacketChecker.to_hit_set(vmms, channels) != hit_set:
+                print("Decoder does not invert the encoder for %s at BC %s: %s %s %s %s" % (hit_set, BCID, BCID_read, vmms, channels, problems))
+                sys.exit()
+
+        print("Decoder inverts the encoder for %s cases." % len(cases))
+        return True
+
+    def read_words(self):
+        '''
+        Reads the four 32-bit words and the region of the GBT packet file.
+        :return list, int: [header, word1, word2, word3], region
+        '''
+        with open(self.directory + self.input_gbt, 'r') as f:
+            lines = [line for line in f.read().split("\n") if line and line != '00000001 01']
+        if len(lines) < 4:
+            print("%s does not have a whole GBT packet." % (self.directory + self.input_gbt))
+            sys.exit()
+        return [int(line[0:8], 16) for line in lines[:4]], int(lines[0][9:])
+
+    def decode(self):
+        '''
+        Reads and decodes the GBT packet once; later calls return the same result.
+        :return int, int, tuple, tuple, tuple: BC ID, region, hit vmm's as plane * 8 + vmm, hit channels, problems
+        '''
+        if self.decoded is None:
+            words, region = GbtPacketChecker.read_words(self)
+            BCID, vmms, channels, problems = GbtPacketChecker.decode_words(words)
+            self.decoded = (BCID, region, vmms, channels, problems)
+        return self.decoded
+
     def read_hitmap(self):
         '''
         Converts Hit Map into a list that contains information about planes and vmm's hit
         :return list: a list in a format [plane.vmm,...]
         e.g. Returns [0.2, 2.1] when the third vmm of the first plane and the second vmm of the third plane are hit.
         '''
-        hitmap, _, _ = GbtPacketChecker.extract(self)
-        hitmap_bin =[]
-        for each in hitmap:                                 # converts hexadecimal digits to integer to binary
-            temp = str(bin(int(each, 16))[2:])
-            if len(temp) == 4:
-                hitmap_bin.append(temp)
-            else:
-                hitmap_bin.append(((4-len(temp))*"0"+temp))
-
-        hitmap_pl = GbtPacketMaker.GbtPacketMaker.chunky(hitmap_bin, 2)     # consolidates into groups of two sets of four digits
-        hitmap_ls = []
-        for each in hitmap_pl:                              # e.g. ['00000100', '00000100', '00000101', '00000100']
-            hitmap_ls.append(''.join(map(str, each)))
-
-        hitmap_read = []
-        for i in range(len(hitmap_ls)):                     # [3.2, 2.2, 1.2, 1.0, 0.2]
-            for j in range(len(hitmap_ls[i])):
-                if hitmap_ls[i][j] != '0':
-                    hitmap_read.append((3-i)+round(.1*(7-j), 1))  # reverses the list
-
-        hitmap_read.sort()
-        return hitmap_read                                  # returns lists of hit vmm's and number of hits
+        vmms = GbtPacketChecker.decode(self)[2]
+        return [round((vmm >> 3) + (vmm & 7) * .1, 1) for vmm in vmms]
 
     def read_artdata(self):                                 # reads and converts ART data
         '''
@@ -163,29 +607,391 @@ class GbtPacketChecker:
         :return list: [channel_hit, ...]
         e.g. Returns [37, 28] when channel numbers 37 and 28 are hit.
         '''
-        _, artdata, _ = GbtPacketChecker.extract(self)
-        artdata_int = []
-        artdata_dig = []
-        for each in artdata:
-            artdata_int.append(int(each, 16))
-            artdata_dig.append(bin(int(each, 16))[2:].zfill(4))
+        return list(GbtPacketChecker.decode(self)[3])
+
+    def read_hit_set(self):
+        '''
+        Returns hits of the GBT packet as a HitSet, or None if Hit Map and ART data have different numbers of hits.
+        '''
+        _, _, vmms, channels, _ = GbtPacketChecker.decode(self)
+        return GbtPacketChecker.to_hit_set(vmms, channels)
+
+    @staticmethod
+    def iter_packets(file_name):
+        '''
+        Yields ([header, word1, word2, word3], region) of each packet of a text or binary (GbtPacketBinary) GBT packet file
+        one at a time, and None for the finish command line, so memory does not grow with the file.
+        The last packet has fewer than four words if the file ends in the middle of a packet.
+        '''
+        with open(file_name, 'rb') as f:
+            binary = f.read(len(GbtPacketBinary.magic)) == GbtPacketBinary.magic
+        if binary:
+            records, finished = GbtPacketBinary.read(file_name)
+            for words, region in zip(records["words"].tolist(), records["region"].tolist()):
+                yield words, region
+            if finished:
+                yield None
+            return
 
-        if artdata_dig[0] =='0000':
-            for i in range(len(artdata_dig)-1):
-                if artdata_dig[i+1] != '0000':
-                    artdata_dig = artdata_dig[i+1:]
-                    break
+        with open(file_name, 'r') as f:
+            words = []
+            region = None
+            for line in f:
+                if len(words) == 0 and line.startswith('00000001 01'):
+                    yield None
+                    continue
+                if len(words) == 0:
+                    region = int(line[9:])
+                words.append(int(line[0:8], 16))
+                if len(words) == 4:
+                    yield words, region
+                    words = []
+            if words:
+                yield words, region
 
-        artdata = "".join(artdata_dig)
-        if len(artdata) % 6 != 0:
-                artdata = "0"*(6-(len(artdata)%6)) + artdata
+    @staticmethod
+    def scan_combined(file_name, report, bc_delay=0):
+        '''
+        Yields (BCID, region, HitSet, problems) of each packet of a combined file for check_combined(). Delay packets, packets out of
+        the order of BC ID and region, incomplete packets, packets after the finish command line and a missing finish command line are
+        recorded in report["mismatches"] instead of being yielded. HitSet is None if Hit Map and ART data have different numbers of hits.
+        '''
+        mismatches = report["mismatches"]
+        delay_hit_set = HitSet([0], [0], [0])
+        delay_regions = [20, 21] if bc_delay != 0 else []
+        last_key = None
+        for packet in GbtPacketChecker.iter_packets(file_name):
+            if packet is None:
+                report["finished"] = True
+                continue
+            report["packets"] += 1
+            words, region = packet
+            if len(words) != 4:
+                mismatches.append({"kind": "incomplete", "BCID": words[0] & 0xFFF, "region": region, "expected": [], "found": [],
+                                   "problems": ["The file ends after %s words of a packet." % len(words)]})
+                continue
+
+            BCID, vmms, channels, problems = GbtPacketChecker.decode_words(words)
+            hit_set = GbtPacketChecker.to_hit_set(vmms, channels)
+            if report["finished"]:
+                mismatches.append({"kind": "after finish", "BCID": BCID, "region": region, "expected": [], "found": [hit_set], "problems": list(problems)})
+                continue
+            if delay_regions:                           # the first packets are the delay packets of regions 20 and 21
+                if (BCID, region, hit_set) != (bc_delay, delay_regions[0], delay_hit_set) or problems:
+                    mismatches.append({"kind": "delay", "BCID": BCID, "region": region, "expected": [delay_hit_set], "found": [hit_set],
+                                       "problems": ["Expected the delay packet at BC %s region %s." % (bc_delay, delay_regions[0])] + list(problems)})
+                delay_regions.pop(0)
+                continue
+            if last_key is not None and (BCID, region) < last_key:
+                mismatches.append({"kind": "order", "BCID": BCID, "region": region, "expected": [], "found": [hit_set],
+                                   "problems": ["Packet comes after BC %s region %s." % last_key] + list(problems)})
+                continue
+            last_key = (BCID, region)
+            if problems:
+                mismatches.append({"kind": "invalid", "BCID": BCID, "region": region, "expected": [], "found": [hit_set], "problems": list(problems)})
+            yield BCID, region, hit_set, problems
 
-        artdata_six = [artdata[i: i+6] for i in range(0, len(artdata), 6)]
-        artdata_read = [int(artdata_six[i], 2) for i in range(len(artdata_six))]
-        artdata_read.reverse()
-        return artdata_read
+        if not report["finished"]:
+            mismatches.append({"kind": "unfinished", "BCID": None, "region": None, "expected": [], "found": [],
+                               "problems": ["The file does not end with the finish command line '00000001 01'."]})
 
-    def check(self, hitmap_expected, artdata_expected, print_suppress=False, swap=False):      # checks if hit map and art data are correct
+    @staticmethod
+    def check_combined(file_name, expected, bc_delay=0):
+        '''
+        Checks every packet of a combined file against a manifest of expected packets in one pass over the file. Packets of the file and
+        the manifest are joined by BC ID and region, which both come in ascending order, so only the packets of one BC ID and region are
+        in memory at a time. The manifest can be the generator of the pattern or a file read by read_manifest()::
+
+
+                # Checks a vertical pattern against the hits it was made from
+                GbtPacketMaker.GbtPacketMaker.vertical_pattern("upper", [20, 21], 4, bc_delay=800)
+                report = GbtPacketChecker.check_combined("combined_GBT_packet_dir_vert_upper_[20, 21]_offset4_bc_delay_800_gap_32_0_bc_gap_pl_1",
+                                                         GbtPacketMaker.GbtPacketMaker.vertical_hits("upper", [20, 21], 4), bc_delay=800)
+                print(GbtPacketChecker.format_report(report))
+
+
+        :param str file_name: text or binary combined file
+        :param iterable expected: (BCID, region, HitSet) of the expected packets, ordered by BC ID and region, without delay packets
+        :param 0/int/optional bc_delay: BC ID of the delay packets at the start of the file (second combined files start with them too). 0 if the file has no delay packets.
+        :return dict: {"file", "packets", "expected", "matched", "finished", "mismatches"} where each mismatch is
+            {"kind", "BCID", "region", "expected", "found", "problems"} and kind is "missing", "unexpected", "different", "invalid",
+            "order", "delay", "incomplete", "after finish" or "unfinished"
+        '''
+        start = time.perf_counter()
+        report = GbtPacketChecker.compare_combined(file_name, expected, bc_delay)
+        stats.add("check", packets=report["packets"], bytes=os.path.getsize(file_name), files=1, seconds=time.perf_counter() - start)
+        return report
+
+    @staticmethod
+    def compare_combined(file_name, expected, bc_delay=0):
+        '''
+        Returns the report of check_combined() without adding to stats, for verify_tree() which records the stats of all its checks itself.
+        '''
+        report = {"file": file_name, "packets": 0, "expected": 0, "matched": 0, "finished": False, "mismatches": []}
+        mismatches = report["mismatches"]
+        key = lambda packet: (packet[0], packet[1])
+        found_groups = itertools.groupby(GbtPacketChecker.scan_combined(file_name, report, bc_delay), key)
+        expected_groups = itertools.groupby(expected, key)
+        found_key, found_packets = next(found_groups, (None, None))
+        expected_key, expected_packets = next(expected_groups, (None, None))
+        while found_key is not None or expected_key is not None:
+            if found_key is not None and (expected_key is None or found_key < expected_key):
+                mismatches.append({"kind": "unexpected", "BCID": found_key[0], "region": found_key[1], "expected": [],
+                                   "found": [packet[2] for packet in found_packets], "problems": []})
+                found_key, found_packets = next(found_groups, (None, None))
+            elif found_key is None or expected_key < found_key:
+                hit_sets = [packet[2] for packet in expected_packets]
+                report["expected"] += len(hit_sets)
+                mismatches.append({"kind": "missing", "BCID": expected_key[0], "region": expected_key[1], "expected": hit_sets, "found": [], "problems": []})
+                expected_key, expected_packets = next(expected_groups, (None, None))
+            else:
+                hit_sets = [packet[2] for packet in expected_packets]
+                found = [packet[2] for packet in found_packets]
+                report["expected"] += len(hit_sets)
+                if Counter(hit_sets) == Counter(found):
+                    report["matched"] += len(found)
+                else:
+                    mismatches.append({"kind": "different", "BCID": found_key[0], "region": found_key[1], "expected": hit_sets, "found": found, "problems": []})
+                found_key, found_packets = next(found_groups, (None, None))
+                expected_key, expected_packets = next(expected_groups, (None, None))
+        return report
+
+    @staticmethod
+    def format_report(report):
+        '''
+        Returns a report of check_combined() as text with one line per mismatch, e.g. "BC 64 region 21: different, expected [...] found [...]".
+        '''
+        lines = ["%s: %s packets, %s expected, %s matched, %s mismatches" % (report["file"], report["packets"], report["expected"],
+                                                                            report["matched"], len(report["mismatches"]))]
+        for mismatch in report["mismatches"]:
+            lines.append("BC %s region %s: %s, expected %s found %s %s" % (mismatch["BCID"], mismatch["region"], mismatch["kind"],
+                                                                       mismatch["expected"], mismatch["found"], " ".join(mismatch["problems"])))
+        return "\n".join(lines)
+
+    @staticmethod
+    def write_manifest(packets, file_name, bc_delay=0):
+        '''
+        Writes expected packets (BCID, region, HitSet), e.g. from GbtPacketMaker.vertical_hits(), into a manifest file for check_combined().
+        The file is JSON if file_name ends with ".json", i.e. {"bc_delay": 0, "packets": [{"BCID": 32, "region": 20, "vmm": [0.0, 0.4], "channel": [1, 2]}, ...]},
+        and CSV otherwise with rows of BCID, region, vmm's and channels separated by spaces, i.e. 32,20,0.0 0.4,1 2
+        bc_delay of the delay packets of a combined file is kept in the JSON object or in a first CSV line "# bc_delay=800".
+        '''
+        if file_name.endswith(".json"):
+            with open(file_name, 'w') as f:
+                json.dump({"bc_delay": bc_delay, "packets": [{"BCID": BCID, "region": region, "vmm": hit_set.vmm_list(), "channel": hit_set.channel_list()}
+                                                             for BCID, region, hit_set in packets]}, f)
+            return
+
+        with open(file_name, 'w', newline='') as f:
+            if bc_delay != 0:
+                f.write("# bc_delay=%s\n" % bc_delay)
+            writer = csv.writer(f)
+            writer.writerow(["BCID", "region", "vmm", "channel"])
+            for BCID, region, hit_set in packets:
+                writer.writerow([BCID, region, " ".join(map(str, hit_set.vmm_list())), " ".join(map(str, hit_set.channel_list()))])
+
+    @staticmethod
+    def read_manifest(file_name):
+        '''
+        Yields (BCID, region, HitSet) of the expected packets of a manifest file written by write_manifest(). CSV files are read row by row.
+        '''
+        if file_name.endswith(".json"):
+            with open(file_name, 'r') as f:
+                packets = json.load(f)
+            for packet in packets["packets"] if isinstance(packets, dict) else packets:
+                yield packet["BCID"], packet["region"], HitSet.from_floats(packet["vmm"], packet["channel"])
+            return
+
+        with open(file_name, 'r', newline='') as f:
+            reader = csv.reader(line for line in f if not line.startswith("#"))
+            next(reader)                                # header row
+            for BCID, region, vmms, channels in reader:
+                yield int(BCID), int(region), HitSet.from_floats([float(vmm) for vmm in vmms.split()], [int(channel) for channel in channels.split()])
+
+    @staticmethod
+    def read_manifest_delay(file_name):
+        '''
+        Returns bc_delay kept in a manifest file by write_manifest(), or 0.
+        '''
+        with open(file_name, 'r') as f:
+            if file_name.endswith(".json"):
+                manifest = json.load(f)
+                return manifest.get("bc_delay", 0) if isinstance(manifest, dict) else 0
+            first = f.readline()
+        return int(first.split("=")[1]) if first.startswith("# bc_delay=") else 0
+
+    @staticmethod
+    def manifest_target(manifest_file):
+        '''
+        Returns the combined file or GBT packet directory a manifest belongs to: a manifest is named after it with ".manifest.csv"
+        or ".manifest.json" added, e.g. "combined_GBT_packet_dir_test.manifest.csv" or "GBT_packet_dir_test.manifest.csv".
+        Returns None if the file is not a manifest.
+        '''
+        for suffix in [".manifest.csv", ".manifest.json"]:
+            if manifest_file.endswith(suffix):
+                return manifest_file[:-len(suffix)]
+        return None
+
+    @staticmethod
+    def verify_combined(task):
+        '''
+        Checks one combined file against its manifest in a worker process of verify_tree().
+
+        :param tuple task: (combined file, manifest file)
+        :return dict: report of check_combined() with "manifest" and "seconds" added
+        '''
+        target, manifest = task
+        start = time.perf_counter()
+        report = GbtPacketChecker.compare_combined(target, GbtPacketChecker.read_manifest(manifest), GbtPacketChecker.read_manifest_delay(manifest))
+        report["manifest"] = manifest
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+    @staticmethod
+    def read_directory(task):
+        '''
+        Decodes GBT packet files of a directory in a worker process of verify_tree().
+
+        :param tuple task: (directory, [file name, ...])
+        :return list: (file name, BCID, region, packed hits or None, problems) of each packet
+        '''
+        directory, names = task
+        packets = []
+        for name in names:
+            found = False
+            for packet in GbtPacketChecker.iter_packets(os.path.join(directory, name)):
+                if packet is None:
+                    continue
+                found = True
+                words, region = packet
+                if len(words) != 4:
+                    packets.append((name, words[0] & 0xFFF, region, None, ("The file ends after %s words of a packet." % len(words),)))
+                    continue
+                BCID, vmms, channels, problems = GbtPacketChecker.decode_words(words)
+                hit_set = GbtPacketChecker.to_hit_set(vmms, channels)
+                packets.append((name, BCID, region, None if hit_set is None else tuple(hit_set.hits), problems))
+            if not found:
+                packets.append((name, None, None, None, ("The file has no GBT packet.",)))
+        return packets
+
+    @staticmethod
+    def verify_directory(directory, manifest, pool, chunk_size):
+        '''
+        Checks every GBT packet file of a directory against its manifest. Files are decoded in chunks of chunk_size files by pool
+        (a map function) and packets are compared with the manifest by BC ID and region.
+
+        :return dict: report like the one of check_combined() with "file" being the directory
+        '''
+        start = time.perf_counter()
+        names = sorted(os.listdir(directory))
+        chunks = [(directory, names[i:i + chunk_size]) for i in range(0, len(names), chunk_size)]
+        report = {"file": directory, "manifest": manifest, "packets": 0, "expected": 0, "matched": 0, "finished": True, "mismatches": []}
+        found = {}
+        for packets in pool(GbtPacketChecker.read_directory, chunks):
+            for name, BCID, region, hits, problems in packets:
+                report["packets"] += 1
+                if problems:
+                    report["mismatches"].append({"kind": "invalid", "BCID": BCID, "region": region, "expected": [],
+                                                 "found": [] if hits is None else [HitSet.from_packed(hits)], "problems": [name] + list(problems)})
+                if BCID is not None:
+                    found.setdefault((BCID, region), Counter())[hits] += 1
+
+        expected = {}
+        for BCID, region, hit_set in GbtPacketChecker.read_manifest(manifest):
+            expected.setdefault((BCID, region), Counter())[tuple(hit_set.hits)] += 1
+            report["expected"] += 1
+        to_hit_sets = lambda counter: [None if hits is None else HitSet.from_packed(hits) for hits in counter.elements()]
+        for key in sorted(set(expected) | set(found)):
+            expected_hits, found_hits = expected.get(key, Counter()), found.get(key, Counter())
+            report["matched"] += sum((expected_hits & found_hits).values())
+            if expected_hits != found_hits:
+                kind = "missing" if not found_hits else "unexpected" if not expected_hits else "different"
+                report["mismatches"].append({"kind": kind, "BCID": key[0], "region": key[1], "expected": to_hit_sets(expected_hits - found_hits),
+                                             "found": to_hit_sets(found_hits - expected_hits), "problems": []})
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+    @staticmethod
+    def verify_tree(root, workers=1, report_file=None, chunk_size=1000):
+        '''
+        Verifies every combined file and GBT packet directory under root that has a manifest (see manifest_target()), e.g. the manifests
+        written by GbtPacketMaker.vertical_pattern(..., manifest=True). Combined files, and chunks of the files of a directory, are checked
+        in a pool of worker processes. Combined files and packet directories without a manifest are listed as "unverified"::
+
+
+                GbtPacketMaker.GbtPacketMaker.vertical_pattern("upper", [20, 21], 4, bc_delay=800, manifest=True)
+                report = GbtPacketChecker.verify_tree(".", workers=4, report_file="verify.json")
+                report["passed"], report["failed"]
+
+
+        :param str root: top directory
+        :param 1/int/optional workers: number of worker processes. 1 checks everything in this process.
+        :param None/str/optional report_file: If given, the report is written as JSON (".json") or CSV (see write_report()).
+        :param 1000/int/optional chunk_size: number of GBT packet files decoded by a worker at a time
+        :return dict: {"root", "targets": [report of each combined file or directory with "passed"], "passed", "failed", "unverified", "workers", "seconds"}
+        '''
+        start = time.perf_counter()
+        manifests = {}
+        data = []
+        for directory, dir_names, file_names in os.walk(root):
+            dir_names.sort()
+            for name in sorted(file_names):
+                target = GbtPacketChecker.manifest_target(name)
+                if target is not None:
+                    manifests[os.path.join(directory, target)] = os.path.join(directory, name)
+                elif name.startswith("combined_"):
+                    data.append(os.path.join(directory, name))
+            data.extend(os.path.join(directory, name) for name in dir_names if name.startswith("GBT_packet_dir_"))
+
+        combined = [(target, manifest) for target, manifest in sorted(manifests.items()) if os.path.isfile(target)]
+        directories = [(target, manifest) for target, manifest in sorted(manifests.items()) if os.path.isdir(target)]
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            pool_map = pool.map if pool is not None else map
+            targets = list(pool_map(GbtPacketChecker.verify_combined, combined))
+            for target, manifest in directories:
+                targets.append(GbtPacketChecker.verify_directory(target, manifest, pool_map, chunk_size))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        for target in targets:                          # stats of all checks are recorded here, whether they ran in a worker or not
+            target["passed"] = len(target["mismatches"]) == 0
+            stats.add("check", packets=target["packets"], bytes=os.path.getsize(target["file"]) if os.path.isfile(target["file"]) else 0, files=1)
+        report = {"root": root, "targets": targets, "passed": sum(target["passed"] for target in targets),
+                  "failed": sum(not target["passed"] for target in targets), "unverified": [path for path in data if path not in manifests],
+                  "workers": workers, "seconds": time.perf_counter() - start}
+        stats.add("check", seconds=report["seconds"])
+        if report_file is not None:
+            GbtPacketChecker.write_report(report, report_file)
+        return report
+
+    @staticmethod
+    def write_report(report, file_name):
+        '''
+        Writes a report of verify_tree() as JSON if file_name ends with ".json", with HitSets written as {"vmm": [...], "channel": [...]}.
+        Otherwise it is written as CSV with one "summary" row per target followed by one row per mismatch.
+        '''
+        hits = lambda hit_sets: [None if hit_set is None else {"vmm": hit_set.vmm_list(), "channel": hit_set.channel_list()} for hit_set in hit_sets]
+        if file_name.endswith(".json"):
+            copy = dict(report)
+            copy["targets"] = [dict(target, mismatches=[dict(mismatch, expected=hits(mismatch["expected"]), found=hits(mismatch["found"]))
+                                                        for mismatch in target["mismatches"]]) for target in report["targets"]]
+            with open(file_name, 'w') as f:
+                json.dump(copy, f, indent=1)
+            return
+
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["target", "kind", "BCID", "region", "expected", "found", "problems", "packets", "matched", "passed", "seconds"])
+            for target in report["targets"]:
+                writer.writerow([target["file"], "summary", "", "", target["expected"], "", "", target["packets"], target["matched"],
+                                 target["passed"], "%.6f" % target["seconds"]])
+                for mismatch in target["mismatches"]:
+                    writer.writerow([target["file"], mismatch["kind"], mismatch["BCID"], mismatch["region"], mismatch["expected"],
+                                     mismatch["found"], " ".join(mismatch["problems"]), "", "", "", ""])
+
+    def check(self, hitmap_expected, artdata_expected=None, print_suppress=False, swap=False):      # checks if hit map and art data are correct
         '''
         Option 1: Checks if the actual GBT packet follow the expected hit pattern by comparing the produced list to the input list.
         Option 2: Checks if the input Hit Map and ART data follow the expected hit pattern after swapping fibers. This option is chosen if new_hitmap and new_artdata are not empty lists and their lenghts are the same.
@@ -196,12 +1002,15 @@ class GbtPacketChecker:
         Case 2: There are the same number of hits, but the hit track translated from GBT packet and the hit track of the user input don't match. Returns False.
         Case 3: There are the same number of hits and the hit tracks match. Returns True.
 
-        :param []/list hitmap_expected: If checking for a real GBT packet, hitmap_intended would be the input. If checking for a simulated cable swap hit map, hitmap_swap would be the input as the code is checking whether the hit map with simulated cable swaps can generate the same hit map as the GBT packet, which would confirm / do not confirm cable swapping possibilities.
+        :param []/list/HitSet hitmap_expected: If a HitSet, artdata_expected is not needed. If checking for a real GBT packet, hitmap_intended would be the input. If checking for a simulated cable swap hit map, hitmap_swap would be the input as the code is checking whether the hit map with simulated cable swaps can generate the same hit map as the GBT packet, which would confirm / do not confirm cable swapping possibilities.
         :param []/list artdata_expected: If checking for a real GBT packet, artdata_intended would be the input. If checking for a simulated cable swap hit map, artdata_swap would be the input.
         :param False/bool/optional print_suppress: If True, print statements regarding whether the expected hit track and translated hit track from the GBT equal to each other can be suppressed except for Case 1.
         :param False/bool/optional swap: If True, label for the hit map and art data expected are changed for the print statement purpose.
         :return bool: Returns True if expected hit pattern and the GBT packet has the same hit track and false otherwise.
         '''
+        start = time.perf_counter()
+        if isinstance(hitmap_expected, HitSet):
+            hitmap_expected, artdata_expected = hitmap_expected.vmm_list(), hitmap_expected.channel_list()
         hitmap_compare, artdata_compare = GbtPacketChecker.read_hitmap(self), GbtPacketChecker.read_artdata(self)
         hitmap_expected, artdata_expected = zip(*sorted(zip(hitmap_expected, artdata_expected)))  # sorts in an ascending order
         hitmap_expected, artdata_expected = list(hitmap_expected), list(artdata_expected)
@@ -216,15 +1025,19 @@ class GbtPacketChecker:
             print("ERROR: Wrong input for new_hitmap and new_artdata.")
             exit()
 
+        problems = GbtPacketChecker.decode(self)[4]
         if len(hitmap_compare) != len(artdata_compare):
-            print("ERROR: The lengths of hit map and ART data read don't match up. Fix the code.")
+            print("ERROR: The lengths of hit map and ART data read don't match up. %s" % " ".join(problems))
             exit()
 
         if len(hitmap_compare) != len(hitmap_expected) or len(artdata_compare) != len(artdata_expected):
             print(" The number of hits are different for intended hits and GBT packet hit data.")
+            stats.add("check", packets=1, files=1, seconds=time.perf_counter() - start)
             return False
 
-        if hitmap_compare == hitmap_expected and artdata_compare == artdata_expected:
+        if problems and not print_suppress:
+            print("ERROR: %s" % " ".join(problems))
+        if hitmap_compare == hitmap_expected and artdata_compare == artdata_expected and not problems:
             does_match = True
             match_str = "DO"
         else:
@@ -235,11 +1048,13 @@ class GbtPacketChecker:
         if not print_suppress:
             print(result)
 
+        stats.add("check", packets=1, files=1, seconds=time.perf_counter() - start)
         return does_match
 
-    def identify_swaps(self, hitmap_intended, artdata_intended):     # identify which vmm's are in correctly connected
+    def identify_swaps(self, hitmap_intended, artdata_intended=None):     # identify which vmm's are in correctly connected
         '''
-        Checks if there are possibilities of misconnected fibers and returns possible swaps for one region.::
+        Checks if there are possibilities of misconnected fibers and returns possible swaps for one region.
+        The intended hits are given as [plane.vmm, ...], [channel, ...] or as a HitSet.::
 
 
                 # Make a GBT packet in a directory called "GBT_packet_dir_test"
@@ -255,8 +1070,9 @@ class GbtPacketChecker:
 
         :return: a list of strings containing original indices -> swapped indices to explain possible cabling swap[s] e.g. [1, 2] -> [2, 1] means that if intended hit were [0.2, 1.2, 2.0, 2.2, 3.2], [10, 10, 10, 11, 10], the cables swapping resulted in [0.2, 2.2, 1.0, 1.2, 3.2], [10, 10, 10, 11, 10] which can be reordered into [0.2, 1.0, 1.2, 2.2, 3.2], [10, 10, 11, 10, 10, 10] and thus match the original GBT packet hit track. This indicates that there is a possibility that the cabling order was not correct.
         '''
-        _, _, region = GbtPacketChecker.extract(self)
-        hitmap_read, artdata_read = GbtPacketChecker.read_hitmap(self), GbtPacketChecker.read_artdata(self)     # repetitive, but necessary for printing below
+        if isinstance(hitmap_intended, HitSet):
+            hitmap_intended, artdata_intended = hitmap_intended.vmm_list(), hitmap_intended.channel_list()
+        hitmap_read, artdata_read = GbtPacketChecker.read_hitmap(self), GbtPacketChecker.read_artdata(self)     # decoded once and kept by decode()
         hitmap_intended, artdata_intended = zip(*sorted(zip(hitmap_intended, artdata_intended)))  # in case not in order
         hitmap_intended, artdata_intended = list(hitmap_intended), list(artdata_intended)
         if GbtPacketChecker.check(self, hitmap_intended, artdata_intended):     # checks if expected hit data and GBT packet hit data match up
@@ -264,19 +1080,16 @@ class GbtPacketChecker:
             print("Intended hits and Hit Map and ART data read match up so no need for further investigation.")
             exit()
 
-        change_idx_list, new_vmm_list = GbtPacketChecker.simulate_cable_swap(hitmap_intended)
-        all_possible_swaps = []
+        _, _, vmms, channels, _ = GbtPacketChecker.decode(self)   # the packet is read and decoded only once
+        read_hit_set = GbtPacketChecker.to_hit_set(vmms, channels)
         all_possible_swaps_idx = []
-        for hitmap, change_idx in zip(new_vmm_list, change_idx_list):
-            # print("_____")
-            # print(hitmap, artdata_intended, change_idx)
-            vmm_swap, channel_swap = zip(*sorted(zip(hitmap, artdata_intended)))
-            vmm_swap, channel_swap = list(vmm_swap), list(channel_swap)
-            if GbtPacketChecker.check(self, vmm_swap, channel_swap, print_suppress=True, swap=True):
-                all_possible_swaps.append(hitmap)
-                all_possible_swaps_idx.append(change_idx)
-
-        if len(all_possible_swaps) != 0:
+        if read_hit_set is not None:
+            fibers = [0, 1, 2, 3]
+            swaps = GbtPacketChecker.find_swaps(HitSet.from_floats(hitmap_intended, artdata_intended), read_hit_set, fibers)
+            swaps = sorted(swaps, key=lambda swap: [swap[fiber] for fiber in fibers])   # in the order of simulate_cable_swap()
+            all_possible_swaps_idx = [GbtPacketChecker.swap_string(swap) for swap in swaps]
+
+        if len(all_possible_swaps_idx) != 0:
             print("All possible swaps of cables are %s" % all_possible_swaps_idx)
             return all_possible_swaps_idx
         else:
@@ -284,6 +1097,8 @@ class GbtPacketChecker:
             exit()
 
 
+GbtPacketChecker.set_decode_cache()
+
 #GbtPacketMaker.GbtPacketMaker([0.0, 1.0, 2.0, 3.0],[1,2,1,2,13]).make_gbt(32, 20, "test","yes")
 #test1 = GbtPacketChecker("GBT_packet_dir_test/","GBT_packet_BC=32_fiber=20_[0.2, 1.0, 1.2, 2.2, 3.2][10, 10, 11, 10, 10]")
 #test1.identify_swaps([0.2, 1.2, 2.0, 2.2, 3.2],[10, 10, 10, 11, 10])
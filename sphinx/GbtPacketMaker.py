@@ -1,6 +1,6 @@
 '''
 GbtPacketMaker is a class that allows the user to make a GBT(Gigabyte Transmission) packet that corresponds to the user input.
-The format of the input is [plane.vmm,...],[channel,...]. 
+The format of the input is [plane.vmm,...],[channel,...] or a HitSet. 
 For instance, if the instance of the class is GbtPacketMaker([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13]), then GbtPacketMaker.make_gbt() would interpret first plane's first vmm's 2nd channel, first plane's 5th vmm's 3rd channel, second plane's 6th vmm's 5th channel, etc, to be hit and produce the corresponding GBT packet file.
 
 GbtPacketMaker can also produce two different patterns: vertical and horizontal. After producing GBT packet files of either of the patterns, the class can combine files into one file or directory depending on user's input.    
@@ -9,20 +9,35 @@ import os
 import errno
 import re
 import sys
+import time
+import random
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+import numpy as np
+from HitSet import HitSet
+from PacketSink import PacketSink, CombinedFileSink, DirectorySink
+from GbtPacketBinary import GbtPacketBinary, BinaryFileSink
+from PacketStats import stats, logger
 
 
 class GbtPacketMaker:
     '''
     This is a class to make GBT packets.
     '''
-    def __init__(self, input_vmm_list, input_channel_list):
+    parity_table = [1 - bin(ch).count("1") % 2 for ch in range(64)]             # parity bit of each channel: 1 if even number of 1's
+
+    def __init__(self, input_vmm_list, input_channel_list=None):
         '''
-        Initializes GbtPacketMaker object.
+        Initializes GbtPacketMaker object from a HitSet or from [plane.vmm,...],[channel,...] lists.
 
         '''
-        vmm_list, channel_list = zip(*sorted(zip(input_vmm_list, input_channel_list)))  # sorts the input vmm and channel pairs from smallest to largest
-        self.vmm_list = list(vmm_list)
-        self.channel_list = list(channel_list)
+        if isinstance(input_vmm_list, HitSet):
+            self.hit_set = input_vmm_list
+        else:
+            self.hit_set = HitSet.from_floats(input_vmm_list, input_channel_list)   # sorts the input vmm and channel pairs from smallest to largest
+        self.vmm_list = self.hit_set.vmm_list()
+        self.channel_list = self.hit_set.channel_list()
 
     @staticmethod
     def align(ls):
@@ -80,9 +95,14 @@ class GbtPacketMaker:
         Sorts list of files in alphanumerical way. It is necessary to align GBT packets in an ascending order of BC
         and pair numbers when combining GBT packets to minimize the running time for simulation.
         '''
-        convert = lambda text: int(text) if text.isdigit() else text.lower()
-        alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
-        return sorted(ls, key=alphanum_key)
+        return sorted(ls, key=GbtPacketMaker.alphanumeric_key)
+
+    @staticmethod
+    def alphanumeric_key(text):
+        '''
+        Returns the key of sorted_alphanumeric() e.g. ['gbt_packet_bc=', 32, '_region=', 20, ...] for "GBT_packet_BC=32_region=20_...".
+        '''
+        return [int(c) if c.isdigit() else c.lower() for c in re.split('([0-9]+)', text)]
 
     @staticmethod
     def to_hex(ls):
@@ -103,12 +123,9 @@ class GbtPacketMaker:
         The list reads right to left: The last 8th vmm of the fourth plane is the first element of the list and the
         first vmm of the first plane is the last element of the list.
         '''
-        vmm_each_plane = [[], [], [], [], [], [], [], []]  # separates into each plane
+        vmm_each_plane = [[], [], [], []]                  # separates into each plane
 
-        for i in range(len(self.vmm_list)):
-            vmm_str = str(self.vmm_list[i])
-            plane_int = int(vmm_str[0])
-            vmm_int = int(vmm_str[2])
+        for plane_int, vmm_int, _ in self.hit_set:
             vmm_each_plane[plane_int].append(vmm_int)      # makes a list of vmm's by each plane
 
         vmm_bin = []
@@ -144,9 +161,30 @@ class GbtPacketMaker:
     def read_channel(self):  # ART data Creator
         '''
         Returns a string of ART DATA that corresponds to the input of the class instance or input list of hit channels.
+        Channel i of the sorted input takes bits 6*i to 6*i+5 of ART data.
+        '''
+        art_data = 0
+        for i in range(len(self.channel_list)):
+            art_data |= self.channel_list[i] << (6 * i)
+        return '%0*X' % (max(12, (6 * len(self.channel_list) + 3) // 4), art_data)  # at least 12 digits filled up with 0's
+
+    def find_parity(self):
+        '''
+        Returns a string of parity by interpreting hit channels with parity_table. Channel i of the sorted input takes bit i of parity.
+        '''
+        parity = 0
+        for i in range(len(self.channel_list)):
+            parity |= GbtPacketMaker.parity_table[self.channel_list[i]] << i
+        return '%0*X' % ((len(self.channel_list) + 3) // 4, parity)
+
+    @staticmethod
+    def string_channel(channel_list):
+        '''
+        Returns a string of ART data built by formatting each channel as a 6-bit string and re-chunking the digits.
+        It is the former read_channel() kept as the reference of check_tables() and benchmark_tables().
         '''
         channel = []
-        channel_ls = self.channel_list[::-1]            # same as reverse function (by slicing)
+        channel_ls = channel_list[::-1]                 # same as reverse function (by slicing)
 
         for ch in channel_ls:
             six_digit = '{0:06b}'.format(ch)            # f'{channel:08b}' if python 3.6 or above
@@ -163,12 +201,14 @@ class GbtPacketMaker:
         art_data = art_data_almost.zfill(12).upper()    # if ART data digit number is smaller than 12, it fills up the space with 0's
         return art_data
 
-    def find_parity(self):
+    @staticmethod
+    def string_parity(channel_list):
         '''
-        Returns a string of parity by interpreting hit channels.
+        Returns a string of parity built by counting '1' characters of each channel formatted as a binary string.
+        It is the former find_parity() kept as the reference of check_tables() and benchmark_tables().
         '''
         ls = []
-        for channel in self.channel_list:
+        for channel in channel_list:
             channel_bin = '{0: 04b}'.format(channel)
             count =0
 
@@ -186,12 +226,270 @@ class GbtPacketMaker:
         parity = GbtPacketMaker.to_hex(chunks_read).upper()
         return parity
 
-    def make_gbt(self, BCID, region, directory_name, add_line=False, second_dir="none", make=True, return_dict=False):
+    @staticmethod
+    def check_tables():
+        '''
+        Checks find_parity() and read_channel() against string_parity() and string_channel() for every channel from 0 to 63
+        at every position of every number of hits from 1 to 8. Exits at the first disagreement.::
+
+
+                GbtPacketMaker.check_tables()
+
+
+        :return bool: True if all cases agree
+        '''
+        num_cases = 0
+        for num_hit in range(1, 9):
+            for ch in range(64):
+                for pos in range(num_hit):
+                    channel_list = [(ch + 37 * k) % 64 for k in range(num_hit)]   # other positions get varying channels
+                    channel_list[pos] = ch
+                    maker = GbtPacketMaker(HitSet([0] * num_hit, list(range(num_hit)), channel_list))
+                    if maker.find_parity() != GbtPacketMaker.string_parity(channel_list) or \
+                            maker.read_channel() != GbtPacketMaker.string_channel(channel_list):
+                        print("parity_table or ART data shifts disagree for channels %s: %s %s / %s %s" % (channel_list, maker.find_parity(), maker.read_channel(),
+                              GbtPacketMaker.string_parity(channel_list), GbtPacketMaker.string_channel(channel_list)))
+                        sys.exit()
+                    num_cases += 1
+
+        print("parity_table and ART data shifts agree with the string functions for %s cases." % num_cases)
+        return True
+
+    @staticmethod
+    def benchmark_tables(num_packets=10000, seed=0):
+        '''
+        Compares the time of find_parity() and read_channel() with string_parity() and string_channel() on the same random hits.::
+
+
+                GbtPacketMaker.benchmark_tables(100000)
+
+
+        :param 10000/int/optional num_packets: number of channel lists
+        :param 0/int/optional seed: seed of the random hits
+        :return dict: {"string": packets/sec, "table": packets/sec}
+        '''
+        rand = random.Random(seed)
+        makers = []
+        for i in range(num_packets):
+            num_hit = rand.choice(range(1, 9))
+            makers.append(GbtPacketMaker(HitSet([0] * num_hit, list(range(num_hit)), [rand.choice(range(64)) for _ in range(num_hit)])))
+
+        start = time.perf_counter()
+        for maker in makers:
+            GbtPacketMaker.string_parity(maker.channel_list)
+            GbtPacketMaker.string_channel(maker.channel_list)
+        string_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for maker in makers:
+            maker.find_parity()
+            maker.read_channel()
+        table_time = time.perf_counter() - start
+
+        result = {"string": num_packets / string_time, "table": num_packets / table_time}
+        print("string parity/channel: %.0f packets/sec, parity_table and shifts: %.0f packets/sec (x%.1f)" % (result["string"], result["table"], result["table"] / result["string"]))
+        return result
+
+    def read_packet(self, BCID):
+        '''
+        Returns a GBT packet as one hexadecimal string built by the string pipeline of read_vmm(), string_parity() and string_channel().
+        It is kept as the reference that encode() is compared against in benchmark_encode().
+        '''
+        parity = GbtPacketMaker.string_parity(self.channel_list)
+        if len(parity) != 2:
+            parity = "0" + parity
+        return "0000A" + hex(BCID)[2:].upper().zfill(3) + "00" + GbtPacketMaker.read_vmm(self) + parity + GbtPacketMaker.string_channel(self.channel_list)
+
+    def encode_fields(self, BCID):
+        '''
+        Builds header, error, Hit Map, parity and ART data of a GBT packet directly as integer bit fields.
+        Hit Map bit (plane * 8 + vmm) is set for each hit vmm, parity bit i and ART data bits 6*i to 6*i+5 belong to the i-th hit
+        in the sorted input.::
+
+
+                # Returns (40992, 0, 2151686161, 0, 220217473)
+                GbtPacketMaker([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13]).encode_fields(32)
+
+
+        :param int BCID: BC number from 0 to 4095.
+        :return int, int, int, int, int: header, error, hit_map, parity, art_data
+        '''
+        if not 0 <= BCID <= 4095:
+            print("BC %s is too large. Fix the pattern code to limit BC number maximum." % BCID)
+            sys.exit()
+        if len(self.channel_list) > 8:                  # ART data holds at most 8 channels of 6 bits
+            print("%s hits do not fit into one GBT packet. The maximum number of hits is 8." % len(self.channel_list))
+            sys.exit()
+
+        header = 0xA000 | BCID                          # e.g. 0x0000A00A where 0x00A is a bunch crossing id
+        error = 0
+        hit_map = self.hit_set.vmm_bitmap
+        parity = 0
+        art_data = 0
+        for i in range(len(self.channel_list)):
+            channel = self.channel_list[i]
+            parity |= GbtPacketMaker.parity_table[channel] << i
+            art_data |= channel << (6 * i)
+        return header, error, hit_map, parity, art_data
+
+    @staticmethod
+    def pack_words(header, error, hit_map, parity, art_data):
+        '''
+        Packs integer fields of a GBT packet into four 32-bit words in the order they are written in a GBT packet file:
+        header | error, Hit Map[31:8] | Hit Map[7:0], parity, ART data[47:32] | ART data[31:0].
+
+        :return array: array('I') of four 32-bit words. words.tobytes() gives the packet as bytes.
+        '''
+        return array('I', (header,
+                           error << 24 | hit_map >> 8,
+                           (hit_map & 0xFF) << 24 | parity << 16 | art_data >> 32,
+                           art_data & 0xFFFFFFFF))
+
+    def encode(self, BCID):
+        '''
+        Returns a GBT packet as four 32-bit words without going through strings.::
+
+
+                # Returns array('I', [40992, 8405024, 285212672, 220217473])
+                GbtPacketMaker([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13]).encode(32)
+
+
+        :param int BCID: BC number from 0 to 4095.
+        :return array: array('I') of four 32-bit words
+        '''
+        return GbtPacketMaker.pack_words(*GbtPacketMaker.encode_fields(self, BCID))
+
+    @staticmethod
+    def format_words(words, region):
+        '''
+        Converts 32-bit packet words into lines of a GBT packet file. e.g. "0000A020 20\\n" for each word.
+        '''
+        add = str(region)
+        return "".join(["%08X %s\n" % (word, add) for word in words])
+
+    @staticmethod
+    def encode_batch(plane, vmm, channel, packet_index, BCID, region):
+        '''
+        Encodes many GBT packets at once with NumPy. Hits are given as flat arrays with one entry per hit and packet_index
+        telling which packet each hit belongs to. Hits are ordered within each packet by (plane, vmm, channel) just like
+        the sorting in __init__, so every packet is the same as GbtPacketMaker(...).encode(BCID) of its hits.::
+
+
+                # Two packets: [0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13] at BC 32 and [2.1],[7] at BC 64
+                batch = GbtPacketMaker.encode_batch([0, 0, 1, 2, 3, 2], [0, 4, 5, 6, 7, 1], [1, 2, 4, 8, 13, 7],
+                                                    [0, 0, 0, 0, 0, 1], [32, 64], [20, 21])
+                batch["Words"]      # array of shape (2, 4) with the four 32-bit words of each packet
+
+
+        :param array plane: plane of each hit, 0 to 3
+        :param array vmm: vmm of each hit, 0 to 7
+        :param array channel: channel of each hit, 0 to 63
+        :param array packet_index: index of the packet of each hit, 0 to N-1
+        :param array BCID: BC number of each of the N packets, 0 to 4095
+        :param array region: region of each of the N packets
+        :return dict: {"Header": uint32, "Error": uint8, "Hit Map": uint32, "Parity": uint8, "ART data": uint64, "Words": uint32 (N, 4), "Region": int} arrays of N packets
+        '''
+        start = time.perf_counter()
+        plane = np.asarray(plane, dtype=np.int64)
+        vmm = np.asarray(vmm, dtype=np.int64)
+        channel = np.asarray(channel, dtype=np.int64)
+        packet_index = np.asarray(packet_index, dtype=np.int64)
+        BCID = np.asarray(BCID, dtype=np.int64)
+        region = np.asarray(region, dtype=np.int64)
+        num_packets = len(BCID)
+        if np.any((BCID < 0) | (BCID > 4095)):
+            print("BC %s is too large. Fix the pattern code to limit BC number maximum." % BCID[(BCID < 0) | (BCID > 4095)][0])
+            sys.exit()
+
+        if np.any((plane < 0) | (plane > 3) | (vmm < 0) | (vmm > 7) | (channel < 0) | (channel > 63)):
+            print("Hits of encode_batch() are out of range: planes should be 0 to 3, vmm's 0 to 7 and channels 0 to 63.")
+            sys.exit()
+        order = np.argsort(packet_index << 11 | plane << 9 | vmm << 6 | channel, kind='stable')  # sorts hits by packet, then plane.vmm, then channel
+        plane, vmm, channel, packet_index = plane[order], vmm[order], channel[order], packet_index[order]
+        counts = np.bincount(packet_index, minlength=num_packets)
+        if np.any(counts > 8):                                 # ART data holds at most 8 channels of 6 bits
+            print("%s hits do not fit into one GBT packet. The maximum number of hits is 8." % counts.max())
+            sys.exit()
+        position = np.arange(len(packet_index)) - (np.cumsum(counts) - counts)[packet_index]  # i-th hit within its packet
+
+        parity_table = np.array(GbtPacketMaker.parity_table, dtype=np.uint64)
+        hit_map = np.zeros(num_packets, dtype=np.uint64)
+        parity = np.zeros(num_packets, dtype=np.uint64)
+        art_data = np.zeros(num_packets, dtype=np.uint64)
+        hit = counts > 0                                    # hits of a packet are contiguous, so each packet is one reduceat segment
+        starts = (np.cumsum(counts) - counts)[hit]
+        if len(starts):
+            hit_map[hit] = np.bitwise_or.reduceat(np.left_shift(1, plane * 8 + vmm).astype(np.uint64), starts)
+            parity[hit] = np.bitwise_or.reduceat(parity_table[channel] << position.astype(np.uint64), starts)
+            art_data[hit] = np.bitwise_or.reduceat(channel.astype(np.uint64) << (6 * position).astype(np.uint64), starts)
+
+        header = (0xA000 | BCID).astype(np.uint64)
+        error = np.zeros(num_packets, dtype=np.uint64)
+        words = np.empty((num_packets, 4), dtype=np.uint32)  # same layout as pack_words()
+        words[:, 0] = header
+        words[:, 1] = error << np.uint64(24) | hit_map >> np.uint64(8)
+        words[:, 2] = (hit_map & np.uint64(0xFF)) << np.uint64(24) | parity << np.uint64(16) | art_data >> np.uint64(32)
+        words[:, 3] = art_data & np.uint64(0xFFFFFFFF)
+        stats.add("encode", packets=num_packets, seconds=time.perf_counter() - start)
+        return {"Header": header.astype(np.uint32), "Error": error.astype(np.uint8), "Hit Map": hit_map.astype(np.uint32),
+                "Parity": parity.astype(np.uint8), "ART data": art_data, "Words": words, "Region": region}
+
+    @staticmethod
+    def format_batch(words, region):
+        '''
+        Converts the "Words" and "Region" arrays of encode_batch() into lines of a combined GBT packet file without a finish line.
+        '''
+        return "".join([GbtPacketMaker.format_words(packet, add) for packet, add in zip(words.tolist(), region.tolist())])
+
+    @staticmethod
+    def benchmark_encode(num_packets=10000, seed=0):
+        '''
+        Compares packets/sec of the string pipeline (read_packet) and the integer encoder (encode) on the same random hits
+        and checks that both give the same GBT packet lines.::
+
+
+                GbtPacketMaker.benchmark_encode(100000)
+
+
+        :param 10000/int/optional num_packets: number of packets to encode with each method
+        :param 0/int/optional seed: seed of the random hits
+        :return dict: {"string": packets/sec, "integer": packets/sec}
+        '''
+        rand = random.Random(seed)
+        packets = []
+        for i in range(num_packets):
+            num_hit = rand.choice(range(1, 9))
+            vmm_list = [rand.choice(range(4)) + round(rand.choice(range(8)) * .1, 1) for _ in range(num_hit)]
+            channel_list = [rand.choice(range(64)) for _ in range(num_hit)]
+            packets.append((GbtPacketMaker(vmm_list, channel_list), rand.choice(range(4096)), rand.choice(range(20, 30))))
+
+        start = time.perf_counter()
+        string_lines = []
+        for maker, bc, region in packets:
+            final = maker.read_packet(bc)
+            string_lines.append("".join([final[i * 8:(i + 1) * 8] + ' ' + str(region) + "\n" for i in range(4)]))
+        string_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        integer_lines = [GbtPacketMaker.format_words(maker.encode(bc), region) for maker, bc, region in packets]
+        integer_time = time.perf_counter() - start
+
+        for (maker, bc, region), string_line, integer_line in zip(packets, string_lines, integer_lines):
+            if string_line != integer_line:
+                print("Encoders disagree for %s %s at BC %s:\n%s\n%s" % (maker.vmm_list, maker.channel_list, bc, string_line, integer_line))
+                sys.exit()
+
+        result = {"string": num_packets / string_time, "integer": num_packets / integer_time}
+        print("string pipeline: %.0f packets/sec, integer encoder: %.0f packets/sec (x%.1f)" % (result["string"], result["integer"], result["integer"] / result["string"]))
+        return result
+
+    def make_gbt(self, BCID, region, directory_name, add_line=False, second_dir="none", make=True, return_dict=False, sink=None):
         '''
         Option 1: Creates a GBT packet file with a corresponding input information. If a directory doesn't exist already,
         the function will create a new directory within the working directory.
         Option 2: Returns lines of a GBT packet with a corresponding input information.
-        Option 3: Returns a dictionary of GBT packet information - {header, error, hit_map, parity, art_data}::
+        Option 3: Returns a dictionary of GBT packet information - {header, error, hit_map, parity, art_data}
+        Option 4: Writes the GBT packet into a PacketSink instead of creating a file::
 
 
                 # Returns a dictionary e.g. {'Header': '0000A020', 'Error': '00', 'Hit Map': '80402011', 'Parity': '00', 'ART data': '00000D204081'}
@@ -200,6 +498,9 @@ class GbtPacketMaker:
                 GbtPacketMaker([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13]).make_gbt(32, 20, "test", make=False)
                 # Creates a GBT packet file
                 GbtPacketMaker([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13]).make_gbt(32, 20, "test")
+                # Writes the GBT packet into a combined file
+                with CombinedFileSink("combined_test") as sink:
+                    GbtPacketMaker([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13]).make_gbt(32, 20, "test", sink=sink)
 
 
         :param int BCID: BC number. Preferably a multiple of 32.
@@ -209,40 +510,30 @@ class GbtPacketMaker:
         :param "none"/str/optional second_dir: a name of the second directory if necessary when storing multiple GBT files.
         :param True/bool/optional make: If True, it creates a GBT file; If False, it only returns lines that would have been printed in a GBT packet
         :param True/bool/optional return_dict: If True, it creates a dictionary that returns {header, error, hit_map, parity, art_data}
+        :param None/PacketSink/optional sink: If not None, the packet is written into the sink. directory_name and add_line are then not used and second_dir only tells whether the packet belongs to the second directory.
         '''
-        bcid_converted = hex(BCID)[2:].upper()
-        if len(bcid_converted) > 3:
-            print("BC %s is too large. Fix the pattern code to limit BC number maximum." %BCID)
-            sys.exit()
-
-        bcid_converted  = bcid_converted.zfill(3)
-        header = "0000A" + bcid_converted       # e.g. "0000A00A" where "00A" is a bunch crossing id
-        error = "00"
+        start = time.perf_counter()
+        header, error, hit_map, parity, art_data = GbtPacketMaker.encode_fields(self, BCID)
         tag = str(self.vmm_list) + str(self.channel_list)
-        hit_map = str(GbtPacketMaker.read_vmm(self))
-        parity = str(GbtPacketMaker.find_parity(self))
-        if len(parity) != 2:
-            parity = "0" + parity
-        art_data = str(GbtPacketMaker.read_channel(self))
-        final = header + error + hit_map+ parity+ art_data
 
         dict_gbt = {}
         if return_dict:
             temp_name =["Header", "Error", "Hit Map", "Parity", "ART data"]
-            temp = [header, error, hit_map, parity, art_data]
+            temp = ["%08X" % header, "%02X" % error, "%08X" % hit_map, "%02X" % parity, "%012X" % art_data]
             for i in range(len(temp)):
                 dict_gbt[str(temp_name[i])] = temp[i]
             return dict_gbt
 
-        add = str(region)   # e.g." 20"
-        lines = ""
+        lines = GbtPacketMaker.format_words(GbtPacketMaker.pack_words(header, error, hit_map, parity, art_data), region)
+        encoded = time.perf_counter()
+        stats.add("encode", packets=1, seconds=encoded - start)
+        if sink is not None:
+            sink.write(BCID, region, lines, tag, second_dir.lower() != "none")
+            stats.add("write", seconds=time.perf_counter() - encoded)
+            return lines
+
         if not make:        # if make==False, exit here and returns lines of GBT packet instead of creating a GBT packet file
-            if len(final) % 8 == 0:
-                for i in range(int(len(final) // 8)):  # To return GBT packet lines
-                    line = final[i * 8:(i + 1) * 8] + ' ' + add
-                    final_line = line + "\n"
-                    lines += final_line
-                print("GBT file was not created because of the user input.")
+            logger.debug("GBT file was not created because of the user input.")
             return lines
 
         output_file = "GBT_packet_BC=%s_region=%s_%s" % (BCID, region, tag)
@@ -259,30 +550,70 @@ class GbtPacketMaker:
                     raise
 
         with open(directory + output_file, 'w') as f:               # 'w' allows for overwriting the file each time this is opened
-            if len(final) % 8 == 0:
-                for i in range(int(len(final) // 8)):
-                    line = final[i * 8:(i + 1) * 8] + ' ' + add
-                    if make:
-                        f.write(line)
-                        f.write("\n")
-
-                if add_line:
-                    fin_line = '00000001 01' # do this while combining -> IF individual packet needs this, add this, but make sure to change other parts of the code that combines all GDP packets
-                    f.write(fin_line)
-
-                print("GBT file named {} created".format(output_file))
-            else:
-                print("GBT for {} not created correctly. Check if BC number is larger than 4095.".format(output_file))
-                print("Not created file content is %s" % final)
+            f.write(lines)
+            if add_line:
+                fin_line = '00000001 01' # do this while combining -> IF individual packet needs this, add this, but make sure to change other parts of the code that combines all GDP packets
+                f.write(fin_line)
+
+        stats.add("write", packets=1, bytes=len(lines), files=1, seconds=time.perf_counter() - encoded)
+        logger.debug("GBT file named %s created", output_file)
 
         return lines
 
     @staticmethod
-    def combine_gbt(dir_name, typ, num_regions, bc_delay):
+    def delay_lines(bc_delay):
+        '''
+        Returns lines of the two dummy packets of regions 20 and 21 at BC bc_delay that let the simulation wait before the first real GBT packet.
+        Returns an empty string if bc_delay is 0.
+        '''
+        if bc_delay == 0:
+            return ""
+        words = GbtPacketMaker(HitSet([0], [0], [0])).encode(bc_delay)
+        return GbtPacketMaker.format_words(words, 20) + GbtPacketMaker.format_words(words, 21)
+
+    @staticmethod
+    def pattern_sink(section, dir_name, second_dir_name, bc_delay, sink=None):
+        '''
+        Returns the sink a pattern writes into: sink itself if given, a DirectorySink if section is "*_specific" (packets are
+        combined into pairs from files afterwards), and otherwise a CombinedFileSink that writes "combined_GBT_packet_dir_<dir_name>"
+        and "combined_GBT_packet_dir_<dir_name>_<second_dir_name>" directly without GBT packet files.
+        '''
+        if sink is not None:
+            return sink
+        if "specific" in section:
+            return DirectorySink(dir_name, second_dir_name)
+        return CombinedFileSink("combined_GBT_packet_dir_%s" % dir_name, "combined_GBT_packet_dir_%s_%s" % (dir_name, second_dir_name),
+                                head=GbtPacketMaker.delay_lines(bc_delay), ordered=True)  # patterns come in the order of the combined file
+
+    @staticmethod
+    def finish_pattern(section, dir_name, second_dir_name, num_regions, bc_delay, out, sink=None):
+        '''
+        Finishes a pattern written into out = pattern_sink(...). A sink given by the user is left open for the user to close.
+        '''
+        if sink is not None:
+            return
+        if "specific" in section:
+            path = "GBT_packet_dir_%s/" % dir_name
+            path2 = "GBT_packet_dir_%s_%s/" % (dir_name, second_dir_name)   # in case there is a second directory to look at
+            GbtPacketMaker.combine_gbt(path, "pair", num_regions, bc_delay)
+            logger.info("Combined file created")
+            if os.path.exists(os.path.dirname(path2)):
+                GbtPacketMaker.combine_gbt(path2, "pair", num_regions, bc_delay)
+                logger.info("Combined file 2 created")
+        else:
+            with stats.timer("write"):     # a buffered CombinedFileSink writes its files when closed
+                out.close()
+            logger.info("Combined file created")
+            if out.num_second_packets != 0:
+                logger.info("Combined file 2 created")
+
+    @staticmethod
+    def combine_gbt(dir_name, typ, num_regions, bc_delay, binary=False):
         '''
         Combines all GBT files of a specific pattern of regions of the given directory. If typ is "pair",
         the combined file is created as a single file within the working directory.
-        If typ is "all", the combined files are stored within a newly created directory within the working directory
+        If typ is "all", the combined files are stored within a newly created directory within the working directory.
+        Packets of "all" are merged in the order of BC number and region read from their headers (look merge_gbt documentation).
 
         :param str dir_name: directory where GBT packets are stored
         :param "all"/"pair" typ: If typ is "all", all GBT packets are combined
@@ -290,30 +621,35 @@ class GbtPacketMaker:
             into one file each pairs with finish command. If typ is neither of those, exit() is executed.
         :param int num_regions: number of regions e.g. Regions 20, 21 are two regions
         :param int bc_delay:
+        :param False/bool/optional binary: If True, combined files are written in the binary format of GbtPacketBinary with ".gbtb" added to their names.
         :return: a single file if typ is "all" and a set of files if typ is "pair"
         '''
 
         def combine():
-            if bc_delay != 0:
-                delay_lines = GbtPacketMaker([0.0], [0]).make_gbt(bc_delay, 20, "", second_dir="none", make=False)
-                delay_lines += GbtPacketMaker([0.0], [0]).make_gbt(bc_delay, 21, "", second_dir="none", make=False)
-                out_file.write(delay_lines)
+            content = [GbtPacketMaker.delay_lines(bc_delay)]
 
             for file in file_ls:
                 with open(file) as in_file:
-                    out_file.write(in_file.read())
+                    content.append(in_file.read())
 
             fin_line = '00000001 01'
-            out_file.write(fin_line)
+            content.append(fin_line)
+            content = "".join(content)
+            if binary:
+                out_file.write(GbtPacketBinary.pack_text(content))
+            else:
+                out_file.write(content)
             out_file.close()
+            stats.add("combine", packets=len(file_ls), bytes=len(content), files=1)
+
+        suffix, mode = (".gbtb", 'wb') if binary else ("", 'w')
 
-        file_ls = GbtPacketMaker.sorted_alphanumeric(os.listdir(dir_name))  # sorts the files within the same directory
-        if typ == "all":                                                    # proceeds if combining all in the directory
-            file_ls = [dir_name + file for file in file_ls]                 # add directory path
-            with open('combined_%s' % dir_name[:-1], 'w') as out_file:
-                combine()
+        if typ == "all":                                                    # streams packets ordered by BC and region
+            GbtPacketMaker.merge_gbt([GbtPacketMaker.file_packets(dir_name)], 'combined_%s%s' % (dir_name[:-1], suffix),
+                                     bc_delay, binary=binary)
 
         elif typ == "pair":                                                 # proceeds if individual packet pair
+            file_ls = GbtPacketMaker.sorted_alphanumeric(os.listdir(dir_name))  # sorts the files within the same directory
 
             ls = GbtPacketMaker.chunky(file_ls, num_regions)
             directory = "combined_" + dir_name
@@ -324,43 +660,129 @@ class GbtPacketMaker:
                     if exc.errno != errno.EEXIST:
                         raise
 
-            for j in range(len(ls[0])//2):
-                if len(ls[0]) % 2!=0:
-                    print("Some fibers don't have their pairs.")
+            with stats.timer("combine"):
+                for j in range(len(ls[0])//2):
+                    if len(ls[0]) % 2!=0:
+                        logger.warning("Some fibers don't have their pairs.")
 
-                for i in range(len(ls)):
-                    file_ls = [dir_name + file_temp for file_temp in ls[i][2*j:2*j + 2]]
-                    print(file_ls)
-                    with open(os.path.join(directory, file_ls[0].split("/")[1]), 'w') as out_file:
-                        combine()
+                    for i in range(len(ls)):
+                        file_ls = [dir_name + file_temp for file_temp in ls[i][2*j:2*j + 2]]
+                        logger.debug("%s", file_ls)
+                        with open(os.path.join(directory, file_ls[0].split("/")[1]) + suffix, mode) as out_file:
+                            combine()
 
         else:
             print("Wrong type input for the GbtPacketMaker.combine_gbt() function")
             exit()
 
     @staticmethod
-    def vertical_pattern(section, regions, offset, bc_delay=0, bc_gap_track=32, bc_gap_region=0, bc_gap_pl=1, second_dir_name="second"):
+    def read_packets(file_name, wrap=0):
         '''
-        Creates GBT packet files in a new directory and a combined file that has all GBT packets in a current directory
-        to simulate a vertical pattern of hits in detector. If BC ID exceeds 4095, then a second directory is created
-        and rest of the files necessary to generate a pattern have BC ID = (BC ID - 4095) and stored in a second directory.
-        Upper region channels are, for example, [4, 5, 6, 7, 12, 13, 14, 15, 20, 21, ...].
-        If file is successfully completed, it will print out "Combined file created" as well as a list of newly created GBT files::
+        Yields (BC, region, lines) of each packet of a text GBT packet file (single packet or combined) one at a time.
+        Finish command lines are skipped. BC is the BC ID of the header plus 4095 * wrap, so packets of a second directory
+        (wrap=1), whose BC ID was reduced by 4095, are ordered after the packets of the first directory.
+        '''
+        with open(file_name, 'r') as f:
+            lines = []
+            for line in f:
+                if len(lines) == 0 and line.startswith('00000001 01'):   # finish command line
+                    continue
+                lines.append(line if line.endswith("\n") else line + "\n")
+                if len(lines) == 4:
+                    yield int(lines[0][5:8], 16) + 4095 * wrap, int(lines[0][9:]), "".join(lines)   # "0000AXXX RR" where XXX is BC ID
+                    lines = []
 
+    @staticmethod
+    def file_packets(dir_name, wrap=0):
+        '''
+        Yields (BC, region, lines) of the GBT packet files of a directory ordered by BC and region. Only the first line of each
+        file is read to order the files, and then files are read one at a time, so memory does not grow with the packets.
+        File names only break ties between packets with the same BC and region.
 
-            GbtPacketMaker.vertical_pattern("upper", [20,21,22,23], 4, bc_gap=96, second_dir_name='2')
+        :param str dir_name: directory where GBT packets are stored e.g. "GBT_packet_dir_test/"
+        :param 0/int/optional wrap: 1 for a second directory. Look read_packets documentation.
+        '''
+        index = []
+        for name in os.listdir(dir_name):
+            with open(dir_name + name, 'r') as f:
+                first = f.readline()
+            index.append((int(first[5:8], 16), int(first[9:]), GbtPacketMaker.alphanumeric_key(name), name))
+        index.sort()
+        for _, _, _, name in index:
+            for packet in GbtPacketMaker.read_packets(dir_name + name, wrap):
+                yield packet
 
+    @staticmethod
+    def merge_gbt(streams, file_name, bc_delay=0, second_file_name=None, binary=False):
+        '''
+        Merges streams of (BC, region, lines) that are each ordered by BC and region into one combined file in a single pass,
+        keeping only one packet of each stream in memory. Packets with BC above 4095 (packets of a second directory, whose
+        BC ID in the lines is BC - 4095) go into second_file_name if it is given.::
 
-        :param "upper"/"lower"/"upper_specific"/"lower_specific" section: "lower" if channels hit should be of lower section or [0, 1, 2, 3, 8, 9, ...] and "upper" if channels are from [4, 5, 6, 7, 12, 13, 14, ...]. If "*_specific", then GBT packets are combined into pairs insteand of one combined file.
-        :param list regions: regions for hits e.g. [20, 21]
-        :param int offset: Hit channel offset / starting channel for x planes. 0, 1, 2, or 3 if section = "lower", 4, 5, 6, or 7 if section = "upper".
-        :param 0/int/optional bc_delay: BC ID of the first dummy packet to allow for simulation to wait and process the first real GBT packet
-        :param 32/int/optional bc_gap_track: BC ID difference between each GBT packets within the same region.
-        :param 0/int/optional bc_gap_region: BC ID difference between different regions/pairs. The default value is 0.
-        :param 0/int/optional bc_gap_pl:  BC ID difference between planes. The default value is 0.
-        :param "second"/str/optional second_dir_name: name of second directory if second directory is necessary.
+
+            # Combines a directory and its second directory into two combined files
+            GbtPacketMaker.merge_gbt([GbtPacketMaker.file_packets("GBT_packet_dir_test/"), GbtPacketMaker.file_packets("GBT_packet_dir_test_second/", wrap=1)],
+                                     "combined_test", second_file_name="combined_test_second")
+
+
+        :param list streams: streams of (BC, region, lines) e.g. file_packets(), read_packets() or MemorySink.stream()
+        :param str file_name: name of the combined file
+        :param 0/int/optional bc_delay: Look combine_gbt documentation.
+        :param None/str/optional second_file_name: name of the combined file of packets with BC above 4095
+        :param False/bool/optional binary: If True, combined files are written in the binary format of GbtPacketBinary.
+        :return int: number of packets merged
+        '''
+        sink_class = BinaryFileSink if binary else CombinedFileSink
+        with stats.timer("combine"):
+            with sink_class(file_name, second_file_name, head=GbtPacketMaker.delay_lines(bc_delay), ordered=True, stage="combine") as sink:
+                for BC, region, lines in heapq.merge(*streams, key=lambda packet: (packet[0], packet[1])):
+                    sink.write(BC, region, lines, second=BC > 4095)
+        logger.info("Combined file %s created with %s packets", file_name, sink.num_packets)
+        return sink.num_packets
+
+    @staticmethod
+    def track_hits(region, bc, tracks, bc_gap_track, plane=None, second=False):
+        '''
+        Yields (BCID, region, HitSet) of the tracks of one region. Each track is a pair of lists (vmm's, channels) of planes 0 to 3
+        and tracks are bc_gap_track apart starting at bc.
+
+        :param int region: region of the packets
+        :param int bc: BC number of the first track
+        :param iterable tracks: ([vmm of plane 0, ..., vmm of plane 3], [channel of plane 0, ..., channel of plane 3]) of each track
+        :param int bc_gap_track: BC ID difference between tracks
+        :param None/int/optional plane: If None, a packet has hits of all four planes at the BC of the track. Otherwise, a packet has only the hit of this plane at BC + plane.
+        :param False/bool/optional second: If False, yields tracks with BC below 4096. If True, yields the rest with BC = BC - 4095.
+        '''
+        for vmm, ch in tracks:
+            if (bc >= 4096) == second:              # max number of bc is 4095
+                BCID = bc - 4095 if second else bc
+                if plane is None:
+                    yield BCID, region, HitSet([0, 1, 2, 3], vmm, ch)
+                else:
+                    yield BCID + plane, region, HitSet([plane], [vmm[plane]], [ch[plane]])
+            bc += bc_gap_track
+
+    @staticmethod
+    def merge_hits(streams):
         '''
+        Merges streams of (BCID, region, HitSet) that are each in order into one stream in the order GBT packets have in a
+        combined file: BC number, region and then hits like the GBT packet file names sorted by sorted_alphanumeric().
+        '''
+        return heapq.merge(*streams, key=lambda packet: PacketSink.sort_key(packet[0], packet[1], str(packet[2].vmm_list()) + str(packet[2].channel_list())))
 
+    @staticmethod
+    def vertical_hits(section, regions, offset, bc_gap_track=32, bc_gap_region=0, bc_gap_pl=1, second=False, region_indices=None):
+        '''
+        Yields (BCID, region, HitSet) of a vertical pattern lazily in the order of the combined file. Arguments are the same
+        as vertical_pattern(). If second is True, only the packets of the second combined file (BC ID above 4095) are yielded.
+        If region_indices is a list of indices of regions, only those regions are yielded with the same BC ID's as in the whole pattern.::
+
+
+            for BCID, region, hit_set in GbtPacketMaker.vertical_hits("upper", [20, 21], 4):
+                print(BCID, region, hit_set)
+
+
+        '''
         if "lower" in section and offset in [0, 1, 2, 3]:        # e.g. offset = 2
             pass
         elif "upper" in section and offset in [4, 5, 6, 7]:     # e.g. offset = 4
@@ -370,60 +792,221 @@ class GbtPacketMaker:
             exit()
 
         channels = [offset + 8 * i for i in range(8)]
-        dir_name = 'vert_%s_%s_offset%s_bc_delay_%s_gap_%s_%s_bc_gap_pl_%s' % (section, regions, offset, bc_delay, bc_gap_track, bc_gap_region, bc_gap_pl)
-        path = "GBT_packet_dir_%s/" % dir_name
-        path2 = "GBT_packet_dir_%s_%s/" % (dir_name, second_dir_name)
+        planes = [None] if bc_gap_pl == 0 else [0, 1, 2, 3]    # each plane is a separate stream if planes have different BC
+        streams = []
         k = 0
         for i in range(len(regions)):
-            bc = bc_gap_track + k
-            for ch in channels:
-                pl = [[],[],[],[]]
-                for n in range(8):          # repeats as many as the number of vmm's in each region = 8 vmm's in one fiber
-                    pl[0] = 0.0 + round(n * (10 ** (-1)), 1)
-                    pl[1] = 1.0 + round(n * (10 ** (-1)), 1)
-                    pl[2] = 2.0 + round(n * (10 ** (-1)), 1)
-                    pl[3] = 3.0 + round(n * (10 ** (-1)), 1)
-                    if bc < 4096:           # max number of bc is 4095
-                        if bc_gap_pl == 0:
-                            GbtPacketMaker(pl,[ch,ch,ch,ch]).make_gbt(bc, regions[i], dir_name)
-                        else:
-                            for j in range(4):
-                                GbtPacketMaker([pl[j]],[ch]).make_gbt(bc+j, regions[i], dir_name)
-
-                    else:
-                        temp_bc = bc - 4095  # adds a separate directory for GBT packet files with BCID that are too large
-                        if bc_gap_pl == 0:
-                            GbtPacketMaker(pl, [ch,ch,ch,ch]).make_gbt(temp_bc, regions[i], dir_name, second_dir_name)
-                        else:
-                            for j in range(4):
-                                GbtPacketMaker([pl[j]],[ch]).make_gbt(temp_bc+j, regions[i], dir_name, second_dir_name)
-
-                    bc += bc_gap_track
+            for plane in planes:
+                if region_indices is not None and i not in region_indices:
+                    break
+                # repeats as many as the number of vmm's in each region = 8 vmm's in one fiber
+                tracks = (([n, n, n, n], [ch, ch, ch, ch]) for ch in channels for n in range(8))
+                streams.append(GbtPacketMaker.track_hits(regions[i], bc_gap_track + k, tracks, bc_gap_track, plane, second))
 
             if i % 2 != 0:                              # increments BCID for each pair
-                 k += bc_gap_region
+                k += bc_gap_region
+        return GbtPacketMaker.merge_hits(streams)
+
+    @staticmethod
+    def vertical_packets(section, regions, offset, bc_gap_track=32, bc_gap_region=0, bc_gap_pl=1, second=False, region_indices=None):
+        '''
+        Yields (BCID, region, packet words) of a vertical pattern lazily in the order of the combined file. See vertical_hits().::
+
+
+            for BCID, region, words in GbtPacketMaker.vertical_packets("upper", [20, 21], 4):
+                print(GbtPacketMaker.format_words(words, region))
+
+
+        '''
+        for BCID, region, hit_set in GbtPacketMaker.vertical_hits(section, regions, offset, bc_gap_track, bc_gap_region, bc_gap_pl, second, region_indices):
+            yield BCID, region, GbtPacketMaker(hit_set).encode(BCID)
+
+    @staticmethod
+    def horizontal_channels(section, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir="none"):
+        '''
+        Returns the x channel and lists of u and v channels (0 to 511 over all vmm's of a plane) of a horizontal pattern.
+        Arguments are the same as horizontal_pattern().
+        '''
+        uv_offset= input_uv_offset
+        if "diagonal" in section:
+            if input_uv_offset == 0 or (uv_dir != "left" and uv_dir != "right"):
+                exit()
+            if uv_dir == "right":
+                uv_offset = -1 * input_uv_offset
+
+        if "lower" in section and offset in [0, 1, 2, 3]:  # checks if the offset is appropriate for the input region e.g. offset = 2
+            pass
+        elif "upper" in section and offset in [4, 5, 6, 7]:  # e.g. offset = 4
+            pass
+        else:
+            print("wrong section")
+            exit()
+
+        interval = 8
+        channels = [offset + interval * i for i in range(8)]        # sets an interval as 8
+        if x_vmm in [i for i in range(8)]:
+            x_ch = x_vmm * 64 + channels[x_ch_idx]
+        else:
+            print("Your x_vmm = %s is out of range. x_vmm should be in a range of 0 to 7" % (x_vmm))
+            exit()
+
+        if x_ch <= 510 // 2:
+            num = range(x_ch // interval + 1)
+        else:
+            num = range((512 - x_ch) // interval + 1)
 
+        # adds left and right channels and removes the duplicated center
+        u_ch_ls = list(reversed([- uv_offset + x_ch - interval * i for i in num])) + \
+                  [- uv_offset + x_ch + interval * i for i in num][1:]
+        v_ch_ls = list(reversed([i+ 2 * uv_offset for i in u_ch_ls]))
+        return x_ch, u_ch_ls, v_ch_ls
+
+    @staticmethod
+    def horizontal_hits(section, regions, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir="none",
+                        bc_gap_track=32, bc_gap_region=0, bc_gap_pl=0, second=False, region_indices=None):
+        '''
+        Yields (BCID, region, HitSet) of a horizontal pattern lazily in the order of the combined file. Arguments are the same
+        as horizontal_pattern(). second and region_indices are the same as vertical_hits().
+        '''
+        x_ch, u_ch_ls, v_ch_ls = GbtPacketMaker.horizontal_channels(section, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir)
+        planes = [None] if bc_gap_pl == 0 else [0, 1, 2, 3]
+        streams = []
+        k = 0
+        for i in range(len(regions)):
+            if regions[i] in [20, 22, 24, 26, 28]:          # [x0, x1, u0, v0]
+                tracks = [([x_ch // 64, x_ch // 64, u // 64, v // 64], [x_ch % 64, x_ch % 64, u % 64, v % 64]) for u, v in zip(u_ch_ls, v_ch_ls)]
+            elif regions[i] in [21, 23, 25, 27, 29]:        # [u0, v0, x0, x1]
+                tracks = [([u // 64, v // 64, x_ch // 64, x_ch // 64], [u % 64, v % 64, x_ch % 64, x_ch % 64]) for u, v in zip(u_ch_ls, v_ch_ls)]
+            else:
+                print("Region %s is not one of regions 20 to 29." % regions[i])
+                exit()
+            for plane in planes:
+                if region_indices is not None and i not in region_indices:
+                    break
+                streams.append(GbtPacketMaker.track_hits(regions[i], bc_gap_track + k, tracks, bc_gap_track, plane, second))
+
+            if i % 2 != 0:
+                k += bc_gap_region
+        return GbtPacketMaker.merge_hits(streams)
+
+    @staticmethod
+    def horizontal_packets(section, regions, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir="none",
+                           bc_gap_track=32, bc_gap_region=0, bc_gap_pl=0, second=False, region_indices=None):
+        '''
+        Yields (BCID, region, packet words) of a horizontal pattern lazily in the order of the combined file. See horizontal_hits().
+        '''
+        for BCID, region, hit_set in GbtPacketMaker.horizontal_hits(section, regions, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir,
+                                                                    bc_gap_track, bc_gap_region, bc_gap_pl, second, region_indices):
+            yield BCID, region, GbtPacketMaker(hit_set).encode(BCID)
+
+    @staticmethod
+    def pattern_hits(pattern, args, second=False, region_indices=None):
+        '''
+        Returns vertical_hits(*args) if pattern is "vertical" or horizontal_hits(*args) if pattern is "horizontal".
+        '''
+        if pattern == "vertical":
+            return GbtPacketMaker.vertical_hits(*args, second=second, region_indices=region_indices)
+        return GbtPacketMaker.horizontal_hits(*args, second=second, region_indices=region_indices)
+
+    @staticmethod
+    def encode_region(task):
+        '''
+        Encodes packets of one region of a pattern in a worker process of write_pattern().
+
+        :param tuple task: (pattern, args, region index, second) as in pattern_hits()
+        :return list: [(BCID, region, lines, tag), ...] in the order of the combined file
+        '''
+        pattern, args, i, second = task
+        packets = []
+        for BCID, region, hit_set in GbtPacketMaker.pattern_hits(pattern, args, second, [i]):
+            maker = GbtPacketMaker(hit_set)
+            packets.append((BCID, region, GbtPacketMaker.format_words(maker.encode(BCID), region), str(maker.vmm_list) + str(maker.channel_list)))
+        return packets
+
+    @staticmethod
+    def write_pattern(pattern, args, dir_name, second_dir_name, num_regions, out, workers=1):
+        '''
+        Writes all packets of a pattern into the sink out. If workers is more than 1, regions are encoded in a pool of
+        worker processes and merged back in the order of the combined file, so the output is the same as with workers=1.
+        '''
+        if workers <= 1:
+            for second, second_dir in [(False, "none"), (True, second_dir_name)]:
+                for BCID, region, hit_set in GbtPacketMaker.pattern_hits(pattern, args, second):
+                    GbtPacketMaker(hit_set).make_gbt(BCID, region, dir_name, second_dir=second_dir, sink=out)
+            return
+
+        with ProcessPoolExecutor(workers) as pool:
+            for second in [False, True]:
+                start = time.perf_counter()
+                region_packets = list(pool.map(GbtPacketMaker.encode_region, [(pattern, args, i, second) for i in range(num_regions)]))
+                stats.add("encode", packets=sum(len(packets) for packets in region_packets), seconds=time.perf_counter() - start)
+                with stats.timer("write"):
+                    for BCID, region, lines, tag in heapq.merge(*region_packets, key=lambda packet: PacketSink.sort_key(packet[0], packet[1], packet[3])):
+                        out.write(BCID, region, lines, tag, second)
+
+    @staticmethod
+    def write_manifests(pattern, args, section, dir_name, second_dir_name, bc_delay):
+        '''
+        Writes the expected packets of a pattern next to its output with GbtPacketChecker.write_manifest(), so that
+        GbtPacketChecker.verify_tree() checks them without reading hits from file names: "combined_GBT_packet_dir_<dir_name>.manifest.csv"
+        for a combined file, or "GBT_packet_dir_<dir_name>.manifest.csv" for the GBT packet directory of a "*_specific" section.
+        A manifest of the second combined file (or directory) is written only if the pattern has packets there.
+        '''
+        from GbtPacketChecker import GbtPacketChecker      # GbtPacketChecker imports this module
         if "specific" in section:
-            GbtPacketMaker.combine_gbt(path, "pair", len(regions), bc_delay)
-            print("Combined file created")
-            if os.path.exists(os.path.dirname(path2)):
-                GbtPacketMaker.combine_gbt(path2, "pair", len(regions), bc_delay)
-                print("Combined file 2 created")
+            names, delay = ["GBT_packet_dir_%s" % dir_name, "GBT_packet_dir_%s_%s" % (dir_name, second_dir_name)], 0
         else:
-            GbtPacketMaker.combine_gbt(path, "all", len(regions), bc_delay)    # CHANGE TO "pair" if wanting to combine in gbt pairs not all produced
-            print("Combined file created")
-            if os.path.exists(os.path.dirname(path2)):
-                GbtPacketMaker.combine_gbt(path2, "all", len(regions), bc_delay)    # combines the second file as well
-                print("Combined file 2 created")
+            names, delay = ["combined_GBT_packet_dir_%s" % dir_name, "combined_GBT_packet_dir_%s_%s" % (dir_name, second_dir_name)], bc_delay
+        for name, second in zip(names, [False, True]):
+            packets = list(GbtPacketMaker.pattern_hits(pattern, args, second))
+            if len(packets) != 0 or not second:
+                GbtPacketChecker.write_manifest(packets, name + ".manifest.csv", delay)
+
+    @staticmethod
+    def vertical_pattern(section, regions, offset, bc_delay=0, bc_gap_track=32, bc_gap_region=0, bc_gap_pl=1, second_dir_name="second", sink=None, workers=1,
+                         manifest=False):
+        '''
+        Creates a combined file that has all GBT packets in a current directory to simulate a vertical pattern of hits in detector.
+        Packets are streamed into the combined file without GBT packet files unless section is "*_specific" or another sink is given.
+        If BC ID exceeds 4095, then rest of the packets necessary to generate a pattern have BC ID = (BC ID - 4095) and are stored in a second combined file (or directory).
+        Upper region channels are, for example, [4, 5, 6, 7, 12, 13, 14, 15, 20, 21, ...].
+        If file is successfully completed, it will log "Combined file created" (look PacketStats documentation)::
+
+
+            GbtPacketMaker.vertical_pattern("upper", [20,21,22,23], 4, bc_gap=96, second_dir_name='2')
+
+
+        :param "upper"/"lower"/"upper_specific"/"lower_specific" section: "lower" if channels hit should be of lower section or [0, 1, 2, 3, 8, 9, ...] and "upper" if channels are from [4, 5, 6, 7, 12, 13, 14, ...]. If "*_specific", then GBT packets are combined into pairs insteand of one combined file.
+        :param list regions: regions for hits e.g. [20, 21]
+        :param int offset: Hit channel offset / starting channel for x planes. 0, 1, 2, or 3 if section = "lower", 4, 5, 6, or 7 if section = "upper".
+        :param 0/int/optional bc_delay: BC ID of the first dummy packet to allow for simulation to wait and process the first real GBT packet
+        :param 32/int/optional bc_gap_track: BC ID difference between each GBT packets within the same region.
+        :param 0/int/optional bc_gap_region: BC ID difference between different regions/pairs. The default value is 0.
+        :param 0/int/optional bc_gap_pl:  BC ID difference between planes. The default value is 0.
+        :param "second"/str/optional second_dir_name: name of second directory if second directory is necessary.
+        :param None/PacketSink/optional sink: If given, all packets are written into this sink, which is left open, instead of combined files.
+        :param 1/int/optional workers: number of worker processes that encode regions in parallel. The output does not depend on it.
+        :param False/bool/optional manifest: If True, manifests of the expected packets are written for GbtPacketChecker.verify_tree() (look write_manifests documentation). Ignored if sink is given.
+        '''
+
+        dir_name = 'vert_%s_%s_offset%s_bc_delay_%s_gap_%s_%s_bc_gap_pl_%s' % (section, regions, offset, bc_delay, bc_gap_track, bc_gap_region, bc_gap_pl)
+        out = GbtPacketMaker.pattern_sink(section, dir_name, second_dir_name, bc_delay, sink)
+        args = (section, regions, offset, bc_gap_track, bc_gap_region, bc_gap_pl)
+        GbtPacketMaker.write_pattern("vertical", args, dir_name, second_dir_name, len(regions), out, workers)
+
+        GbtPacketMaker.finish_pattern(section, dir_name, second_dir_name, len(regions), bc_delay, out, sink)
+        if manifest and sink is None:
+            GbtPacketMaker.write_manifests("vertical", args, section, dir_name, second_dir_name, bc_delay)
 
     @staticmethod
     def horizontal_pattern(section, regions, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir="none",
-                           bc_delay=0, bc_gap_track=32, bc_gap_region=0, bc_gap_pl=0, second_dir_name="second"):
+                           bc_delay=0, bc_gap_track=32, bc_gap_region=0, bc_gap_pl=0, second_dir_name="second", sink=None, workers=1,
+                           manifest=False):
         '''
-        Creates GBT packet files in a new directory and a combined file that has all GBT packets in a current directory
-        to simulate a horizontal pattern of hits in detector. If BC ID exceeds 4095, then a second directory is created
-        and rest of the files necessary to generate a pattern have BC ID = (BC ID - 4095) and stored in a second directory.
-        If file is successfully completed, it will print out "Combined file created" as well as a list of newly created GBT files::
+        Creates a combined file that has all GBT packets in a current directory to simulate a horizontal pattern of hits in detector.
+        Packets are streamed into the combined file without GBT packet files unless section is "*_specific" or another sink is given.
+        If BC ID exceeds 4095, then rest of the packets necessary to generate a pattern have BC ID = (BC ID - 4095) and are stored in a second combined file (or directory).
+        If file is successfully completed, it will log "Combined file created" (look PacketStats documentation)::
 
 
             GbtPacketMaker.horizontal_pattern("lower", [20,21], 2, 3, 4, 2, uv_dir="right")
@@ -441,99 +1024,19 @@ class GbtPacketMaker:
         :param 0/int/optional bc_gap_region: Look vertical_pattern documentation.
         :param 0/int/optional bc_gap_pl: Look vertical_pattern documentation.
         :param "second"/str/optional second_dir_name: Look vertical_pattern documentation.
+        :param None/PacketSink/optional sink: Look vertical_pattern documentation.
+        :param 1/int/optional workers: Look vertical_pattern documentation.
+        :param False/bool/optional manifest: Look vertical_pattern documentation.
         '''
-        def make_hor():
-            uv_offset= input_uv_offset
-            if "diagonal" in section:
-                if input_uv_offset == 0 or (uv_dir != "left" and uv_dir != "right"):
-                    exit()
-                if uv_dir == "right":
-                    uv_offset = -1 * input_uv_offset
-
-            if "lower" in section and offset in [0, 1, 2, 3]:  # checks if the offset is appropriate for the input region e.g. offset = 2
-                pass
-            elif "upper" in section and offset in [4, 5, 6, 7]:  # e.g. offset = 4
-                pass
-            else:
-                print("wrong section")
-                exit()
-
-            interval = 8
-            channels = [offset + interval * i for i in range(8)]        # sets an interval as 8
-            if x_vmm in [i for i in range(8)]:
-                x_ch = x_vmm * 64 + channels[x_ch_idx]
-            else:
-                print("Your x_vmm = %s is out of range. x_vmm should be in a range of 0 to 7" % (x_vmm))
-                exit()
-
-            if x_ch <= 510 // 2:
-                num = range(x_ch // interval + 1)
-            else:
-                num = range((512 - x_ch) // interval + 1)
-
-            # adds left and right channels and removes the duplicated center
-            u_ch_ls = list(reversed([- uv_offset + x_ch - interval * i for i in num])) + \
-                      [- uv_offset + x_ch + interval * i for i in num][1:]
-            v_ch_ls = list(reversed([i+ 2 * uv_offset for i in u_ch_ls]))
-            return x_ch, u_ch_ls, v_ch_ls
-
-        x_ch, u_ch_ls, v_ch_ls = make_hor()
+        x_ch, _, _ = GbtPacketMaker.horizontal_channels(section, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir)
         dir_name = "hor_%s_ch%s_pair%s_%s_bc_gap_%s_bc_gap_pl_%s" % (section, x_ch, regions, uv_dir, bc_gap_track, bc_gap_pl)  # CHANGE THE DIR NAME
-        path = "GBT_packet_dir_%s/" % dir_name
-        path2 = "GBT_packet_dir_%s_%s/" % (dir_name, second_dir_name)   # in case there is a second directory to look at
-        k = 0
-        for i in range(len(regions)):
-            bc = bc_gap_track + k
-            pl = [[], [], [], []]           # [x0, x1, u0, v0]
-            for n in range(len(u_ch_ls)):
-                if regions[i] in [20, 22, 24, 26, 28]:
-                    ch = [x_ch % 64, x_ch % 64, u_ch_ls[n] % 64, v_ch_ls[n] % 64]
-                    x0 = round((x_ch // 64) * .1, 1)
-                    x1 = x0 + 1
-                    u0 = round((u_ch_ls[n] // 64) * .1 + 2, 1)
-                    v0 = round((v_ch_ls[n] // 64) * .1 + 3, 1)
-                    pl = [x0, x1, u0, v0]
-                elif regions[i] in [21, 23, 25, 27, 29]:
-                    ch = [u_ch_ls[n] % 64, v_ch_ls[n] % 64, x_ch % 64, x_ch % 64]
-                    x0 = round((x_ch // 64) * .1 + 2, 1)
-                    x1 = x0 + 1
-                    u0 = round((u_ch_ls[n] // 64) * .1, 1)
-                    v0 = round((v_ch_ls[n] // 64) * .1 + 1, 1)
-                    pl = [u0, v0, x0, x1]
-
-                if bc < 4096:
-                    if bc_gap_pl == 0:
-                        GbtPacketMaker(pl,ch).make_gbt(bc, regions[i], dir_name)
-                    else:
-                        for j in range(4):
-                            GbtPacketMaker([pl[j]],[ch[j]]).make_gbt(bc+j, regions[i], dir_name)
-
-                else:
-                    temp_bc = bc - 4095                             # add a separate directory for BC that are too large
-                    if bc_gap_pl == 0:
-                        GbtPacketMaker(pl,ch).make_gbt(temp_bc, regions[i], dir_name, second_dir_name)
-                    else:
-                        for j in range(4):
-                            GbtPacketMaker([pl[j]],[ch[j]]).make_gbt(temp_bc+j, regions[i], dir_name, second_dir_name)
-
-                bc += bc_gap_track
-
-            if i % 2 != 0:
-                k += bc_gap_region
-
-        if "specific" in section:
-            GbtPacketMaker.combine_gbt(path, "pair", len(regions), bc_delay)
-            print("Combined file created")
-            if os.path.exists(os.path.dirname(path2)):              # combines the second file as well
-                GbtPacketMaker.combine_gbt(path2, "pair", len(regions), bc_delay)
-                print("Combined file 2 created")
-        else:
-            GbtPacketMaker.combine_gbt(path, "all", len(regions), bc_delay)
-            print("Combined file created")
-            if os.path.exists(os.path.dirname(path2)):
-                GbtPacketMaker.combine_gbt(path2, "all", len(regions), bc_delay)
-                print("Combined file 2 created")
+        out = GbtPacketMaker.pattern_sink(section, dir_name, second_dir_name, bc_delay, sink)
+        args = (section, regions, offset, x_vmm, x_ch_idx, input_uv_offset, uv_dir, bc_gap_track, bc_gap_region, bc_gap_pl)
+        GbtPacketMaker.write_pattern("horizontal", args, dir_name, second_dir_name, len(regions), out, workers)
 
+        GbtPacketMaker.finish_pattern(section, dir_name, second_dir_name, len(regions), bc_delay, out, sink)
+        if manifest and sink is None:
+            GbtPacketMaker.write_manifests("horizontal", args, section, dir_name, second_dir_name, bc_delay)
 
 #GbtPacketMaker.vertical_pattern("upper", [20, 21, 22, 23, 24, 25, 26, 27, 28, 29], 4, bc_delay=800, bc_gap_pl=1)
 
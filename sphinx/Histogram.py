@@ -0,0 +1,169 @@
+'''
+Histogram is a class that keeps counts of the values of fields of simulated data, grouped by error message digit, in fixed arrays.
+Every field has one bin for each of the 65536 values of a four-hex-digit field, so a Histogram takes the same memory however many lines
+are counted, and Histograms of different files of a campaign are merged by adding their arrays with +=.
+
+HistogramMaker.histograms() counts one file into a Histogram and HistogramMaker.aggregate() counts many files in a pool of worker processes.
+For instance::
+
+
+    histogram = HistogramMaker.aggregate(["run1.txt", "run2.txt", "run3.txt"], [2, 3], workers=3)
+    histogram += HistogramMaker("run4.txt").histograms([2, 3])
+    histogram["0"][1][12]       # number of lines with error message digit 0 and channel 12 hit on v1
+    histogram.total()[0]        # counts of v0 of all error messages
+'''
+import csv
+import json
+import sys
+import numpy as np
+
+
+class Histogram:
+    '''
+    This is a class of counts of (error message digit, field, value) of simulated data.
+    '''
+    num_bins = 1 << 16                                  # one bin for each value of a field
+
+    def __init__(self, idx_info=[2,3,4,5,6,7,8,9], counts=None, lines=0, files=0):
+        '''
+        :param [2,3,4,5,6,7,8,9]/list/optional idx_info: indices of the fields counted (look HistogramMaker.select documentation)
+        :param None/dict/optional counts: {error message digit: (len(idx_info), num_bins) array of counts}
+        :param 0/int/optional lines: number of lines counted
+        :param 0/int/optional files: number of files counted
+        '''
+        self.idx_info = list(idx_info)
+        self.counts = {} if counts is None else counts
+        self.lines = lines
+        self.files = files
+
+    def __iadd__(self, other):
+        '''
+        Adds counts of another Histogram of the same fields.
+        '''
+        if other.idx_info != self.idx_info:
+            print("Histograms of fields %s and %s can't be added." % (self.idx_info, other.idx_info))
+            sys.exit()
+        for err_msg, counts in other.counts.items():
+            if err_msg in self.counts:
+                self.counts[err_msg] += counts
+            else:
+                self.counts[err_msg] = counts.copy()
+        self.lines += other.lines
+        self.files += other.files
+        return self
+
+    def __add__(self, other):
+        result = Histogram(self.idx_info, dict((err_msg, counts.copy()) for err_msg, counts in self.counts.items()), self.lines, self.files)
+        result += other
+        return result
+
+    def __getitem__(self, err_msg):
+        '''
+        Returns the (len(idx_info), num_bins) counts of an error message digit e.g. "0".
+        '''
+        return self.counts[err_msg]
+
+    def __contains__(self, err_msg):
+        return err_msg in self.counts
+
+    def __iter__(self):
+        return iter(Histogram.error_messages(self))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def error_messages(self):
+        '''
+        Returns the sorted error message digits counted e.g. ["0", "1"].
+        '''
+        return sorted(self.counts)
+
+    def total(self):
+        '''
+        Returns the (len(idx_info), num_bins) counts of all error messages.
+        '''
+        total = np.zeros((len(self.idx_info), Histogram.num_bins), dtype=np.int64)
+        for counts in self.counts.values():
+            total += counts
+        return total
+
+    def __getstate__(self):
+        '''
+        Drops the empty bins above the largest value counted, so that a Histogram sent back from a worker process is small.
+        '''
+        counts = {}
+        for err_msg, field_counts in self.counts.items():
+            used = np.flatnonzero(field_counts.any(axis=0))
+            counts[err_msg] = field_counts[:, :used[-1] + 1 if len(used) else 0]
+        return {"idx_info": self.idx_info, "counts": counts, "lines": self.lines, "files": self.files}
+
+    def __setstate__(self, state):
+        self.idx_info = state["idx_info"]
+        self.lines = state["lines"]
+        self.files = state["files"]
+        self.counts = {}
+        for err_msg, field_counts in state["counts"].items():
+            self.counts[err_msg] = np.zeros((len(self.idx_info), Histogram.num_bins), dtype=np.int64)
+            self.counts[err_msg][:, :field_counts.shape[1]] = field_counts
+
+    def save(self, file_name):
+        '''
+        Writes the Histogram into a NumPy .npz file (or an opened binary file) without the empty bins above the largest value counted.
+        '''
+        state = Histogram.__getstate__(self)
+        error_messages = Histogram.error_messages(self)
+        counts = np.zeros((len(error_messages), len(self.idx_info), max([0] + [state["counts"][e].shape[1] for e in error_messages])), dtype=np.int64)
+        for i, err_msg in enumerate(error_messages):
+            counts[i, :, :state["counts"][err_msg].shape[1]] = state["counts"][err_msg]
+        np.savez_compressed(file_name, idx_info=np.array(self.idx_info, dtype=np.int64), error_messages=np.array(error_messages, dtype=str),
+                            counts=counts, lines=self.lines, files=self.files)
+
+    @staticmethod
+    def load(file_name):
+        '''
+        Reads a Histogram written by save().
+        '''
+        with np.load(file_name) as data:
+            histogram = Histogram.__new__(Histogram)
+            Histogram.__setstate__(histogram, {"idx_info": data["idx_info"].tolist(), "lines": int(data["lines"]), "files": int(data["files"]),
+                                               "counts": dict(zip(data["error_messages"].tolist(), data["counts"]))})
+        return histogram
+
+    def rows(self, names=None):
+        '''
+        Yields (error message digit, field index, field name, value, count) of every bin with hits.
+        names are the names of the 18 fields e.g. HistogramMaker.variables. If None, the name is the field index.
+        '''
+        for err_msg in Histogram.error_messages(self):
+            for i, idx in enumerate(self.idx_info):
+                counts = self.counts[err_msg][i]
+                values = np.flatnonzero(counts)
+                name = str(idx) if names is None else names[idx]
+                for value, count in zip(values.tolist(), counts[values].tolist()):
+                    yield err_msg, idx, name, value, count
+
+    def write(self, file_name, names=None):
+        '''
+        Writes the counts as CSV, JSON or NPZ by the extension of file_name. CSV has one row of error_message, field, name, value, count
+        per bin with hits, and JSON is {"idx_info", "lines", "files", "counts": {error message digit: {field name: {value: count}}}}.
+        NPZ is written by save().
+        '''
+        if file_name.endswith(".npz"):
+            Histogram.save(self, file_name)
+        elif file_name.endswith(".json"):
+            counts = {}
+            for err_msg, idx, name, value, count in Histogram.rows(self, names):
+                counts.setdefault(err_msg, {}).setdefault(name, {})[value] = count
+            with open(file_name, 'w') as f:
+                json.dump({"idx_info": self.idx_info, "lines": self.lines, "files": self.files, "counts": counts}, f)
+        elif file_name.endswith(".csv"):
+            with open(file_name, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["error_message", "field", "name", "value", "count"])
+                writer.writerows(Histogram.rows(self, names))
+        else:
+            print("%s should end with .csv, .json or .npz" % file_name)
+            sys.exit()
+
+    def __repr__(self):
+        return "Histogram(%s, error messages %s, %s lines of %s files)" % (self.idx_info, Histogram.error_messages(self), self.lines, self.files)
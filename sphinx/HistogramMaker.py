@@ -5,72 +5,204 @@ HistogramMaker can generate two different types of histograms: one without an er
 For instance, the default input is [2,3,4,5,6,7,8,9] which are translated into collecting data for all planes or v0, v1, u0, u1, x0, x1, x2, x3 planes.   
 Indices range from 0 to 17 as the number of bytes for each line of the simulated GBT packet is 18 bytes long (this translates into header, error message and BCID, v0, v1, u0, u1, x0, x1, x2, x3, fitting info #1, fitting info #2, fitting info #3, fitting info #4, fitting info #5, fitting info #6, fitting info #7, fitting info #8.
 
+extract() parses the simulated data file block by block into an (N, 18) array of 16-bit fields with NumPy, so large simulator outputs are read without keeping their text in memory.
+The file is memory-mapped and its line ends are indexed once. If all lines have the same width, header checks and select() read only the fields they need from the mapped file.
+After HistogramMaker.set_cache(), counts of histograms are cached in .npz files keyed by the content of the file, so the same file is plotted again without parsing it.
+matplotlib is imported only when a histogram is drawn: export() writes the counts as CSV, JSON or NPZ, and batch() renders many files into PNG/PDF files with the Agg backend.
+follow() keeps counting a file while the simulator writes it and updates a plot or a snapshot file as lines come in.
+
 When creating an instance of the class, make sure the input datafile (simulated GBT data) is either within the same directory, or include the path to the file. e.g.HistogramMaker("<directory>/<filename>").
 '''
 #!/usr/local/bin/python3
-# #UNCOMMENT BELOW(IMPORT) BEFORE EXECUTING THE CODE
-#from matplotlib.pylab import *
-import GbtPacketMaker
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Histogram import Histogram
 
 
 class HistogramMaker:
+    # code of each byte: 0 to 15 for hex digits, 16 for spaces, tabs and carriage returns, 17 for new lines and 18 for anything else
+    hex_code_table = np.array([int(chr(c), 16) if chr(c) in "0123456789abcdefABCDEF" else 16 if chr(c) in " \t\r" else 17 if c == 10 else 18
+                               for c in range(256)], dtype=np.uint8)
+    error_table = np.array(list("0123456789ABCDEF"))    # error message digit of each error code
+    block_size = 1 << 24                                # bytes parsed at a time by extract()
+    variables = ['Header', 'Error message and BCID', 'v0', 'v1', 'u0', 'u1', 'x0', 'x1', 'x2', 'x3',
+                 'Fitting info #1', 'Fitting info #2', 'Fitting info #3', 'Fitting info #4',
+                 'Fitting info #5', 'Fitting info #6', 'Fitting info #7', 'Fitting info #8']      # names of the 18 fields
+    planes = ['v0', 'v1', 'u0', 'u1', 'x0', 'x1', 'x2', 'x3']
+    cache_dir = None                                    # directory of cached histograms, None until set_cache() is called
+    cache_max_bytes = 1 << 30
 
     def __init__(self, file):
-        self.file = "./"+str(file)
+        self.file = str(file) if os.path.isabs(str(file)) else "./"+str(file)
+        self.map = None                                 # memory map of the file, see open_map()
+        self.data = None                                # (N, 18) array once extract() is called
+
+    @staticmethod
+    def parse(block, first_line=0):
+        '''
+        Converts lines of simulated data into an (N, 18) uint16 array of the 18 four-hex-digit fields of each line, e.g.
+        b"A3FF 0027 0004 0004 ...\\n" into [[0xA3FF, 0x0027, 0x0004, 0x0004, ...]]. Spaces, tabs and carriage returns are ignored
+        and empty lines are skipped. The code exits at a line that does not have 72 hex digits.
+
+        :param bytes block: complete lines of simulated data ending with a new line
+        :param 0/int/optional first_line: line number of the first line of block in the file, used in error messages
+        '''
+        codes = HistogramMaker.hex_code_table[np.frombuffer(block, dtype=np.uint8)]
+        codes = codes[codes != 16]
+        ends = np.flatnonzero(codes == 17)                  # one new line per line
+        lengths = np.diff(ends, prepend=-1) - 1
+        bad = np.flatnonzero((lengths != 72) & (lengths != 0)).tolist()[:1]
+        bad += np.searchsorted(ends, np.flatnonzero(codes == 18)).tolist()[:1]     # lines with characters other than hex digits
+        if bad:
+            print("\n Line %s doesn't have 18 fields of four hex digits! \n" % (first_line + min(bad) + 1))
+            sys.exit()
+        digits = codes[codes < 16].reshape(-1, 18, 4).astype(np.uint16)
+        return digits[:, :, 0] << 12 | digits[:, :, 1] << 8 | digits[:, :, 2] << 4 | digits[:, :, 3]
+
+    def open_map(self):
+        '''
+        Maps the simulated data file into memory and indexes the end of every line once, block_size bytes at a time so that only the
+        offsets of the new lines are kept. If all lines have the same width and the same
+        positions of hex digits (e.g. "A3FF 0027 ..." written by the simulator), the positions are kept in digit_pos so that fields are
+        read straight from the mapped file without parsing whole lines. Nothing is done if the file is already mapped.
+        '''
+        if self.map is not None:
+            return
+        with open(self.file, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        buffer = np.frombuffer(self.map, dtype=np.uint8)
+        block_size = HistogramMaker.block_size
+        ends = [np.flatnonzero(buffer[start:start + block_size] == 10) + start for start in range(0, len(buffer), block_size)]
+        self.ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.intp)
+        if len(buffer) and buffer[-1] != 10:
+            self.ends = np.append(self.ends, len(buffer))   # last line without a new line
+        self.width = None
+        self.digit_pos = None
+        if len(self.ends) == 0:
+            return
+        width = int(self.ends[0]) + 1
+        if len(self.ends) * width != len(buffer):
+            return
+        rows = max(1, block_size // width)              # lines checked at a time, so no array of the size of the file is made
+        for start in range(0, len(self.ends), rows):
+            if np.any(np.diff(self.ends[start:start + rows + 1]) != width):
+                return
+        view = buffer.reshape(-1, width)
+        codes = HistogramMaker.hex_code_table[view[0]]
+        digit_pos = np.flatnonzero(codes < 16)
+        separator_pos = np.flatnonzero(codes >= 16)
+        if len(digit_pos) != 72:
+            return
+        for start in range(0, len(view), rows):
+            if np.any(HistogramMaker.hex_code_table[view[start:start + rows, separator_pos]] < 16):
+                return
+        self.width = width
+        self.digit_pos = digit_pos.reshape(18, 4)
+
+    def close(self):
+        '''
+        Unmaps the simulated data file. Parsed data are kept.
+        '''
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.map = None
+
+    def blocks(self, block_size=None):
+        '''
+        Yields (line number of the first line, memoryview of complete lines) of the mapped simulated data file, about block_size bytes at a time.
+        Blocks are views of the mapped file, so nothing is copied or read again.
+        '''
+        HistogramMaker.open_map(self)
+        block_size = HistogramMaker.block_size if block_size is None else block_size
+        buffer = memoryview(self.map)
+        line = 0
+        start = 0
+        while line < len(self.ends):
+            last = max(int(np.searchsorted(self.ends, start + block_size)), line + 1)   # complete lines of about block_size bytes
+            last = min(last, len(self.ends))
+            end = int(self.ends[last - 1]) + 1
+            block = buffer[start:end] if end <= len(buffer) else bytes(buffer[start:]) + b"\n"
+            yield line, block
+            line, start = last, end
+
+    def check_header(self, data=None, first_line=0):
+        '''
+        Checks if every line has a header (in other words, whether the line starts with "a3" or "A3".) Lines of parsed data are checked if
+        data is given, and otherwise the headers are read straight from the mapped file when its lines have fixed width.
+        '''
+        if data is None:
+            data = HistogramMaker.columns(self, [0], check=False)
+        bad = np.flatnonzero(data[:, 0] >> 8 != 0xA3)
+        if len(bad):
+            print("\n We can't find the header and we expect it! \n")
+            print("line %s: %04X" % (first_line + bad[0] + 1, data[bad[0], 0]))
+            sys.exit()
 
     def check(self):
         '''
         Checks if there are headers (in other words, whether the file starts with "a3" or "A3".)
         '''
-        datafile = open(self.file, 'r')
-        for line in datafile:
-            if line[0:2] != ("a3" and "A3"):
-                print("\n We can't find the header and we expect it! \n")
-                print(line[0:2])
-                exit()
+        HistogramMaker.check_header(self)
 
-    def extract(self):
+    def extract(self, block_size=None):
         '''
-        Extracts lines from the simulated data file and converts them into a list of four bits after checking if there are headers For all plane channel information.
-        e.g. [['A3FF', '0027', '0004', '0004', ...],['A3DE',...],...]
-        :return: a list of elements which are each lines of simulated data
+        Extracts lines from the simulated data file into an (N, 18) uint16 array of the 18 four-hex-digit fields of each line after
+        checking if there are headers. The mapped file is parsed in blocks of about block_size bytes, so memory other than the array is bounded.
+        The array is kept, so the file is parsed only once.
+        e.g. [[0xA3FF, 0x0027, 0x0004, 0x0004, ...], [0xA3DE, ...], ...]
+        :return: an array of which rows are lines of simulated data
         '''
-        HistogramMaker.check(self)
-        line_ls = []
-        with open(self.file, 'r') as f:
-            for line in f.readlines():
-                line_condensed = ""
-                for letter in line:
-                    if letter != " " and letter !="\n":
-                        line_condensed += letter
-
-                line_chunks = GbtPacketMaker.GbtPacketMaker.chunky(line_condensed,4)
-                line_ls.append(line_chunks)
+        if self.data is not None:
+            return self.data
+        parts = []
+        for first_line, block in HistogramMaker.blocks(self, block_size):
+            data = HistogramMaker.parse(block, first_line)
+            HistogramMaker.check_header(self, data, first_line)
+            parts.append(data)
+        self.data = np.concatenate(parts) if parts else np.zeros((0, 18), dtype=np.uint16)
+        return self.data
+
+    def columns(self, idx_info, check=True):
+        '''
+        Returns an (N, len(idx_info)) uint16 array of the fields idx_info of each line. If lines have fixed width (see open_map()), only the
+        hex digits of those fields are read from the mapped file, block by block. Otherwise, or if the file was already parsed, the array
+        of extract() is used.
 
-        print(line_ls)
-        exit()
-        return line_ls
+        :param list idx_info: indices of fields from 0 to 17
+        :param True/bool/optional check: If True, headers are checked
+        '''
+        HistogramMaker.open_map(self)
+        if self.data is not None or self.digit_pos is None:
+            return HistogramMaker.extract(self)[:, idx_info]
+        if check:
+            HistogramMaker.check_header(self)
+        buffer = np.frombuffer(self.map, dtype=np.uint8)
+        pos = self.digit_pos[idx_info].ravel()
+        result = np.empty((len(self.ends), len(idx_info)), dtype=np.uint16)
+        step = max(1, HistogramMaker.block_size // self.width)
+        for first in range(0, len(self.ends), step):
+            last = min(first + step, len(self.ends))
+            digits = HistogramMaker.hex_code_table[buffer[first * self.width:last * self.width].reshape(-1, self.width)[:, pos]]
+            if np.any(digits >= 16):                        # a field has other characters than hex digits; extract() tells where
+                return HistogramMaker.extract(self)[:, idx_info]
+            digits = digits.reshape(last - first, len(idx_info), 4).astype(np.uint16)
+            result[first:last] = digits[:, :, 0] << 12 | digits[:, :, 1] << 8 | digits[:, :, 2] << 4 | digits[:, :, 3]
+        return result
 
     def select(self, idx_info=[2,3,4,5,6,7,8,9]):
         '''
         Selects specific information with user input's idx_info of each line of simulated data.
         :param [2,3,4,5,6,7,8,9]/list/optional idx_info: indices of information when lines of simulated data are divided into separate 2-bits e.g. v0 plane channel/strip information is idx_info=[2]
+        :return: (an array of the selected fields of each line, an array of the error message digit of each line e.g. "0")
         '''
-        selected_ls = []
-        err_msg_ls = []
-        info = HistogramMaker.extract(self)
-        for i in range(len(info)):
-            selected = []
-            for idx in idx_info:
-                if idx in [2,3,4,5,6,7,8,9]:
-                    selected.append(int(info[i][idx], 16))
-                else:
-                    selected.append(info[i][idx])
-
-            selected_ls.append(selected)
-            err_msg_ls.append(info[i][1][0])
-
-        return selected_ls, err_msg_ls
+        info = HistogramMaker.columns(self, list(idx_info) + [1])
+        return info[:, :-1], HistogramMaker.error_table[info[:, -1] >> 12]
 
     def categorize(self, idx_info=[2,3,4,5,6,7,8,9], err_msg='g'):
         '''
@@ -80,91 +212,323 @@ class HistogramMaker:
         if err_msg == 'g':skip = True  # default is 'eg' which then looks at every line with all types of error messages
         else:skip = False
         selected_ls, err_msg_ls = HistogramMaker.select(self, idx_info)
-        variables = ['Header', 'Error message and BCID', 'v0', 'v1', 'u0', 'u1', 'x0', 'x1', 'x2', 'x3',
-                     'Fitting info #1', 'Fitting info #2', 'Fitting info #3', 'Fitting info #4',
-                     'Fitting info #5', 'Fitting info #6', 'Fitting info #7', 'Fitting info #8']
-        var_sel = [variables[i] for i in idx_info]
+        var_sel = [HistogramMaker.variables[i] for i in idx_info]
         var_dict = {}
         for i in range(len(var_sel)):
             var_dict[var_sel[i]] = []
 
-        for i in range(len(selected_ls)):
-            for j in range(len(selected_ls[i])):
-                if selected_ls[i][j] != 0:
-                    if skip:
-                        var_dict[var_sel[j]].append(selected_ls[i][j])
-                    elif not skip and err_msg_ls[i] == err_msg:
-                        var_dict[var_sel[j]].append(selected_ls[i][j])
-
-        for each in var_dict:
-            var_dict[each].sort()
+        rows = np.ones(len(selected_ls), dtype=bool) if skip else err_msg_ls == err_msg
+        for j in range(len(var_sel)):
+            column = selected_ls[rows, j]
+            var_dict[var_sel[j]].extend(np.sort(column[column != 0]).tolist())
 
         return var_dict, err_msg_ls, err_msg
 
-    def plot_histogram(self, idx_info=[2,3,4,5,6,7,8,9], second_file="none"):
+    def histograms(self, idx_info=[2,3,4,5,6,7,8,9]):
         '''
-        Plots hit slope histograms for all eight planes. If a second file name is not "none" and the file exists, the two files are combined to make the same histograms.::
+        Returns count() of the file. If the histogram cache is on (look set_cache documentation), the counts are kept in an .npz file, so
+        counting the same file with the same idx_info again only reads the cache. Histograms of several files are added with += (look Histogram documentation).::
 
 
-            # Plotting a histogram of one example simulated GBT file.
-            HistogramMaker("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_first.txt").plot_slope_histogram()
+            counts = HistogramMaker("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_first.txt").histograms([2, 3])
+            counts["0"][1][12]      # number of lines with error message digit 0 and channel 12 hit on v1
 
-            # Plotting one histogram of combined data from two example simulated GBT files.
-            HistogramMaker("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_first.txt").plot_slope_histogram("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_second.txt")
+
+        :param [2,3,4,5,6,7,8,9]/list/optional idx_info: Look select documentation.
+        :return Histogram: {error message digit: (len(idx_info), 65536) array of the number of lines with each value of each field}
+        '''
+        cache_file = HistogramMaker.cache_file(self, idx_info)
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                os.utime(cache_file)                        # marks the cache file as recently used
+            except OSError:
+                pass
+            return Histogram.load(cache_file)
+        histogram = HistogramMaker.count(self, idx_info)
+        if cache_file is not None:
+            HistogramMaker.store(histogram, cache_file)
+        return histogram
+
+    @staticmethod
+    def set_cache(cache_dir=".histogram_cache", max_bytes=1 << 30):
+        '''
+        Turns on the cache of histograms(), which is off by default, and sets where it keeps counts of files. A relative cache_dir is made
+        next to each simulated data file and an absolute one is shared by all files. If the cache files of a cache directory take more
+        than max_bytes, the least recently used ones are removed. None turns the cache off again.::
+
+
+            HistogramMaker.set_cache()                              # ".histogram_cache" next to each file
+            HistogramMaker.set_cache("/tmp/histograms", 1 << 28)    # one cache of at most 256 MB for all files
 
 
         '''
-        var_dict, err_msg_ls, _ = HistogramMaker.categorize(self, idx_info)
-        var_sel = [each for each in var_dict]
-        err_sorted = sorted(list(set(err_msg_ls)))
+        HistogramMaker.cache_dir = cache_dir
+        HistogramMaker.cache_max_bytes = max_bytes
 
-        if second_file.lower() != "none":  # In case there are two files to be combined for one histogram
-            second_title = " and " + [x for x in second_file.split('/')][-1][:-4] + " combined"
-            for each in var_sel:
-                var_dict_2 = HistogramMaker(second_file).categorize(idx_info)
-                var_dict[each].extend(var_dict_2[each])
+    def content_hash(self):
+        '''
+        Returns a hash of the content of the file. The hash is kept with the size and modification time of the file in an index file of
+        the cache directory, e.g. ".histogram_cache/<hash of the path>.json", so the file is hashed again only after it changes.
+        Every data file has its own index file, written whole with os.replace(), so worker processes of aggregate() never write the
+        same index file with different contents.
+        '''
+        directory = os.path.join(os.path.dirname(self.file), HistogramMaker.cache_dir)
+        status = os.stat(self.file)
+        key = os.path.abspath(self.file)
+        index_file = os.path.join(directory, hashlib.blake2b(key.encode(), digest_size=8).hexdigest() + ".json")
+        try:
+            with open(index_file, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if entry is not None and entry.get("file") == key and entry["size"] == status.st_size and entry["mtime_ns"] == status.st_mtime_ns:
+            return entry["hash"]
+
+        HistogramMaker.open_map(self)
+        content = hashlib.blake2b(digest_size=16)
+        buffer = memoryview(self.map)
+        for start in range(0, len(buffer), HistogramMaker.block_size):
+            content.update(buffer[start:start + HistogramMaker.block_size])
+        entry = {"file": key, "size": status.st_size, "mtime_ns": status.st_mtime_ns, "hash": content.hexdigest()}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(index_file + ".tmp%s" % os.getpid(), 'w') as f:
+                json.dump(entry, f)
+            os.replace(index_file + ".tmp%s" % os.getpid(), index_file)
+        except OSError:                                     # e.g. the directory of the file is read-only
+            pass
+        return entry["hash"]
+
+    def cache_file(self, idx_info):
+        '''
+        Returns the name of the cache file of the counts of idx_info of the file, e.g. ".histogram_cache/<content hash>_2-3-4-5-6-7-8-9.npz",
+        or None if the cache is off.
+        '''
+        if HistogramMaker.cache_dir is None:
+            return None
+        return os.path.join(os.path.dirname(self.file), HistogramMaker.cache_dir,
+                            "%s_%s.npz" % (HistogramMaker.content_hash(self), "-".join(str(idx) for idx in idx_info)))
+
+    @staticmethod
+    def store(histogram, cache_file):
+        '''
+        Writes a Histogram into cache_file and removes the least recently used cache files of its directory above cache_max_bytes.
+        '''
+        directory = os.path.dirname(cache_file)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(cache_file + ".tmp%s" % os.getpid(), 'wb') as f:
+                histogram.save(f)
+            os.replace(cache_file + ".tmp%s" % os.getpid(), cache_file)
+            cached = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".npz")]
+            cached = sorted((os.stat(name).st_mtime, os.stat(name).st_size, name) for name in cached)
+            total = sum(size for _, size, _ in cached)
+            for _, size, name in cached:
+                if total <= HistogramMaker.cache_max_bytes:
+                    break
+                os.remove(name)
+                total -= size
+        except OSError:                                     # the cache is skipped if it can't be written
+            pass
+
+    def count(self, idx_info=[2,3,4,5,6,7,8,9]):
+        '''
+        Counts the values of the fields idx_info of every line, grouped by error message digit, in a single pass over the data with np.bincount
+        on (error message, field, value) keys. Value 0 (no hit) is not counted like in categorize(). plot_histogram() and plot_histogram_error()
+        draw these counts without reading the file again.
+
+        :param [2,3,4,5,6,7,8,9]/list/optional idx_info: Look select documentation.
+        :return Histogram: counts of the file
+        '''
+        info = HistogramMaker.columns(self, list(idx_info) + [1])
+        return HistogramMaker.count_lines(info, idx_info)
+
+    @staticmethod
+    def count_lines(info, idx_info):
+        '''
+        Counts an (N, len(idx_info) + 1) array of the fields idx_info and field 1 (error message and BCID) of each line, e.g. columns(idx_info + [1]).
+        count() counts a whole file and follow() counts lines appended to a file.
+
+        :return Histogram: counts of the lines as one file
+        '''
+        codes = np.flatnonzero(np.bincount(info[:, -1] >> 12, minlength=16))   # error message digits found in the file
+        code_index = np.zeros(16, dtype=np.int64)
+        code_index[codes] = np.arange(len(codes))
+        num_fields = len(idx_info)
+        counts = np.zeros(len(codes) * num_fields * Histogram.num_bins, dtype=np.int64)
+        step = max(1, HistogramMaker.block_size // (8 * num_fields))    # lines counted at a time
+        for first in range(0, len(info), step):
+            block = info[first:first + step]
+            keys = (code_index[block[:, -1] >> 12][:, np.newaxis] * num_fields + np.arange(num_fields)) << 16 | block[:, :-1]
+            counts += np.bincount(keys[block[:, :-1] != 0], minlength=len(counts))
+        counts = counts.reshape(len(codes), num_fields, Histogram.num_bins)
+        return Histogram(idx_info, dict((str(HistogramMaker.error_table[code]), counts[i]) for i, code in enumerate(codes)), len(info), 1)
+
+    @staticmethod
+    def file_histogram(task):
+        '''
+        Counts one file in a worker process of aggregate().
 
+        :param tuple task: (file name, idx_info, (cache_dir, cache_max_bytes)) where the cache settings are those of set_cache() in the parent process
+        :return Histogram: histograms() of the file
+        '''
+        file_name, idx_info, cache = task
+        HistogramMaker.set_cache(*cache)
+        histogram_maker = HistogramMaker(file_name)
+        histogram = HistogramMaker.histograms(histogram_maker, idx_info)
+        HistogramMaker.close(histogram_maker)
+        return histogram
+
+    @staticmethod
+    def aggregate(files, idx_info=[2,3,4,5,6,7,8,9], workers=1):
+        '''
+        Counts many simulated data files, e.g. all output files of a campaign, into one Histogram. Files are counted in a pool of
+        worker processes and their Histograms are added as they come back, so memory depends on the number of bins, not of hits.::
+
+
+            histogram = HistogramMaker.aggregate(glob.glob("copied_simdata/*.txt"), workers=8)
+
+
+        :param list files: names of simulated data files
+        :param [2,3,4,5,6,7,8,9]/list/optional idx_info: Look select documentation.
+        :param 1/int/optional workers: number of worker processes. 1 counts the files in this process.
+        :return Histogram: counts of all files
+        '''
+        total = Histogram(idx_info)
+        cache = (HistogramMaker.cache_dir, HistogramMaker.cache_max_bytes)
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            for histogram in (pool.map if pool is not None else map)(HistogramMaker.file_histogram, [(file_name, list(idx_info), cache) for file_name in files]):
+                total += histogram
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return total
+
+    @staticmethod
+    def second_files(second_file):
+        '''
+        Returns a list of the files given as second_file of the plot functions: [] for "none", [second_file] for a file name, or the list itself.
+        '''
+        if isinstance(second_file, str):
+            return [] if second_file.lower() == "none" else [second_file]
+        return list(second_file)
+
+    @staticmethod
+    def plot_counts(axis, name, counts, **kwargs):
+        '''
+        Draws a histogram of the counts of one field (a row of histograms()) on axis like a histogram of the values themselves.
+        Bins of plane fields are channels from 0 to the largest channel hit + 9, and the number of hits is annotated where it changes.
+        :return: (n, bins) of the histogram
+        '''
+        values = np.flatnonzero(counts)
+        if name in HistogramMaker.planes:
+            bins = np.arange(int(values.max() if len(values) else 0) + 10)
+            (n, bins, patches) = axis.hist(bins[:-1], bins=bins, weights=counts[:len(bins) - 1], align="left", histtype='step', **kwargs)
+            prev = 0
+            for yval, xval in zip(n, bins):     # Informs the user of the y values of x+1 when the y value of x+1 is different than y of x
+                if yval != 0 and yval != prev:
+                    prev = yval
+                    if isinstance(yval, float):
+                        yval = int(yval)
+                    axis.annotate(yval, xy=(xval,0))
         else:
-            second_title = ""
+            (n, bins, patches) = axis.hist(values, weights=counts[values], align="left", histtype='step', **kwargs) # histtype=step speeds up plotting process
+        return n, bins
+
+    @staticmethod
+    def pyplot(backend=None):
+        '''
+        Imports matplotlib.pyplot when a histogram is drawn, so counting and exporting data never import matplotlib.
+        A backend e.g. "Agg" renders into files without a display (look batch documentation).
+        '''
+        import matplotlib
+        if backend is not None:
+            matplotlib.use(backend)
+        import matplotlib.pyplot as plt
+        return plt
+
+    def combined_histogram(self, idx_info=[2,3,4,5,6,7,8,9], second_file="none", workers=1):
+        '''
+        Returns histograms() of the file added with the counts of second_file (look plot_histogram documentation).
+        '''
+        histogram = HistogramMaker.histograms(self, idx_info)
+        second_files = HistogramMaker.second_files(second_file)
+        if second_files:  # In case there are more files to be combined for one histogram
+            histogram += HistogramMaker.aggregate(second_files, idx_info, workers)
+        return histogram
+
+    @staticmethod
+    def draw(histogram, errors=False, backend=None, fig=None):
+        '''
+        Draws one histogram per field of a Histogram, with one line per error message if errors is True. If fig is given, it is cleared
+        and drawn again instead of opening a new figure, e.g. to update the same window in follow().
 
-        fig, axs = plt.subplots(len(idx_info), 1, figsize=(15, 7.5)) #figsize=(15,1 *len(idx_info)))
-        plt.subplots_adjust(hspace=1.8)
-        title = [x for x in self.file.split('/')][-1][:-4]
+        :return: (pyplot, figure, {field name: {"n": n, "bins": bins}}) where n and bins of errors=True are kept per error message e.g. {"v0": {"0": {...}}}
+        '''
+        plt = HistogramMaker.pyplot(backend)
+        var_sel = [HistogramMaker.variables[i] for i in histogram.idx_info]
+        if fig is None:
+            fig, axs = plt.subplots(len(var_sel), 1, figsize=(15, 7.5), squeeze=False) #figsize=(15,1 *len(idx_info)))
+        else:
+            fig.clf()
+            axs = fig.subplots(len(var_sel), 1, squeeze=False)
+        axs = axs[:, 0]
+        fig.subplots_adjust(hspace=1.8)
         fig.suptitle("%s Histograms" % var_sel)
+        total = histogram.total()
         data_ls = {}
-        for i in range(len(var_dict)):
-            data_ls[var_sel[i]] = {}
-            print(var_dict[var_sel[i]])
-            if var_sel[i] in ['v0','v1','u0','u1','x0','x1','x2','x3']:
-                print(int(max(var_dict[var_sel[i]])))
-                (n, bins, patches) = axs[i].hist(var_dict[var_sel[i]], align="left", bins=range(int(max(var_dict[var_sel[i]]))+10),
-                                                 histtype='step')
-                prev = 0
-                for yval, xval in zip(n, bins):     # Informs the user of the y values of x+1 when the y value of x+1 is different than y of x
-                    if yval != 0 and yval != prev:
-                        prev = yval
-                        if isinstance(yval, float):
-                            yval = int(yval)
-                        axs[i].annotate(yval, xy=(xval,0))
-
+        for i in range(len(var_sel)):
+            if errors:
+                data_ls[var_sel[i]] = {}
+                for err_msg in histogram.error_messages():
+                    n, bins = HistogramMaker.plot_counts(axs[i], var_sel[i], histogram[err_msg][i], stacked=True, fill=False, label=err_msg)
+                    data_ls[var_sel[i]][err_msg] = {"n": n, "bins": bins}
             else:
-                (n, bins, patches) = axs[i].hist(var_dict[var_sel[i]], align="left", histtype='step') # histtype=step speeds up plotting process
-
-            data_ls[var_sel[i]] = {"n": n, "bins": bins}
+                n, bins = HistogramMaker.plot_counts(axs[i], var_sel[i], total[i])
+                data_ls[var_sel[i]] = {"n": n, "bins": bins}
             axs[i].set_xlabel(var_sel[i], x=1, fontsize=12)  # axs[i].set_title("%s" % var_sel[k], fontsize=10)
 
         axs[0].set_ylabel('Hits', x=1, fontsize=12)
-        for i in range(len(axs)):
+        if errors:
+            axs[0].legend(loc='best', bbox_to_anchor=(0.6, 0., 0.5, 0.5))
+        return plt, fig, data_ls
+
+    def plot_histogram(self, idx_info=[2,3,4,5,6,7,8,9], second_file="none", workers=1, output=None):
+        '''
+        Plots hit slope histograms for all eight planes. If a second file name is not "none" and the file exists, the two files are combined to make the same histograms.
+        second_file can also be a list of files, which are counted in workers processes (look aggregate documentation) and combined.
+        If output is a file name e.g. "v0.png", the figure is saved there instead of being shown.::
+
+
+            # Plotting a histogram of one example simulated GBT file.
+            HistogramMaker("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_first.txt").plot_slope_histogram()
+
+            # Plotting one histogram of combined data from two example simulated GBT files.
+            HistogramMaker("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_first.txt").plot_slope_histogram("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_second.txt")
+
+
+        '''
+        histogram = HistogramMaker.combined_histogram(self, idx_info, second_file, workers)
+        plt, fig, data_ls = HistogramMaker.draw(histogram)
+        if output is not None:
+            fig.savefig(output)
+            plt.close(fig)
+            return data_ls
+
+        var_sel = [HistogramMaker.variables[i] for i in idx_info]
+        for i in range(len(var_sel)):
             print("------------------ plane = %s ------------------" % (var_sel[i]))
             for n_each, bins_each in zip(data_ls[var_sel[i]]["n"], data_ls[var_sel[i]]["bins"]):
                 if int(n_each) != 0:
                     print("(channel= %s, num_hits = %s)" % (bins_each, int(n_each)), end='  ')
             print("\n")
         plt.show()
+        return data_ls
 
-    def plot_histogram_error(self, idx_info=[2,3,4,5,6,7,8,9], second_file="none"):
+    def plot_histogram_error(self, idx_info=[2,3,4,5,6,7,8,9], second_file="none", workers=1, output=None):
         '''
-        Plots hit slope histograms for all eight planes.::
+        Plots hit slope histograms for all eight planes. second_file, workers and output are the same as plot_histogram().::
 
 
             # Plotting a histogram of one example simulated GBT file with error messages.
@@ -175,61 +539,18 @@ class HistogramMaker:
 
 
         '''
-        all_dict = {}
-        all_dict_2 = {}
-        var_dict, err_msg_ls, _ = HistogramMaker.categorize(self, idx_info)
-        var_sel = [each for each in var_dict]
-        var_dict = {}
-        var_dict_2 = {}
-        err_sorted = sorted(list(set(err_msg_ls)))
-        for err_msg in err_sorted:
-            var_dict, _, _ = HistogramMaker.categorize(self, idx_info, err_msg)
-            all_dict[err_msg] = var_dict
-
-        if second_file.lower() != "none":  # In case there are two files to be combined for one histogram
-            second_title = " and " + [x for x in second_file.split('/')][-1][:-4] + " combined"
-            var_dict_2, err_msg_ls_2, _ = HistogramMaker(second_file).categorize(idx_info)
-            err_sorted_2 = sorted(list(set(err_msg_ls)))
-            for err_msg in err_sorted_2:
-                var_dict_2, _, _ = HistogramMaker(second_file).categorize(idx_info, err_msg)
-                all_dict_2[err_msg] = var_dict_2
-                for each in var_sel:
-                    print(all_dict[err_msg][each])
-                    all_dict[err_msg][each].extend(all_dict_2[err_msg][each])
-        else:
-            second_title = ""
-
-        fig, axs = plt.subplots(len(idx_info), 1, figsize=(15, 7.5)) #figsize=(15,1 *len(idx_info)))
-        plt.subplots_adjust(hspace=1.8)
-        title = [x for x in self.file.split('/')][-1][:-4]
-        fig.suptitle("%s Histograms" % var_sel)
-        data_ls = {}
-        for i in range(len(var_dict)):
-            data_ls[var_sel[i]] = {}
-            for err_msg in err_sorted:
-                if var_sel[i] in ['v0','v1','u0','u1','x0','x1','x2','x3']:
-                    (n, bins, patches) = axs[i].hist(all_dict[err_msg][var_sel[i]], align="left", bins=range(int(max(all_dict[err_msg][var_sel[i]])) + 10),
-                                                     histtype='step', stacked=True, fill=False, label=err_msg)
-                    prev = 0
-                    for yval, xval in zip(n, bins):     # Informs the user of the y values of x+1 when the y value of x+1 is different than y of x
-                        if yval != 0 and yval != prev:
-                            prev = yval
-                            if isinstance(yval, float):
-                                yval = int(yval)
-                            axs[i].annotate(yval, xy=(xval,0))
-
-                else:
-                    (n, bins, patches) = axs[i].hist(all_dict[err_msg][var_sel[i]], align="left", histtype='step') # histtype=step speeds up plotting process
-
-                data_ls[var_sel[i]][err_msg] = {"n": n, "bins": bins}
-
-            axs[i].set_xlabel(var_sel[i], x=1, fontsize=12)  # axs[i].set_title("%s" % var_sel[k], fontsize=10)
-
-        axs[0].set_ylabel('Hits', x=1, fontsize=12)
-        axs[0].legend(loc='best', bbox_to_anchor=(0.6, 0., 0.5, 0.5))
+        histogram = HistogramMaker.combined_histogram(self, idx_info, second_file, workers)
+        err_sorted = histogram.error_messages()
+        plt, fig, data_ls = HistogramMaker.draw(histogram, errors=True)
+        if output is not None:
+            fig.savefig(output)
+            plt.close(fig)
+            return data_ls
+
+        var_sel = [HistogramMaker.variables[i] for i in idx_info]
         print("file = %s\n" % self.file)
         print(err_sorted)
-        for i in range(len(axs)):
+        for i in range(len(var_sel)):
             for err_msg in err_sorted:
                 print("------------------ plane = %s ||| error message = %s ------------------" % (var_sel[i], err_msg))
                 for n_each, bins_each in zip(data_ls[var_sel[i]][err_msg]["n"], data_ls[var_sel[i]][err_msg]["bins"]):
@@ -237,6 +558,157 @@ class HistogramMaker:
                         print("(channel= %s, num_hits = %s)" % (bins_each, int(n_each)), end='  ')
                 print("\n")
         plt.show()
+        return data_ls
+
+    def export(self, file_name, idx_info=[2,3,4,5,6,7,8,9], second_file="none", workers=1):
+        '''
+        Writes the counts of the histograms without drawing them (and without importing matplotlib) as CSV, JSON or NPZ by the
+        extension of file_name (look Histogram.write documentation).::
+
+
+            HistogramMaker("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_first.txt").export("first.csv")
+
+
+        :return Histogram: the counts written
+        '''
+        histogram = HistogramMaker.combined_histogram(self, idx_info, second_file, workers)
+        histogram.write(file_name, HistogramMaker.variables)
+        return histogram
+
+    def follow(self, idx_info=[2,3,4,5,6,7,8,9], interval=1.0, snapshot=None, plot=False, errors=False, timeout=None, callback=None):
+        '''
+        Follows a simulated data file while the simulator is still writing it, like "tail -f". Every interval seconds only the complete lines
+        appended since the last time are parsed and added to the histograms, and then a snapshot file is written, the plot is redrawn
+        and/or callback(histogram) is called. Appended bytes are read block_size bytes at a time. Following stops when the file doesn't
+        grow for timeout seconds or on Ctrl-C. If the file is replaced, gets shorter or no longer ends with the last bytes counted (e.g.
+        the simulator starts again), counting starts again from the beginning of the file.::
+
+
+            # Redraws the histograms every 5 seconds and stops 60 seconds after the simulator stops writing.
+            HistogramMaker("simdata/run.txt").follow(interval=5, plot=True, timeout=60)
+
+            # Writes counts every 10 seconds for another program to read.
+            HistogramMaker("simdata/run.txt").follow(interval=10, snapshot="run_live.json")
+
+
+        :param [2,3,4,5,6,7,8,9]/list/optional idx_info: Look select documentation.
+        :param 1.0/float/optional interval: seconds between updates
+        :param None/str/optional snapshot: If given, counts are written into this CSV, JSON or NPZ file (look Histogram.write documentation) at each update.
+        :param False/bool/optional plot: If True, the histograms are redrawn at each update.
+        :param False/bool/optional errors: If True, the plot has one line per error message like plot_histogram_error().
+        :param None/float/optional timeout: seconds without new lines before following stops. None follows until Ctrl-C.
+        :param None/function/optional callback: function called with the Histogram at each update
+        :return Histogram: counts of all lines read
+        '''
+        histogram = Histogram(idx_info)
+        position = 0                                        # bytes of complete lines counted so far
+        line = 0                                            # lines counted so far
+        tail = b""                                          # last bytes counted, to tell if the file was written again
+        identity = None                                     # (device, inode) of the file counted
+        last_growth = time.time()
+        fig = None
+        try:
+            while True:
+                updated = False
+                with open(self.file, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    if position:
+                        f.seek(position - len(tail))
+                        if (stat.st_dev, stat.st_ino) != identity or stat.st_size < position or f.read(len(tail)) != tail:
+                            histogram, position, line, tail = Histogram(idx_info), 0, 0, b""
+                            f.seek(0)
+                    identity = (stat.st_dev, stat.st_ino)
+                    rest = b""                              # a line being written is counted at the next update
+                    while True:
+                        block = f.read(HistogramMaker.block_size)
+                        if not block:
+                            break
+                        block = rest + block
+                        end = block.rfind(b"\n") + 1
+                        rest = block[end:]
+                        if end == 0:
+                            continue
+                        data = HistogramMaker.parse(block[:end], line)
+                        HistogramMaker.check_header(self, data, line)
+                        histogram += HistogramMaker.count_lines(data[:, list(idx_info) + [1]], idx_info)
+                        histogram.files = 1                 # appended lines belong to the same file
+                        position += end
+                        line += block.count(b"\n", 0, end)
+                        tail = block[max(0, end - 64):end]
+                        updated = True
+                        last_growth = time.time()
+
+                if updated:
+                    if snapshot is not None:
+                        histogram.write(snapshot, HistogramMaker.variables)
+                    if plot:
+                        plt, fig, _ = HistogramMaker.draw(histogram, errors, fig=fig)   # redraws the same window
+                        plt.pause(0.001)                    # draws the figure without blocking
+                    if callback is not None:
+                        callback(histogram)
+                elif timeout is not None and time.time() - last_growth > timeout:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        return histogram
+
+    @staticmethod
+    def render(task):
+        '''
+        Writes the histograms of one file in a worker process of batch().
+
+        :param tuple task: (file name, output_dir, idx_info, errors, formats, data_format) as in batch() and (cache_dir, cache_max_bytes) of set_cache()
+        :return list: names of the files written
+        '''
+        file_name, output_dir, idx_info, errors, formats, data_format, cache = task
+        HistogramMaker.set_cache(*cache)
+        histogram_maker = HistogramMaker(file_name)
+        histogram = HistogramMaker.histograms(histogram_maker, idx_info)
+        HistogramMaker.close(histogram_maker)
+        base = os.path.join(output_dir, os.path.splitext(os.path.basename(file_name))[0] + ("_error" if errors else ""))
+        written = []
+        if data_format is not None:
+            histogram.write(base + "." + data_format, HistogramMaker.variables)
+            written.append(base + "." + data_format)
+        if formats:
+            plt, fig, _ = HistogramMaker.draw(histogram, errors, backend="Agg")
+            for extension in formats:
+                fig.savefig(base + "." + extension)
+                written.append(base + "." + extension)
+            plt.close(fig)
+        return written
+
+    @staticmethod
+    def batch(files, output_dir=".", idx_info=[2,3,4,5,6,7,8,9], errors=False, formats=("png",), data_format=None, workers=1):
+        '''
+        Writes histograms of many simulated data files without a display, e.g. for nightly jobs. Each file gets "<name>.png" (or
+        "<name>_error.png" if errors is True) rendered with the Agg backend of matplotlib and, if data_format is given, "<name>.<data_format>"
+        with its counts. Files are rendered in a pool of worker processes. formats=() writes data only and doesn't import matplotlib.::
+
+
+            HistogramMaker.batch(glob.glob("copied_simdata/*.txt"), "plots", formats=("png", "pdf"), data_format="csv", workers=8)
+
+
+        :param list files: names of simulated data files
+        :param "."/str/optional output_dir: directory of the written files, created if it doesn't exist
+        :param [2,3,4,5,6,7,8,9]/list/optional idx_info: Look select documentation.
+        :param False/bool/optional errors: If True, histograms are drawn per error message like plot_histogram_error().
+        :param ("png",)/tuple/optional formats: image formats written by matplotlib e.g. "png", "pdf" or "svg"
+        :param None/"csv"/"json"/"npz"/optional data_format: format of the counts written next to the images
+        :param 1/int/optional workers: number of worker processes
+        :return list: names of the files written
+        '''
+        os.makedirs(output_dir, exist_ok=True)
+        cache = (HistogramMaker.cache_dir, HistogramMaker.cache_max_bytes)
+        tasks = [(file_name, output_dir, list(idx_info), errors, tuple(formats), data_format, cache) for file_name in files]
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            written = list((pool.map if pool is not None else map)(HistogramMaker.render, tasks))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return [name for names in written for name in names]
 
 
 #HistogramMaker("copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_first_check.txt").plot_histogram_error([2,3,4,5,6,7], second_file="copied_simdata/vert_upper_offset4_same_bc_gap96_pl_1_pair20_21_second_check.txt")
@@ -0,0 +1,152 @@
+'''
+HitGenerator draws random GBT packets for stress tests. All hits of N packets are drawn at once as NumPy arrays in the format of
+GbtPacketMaker.encode_batch(), so millions of packets can be made in batches, and the same seed always gives the same packets.
+
+The number of hits per packet, the planes, vmm's and channels hit and the regions of the packets are drawn from configurable weights.
+For instance::
+
+
+    generator = HitGenerator(seed=1, multiplicity=[0, 1, 1, 1, 0, 0, 0, 0], regions=[20, 21])   # 2 to 4 hits per packet
+    batch = generator.generate(1000000)
+    words = generator.encode(batch)["Words"]
+
+    with CombinedFileSink("combined_random") as sink:
+        generator.write(1000, sink)
+'''
+import sys
+import numpy as np
+import GbtPacketMaker
+from HitSet import HitSet
+
+
+class HitGenerator:
+    '''
+    This is a class to draw random hits of GBT packets with NumPy.
+    '''
+    def __init__(self, seed=None, multiplicity=None, plane_weights=None, vmm_weights=None, channel_weights=None,
+                 regions=(20,), region_weights=None, distinct_vmm=True, bc_start=32, bc_gap=32):
+        '''
+        :param None/int/optional seed: seed of the random generator. None draws different packets every time.
+        :param None/list/optional multiplicity: weights of 1 to 8 hits per packet. Default is 1 to 7 hits with equal weights like GbtPacketChecker.simulate().
+        :param None/list/optional plane_weights: weights of planes 0 to 3. Default is equal weights.
+        :param None/list/optional vmm_weights: weights of vmm's 0 to 7, or of the 32 vmm's plane * 8 + vmm. Default is equal weights.
+        :param None/list/optional channel_weights: weights of channels 0 to 63. Default is equal weights.
+        :param (20,)/list/optional regions: regions of the packets
+        :param None/list/optional region_weights: weights of regions. Default is equal weights.
+        :param True/bool/optional distinct_vmm: If True, hits of a packet are on different vmm's so that Hit Map tells every hit apart.
+        :param 32/int/optional bc_start: BC ID of the first packet
+        :param 32/int/optional bc_gap: BC ID difference between packets. BC ID wraps around after 4095.
+        '''
+        self.rng = np.random.default_rng(seed)
+        self.multiplicity = HitGenerator.probabilities([1, 1, 1, 1, 1, 1, 1, 0] if multiplicity is None else multiplicity, 8, "multiplicity")
+        plane = HitGenerator.probabilities([1] * 4 if plane_weights is None else plane_weights, 4, "plane_weights")
+        if vmm_weights is not None and len(vmm_weights) == 32:
+            vmm = HitGenerator.probabilities(vmm_weights, 32, "vmm_weights")
+        else:
+            vmm = np.outer(plane, HitGenerator.probabilities([1] * 8 if vmm_weights is None else vmm_weights, 8, "vmm_weights")).ravel()
+            vmm /= vmm.sum()
+        self.vmm = vmm                                  # probability of each of the 32 vmm's plane * 8 + vmm
+        self.channel = HitGenerator.probabilities([1] * 64 if channel_weights is None else channel_weights, 64, "channel_weights")
+        self.regions = np.asarray(regions, dtype=np.int64)
+        self.region = HitGenerator.probabilities([1] * len(regions) if region_weights is None else region_weights, len(regions), "region_weights")
+        self.distinct_vmm = distinct_vmm
+        max_hits = np.nonzero(self.multiplicity)[0].max() + 1
+        if distinct_vmm and max_hits > np.count_nonzero(self.vmm):
+            print("Not enough vmm's have weights to draw %s hits on different vmm's." % max_hits)
+            sys.exit()
+        self.bc_start = bc_start
+        self.bc_gap = bc_gap
+        self.num_packets = 0                            # packets drawn so far, which continues BC ID's from batch to batch
+
+    @staticmethod
+    def probabilities(weights, length, name):
+        '''
+        Normalizes weights into probabilities. The code exits if the number of weights is not length or no weight is positive.
+        '''
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) != length or np.any(weights < 0) or weights.sum() <= 0:
+            print("%s should be %s non-negative weights with a positive sum." % (name, length))
+            sys.exit()
+        return weights / weights.sum()
+
+    @staticmethod
+    def draw(rng, probabilities, size):
+        '''
+        Draws size indices of probabilities with replacement. Equal probabilities are drawn as integers, which is several times faster.
+        '''
+        if np.ptp(probabilities) == 0:
+            return rng.integers(len(probabilities), size=size)
+        return rng.choice(len(probabilities), size=size, p=probabilities)
+
+    def generate(self, num_packets):
+        '''
+        Draws hits of num_packets packets.
+
+        :param int num_packets: number of packets
+        :return dict: {"Plane", "VMM", "Channel", "Packet index"} arrays with one entry per hit and {"BCID", "Region"} arrays with one
+            entry per packet, i.e. the arguments of GbtPacketMaker.encode_batch()
+        '''
+        counts = self.rng.choice(8, size=num_packets, p=self.multiplicity) + 1
+        packet_index = np.repeat(np.arange(num_packets), counts)
+        position = np.arange(len(packet_index)) - np.repeat(np.cumsum(counts) - counts, counts)   # i-th hit within its packet
+        if self.distinct_vmm:
+            keys = self.rng.random((num_packets, 32))  # vmm's with the largest u ** (1 / weight) are drawn without replacement
+            if np.ptp(self.vmm) != 0:
+                with np.errstate(divide='ignore'):
+                    keys = np.log(keys) / self.vmm
+            max_hits = counts.max() if num_packets else 1
+            top = np.argpartition(-keys, max_hits - 1, axis=1)[:, :max_hits]     # max_hits largest keys of each packet
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1), axis=1)
+            vmm = top[packet_index, position]
+        else:
+            vmm = HitGenerator.draw(self.rng, self.vmm, len(packet_index))
+        channel = HitGenerator.draw(self.rng, self.channel, len(packet_index))
+
+        BCID = (self.bc_start + self.bc_gap * (self.num_packets + np.arange(num_packets))) % 4096
+        region = self.regions[self.rng.choice(len(self.regions), size=num_packets, p=self.region)]
+        self.num_packets += num_packets
+        return {"Plane": vmm >> 3, "VMM": vmm & 7, "Channel": channel, "Packet index": packet_index, "BCID": BCID, "Region": region}
+
+    def batches(self, num_packets, batch_size=100000):
+        '''
+        Yields generate() of batch_size packets (and the rest in the last batch) until num_packets packets are drawn.
+        '''
+        for start in range(0, num_packets, batch_size):
+            yield HitGenerator.generate(self, min(batch_size, num_packets - start))
+
+    @staticmethod
+    def encode(batch):
+        '''
+        Encodes a batch of generate() with GbtPacketMaker.encode_batch().
+        '''
+        return GbtPacketMaker.GbtPacketMaker.encode_batch(batch["Plane"], batch["VMM"], batch["Channel"], batch["Packet index"],
+                                                          batch["BCID"], batch["Region"])
+
+    @staticmethod
+    def hit_sets(batch):
+        '''
+        Yields (BCID, region, HitSet) of each packet of a batch of generate(), e.g. to write a manifest with GbtPacketChecker.write_manifest().
+        '''
+        packed = (batch["Plane"] << 9 | batch["VMM"] << 6 | batch["Channel"]).tolist()
+        ends = np.cumsum(np.bincount(batch["Packet index"], minlength=len(batch["BCID"]))).tolist()
+        start = 0
+        for BCID, region, end in zip(batch["BCID"].tolist(), batch["Region"].tolist(), ends):
+            yield BCID, region, HitSet.from_packed(packed[start:end])
+            start = end
+
+    def write(self, num_packets, sink, batch_size=100000):
+        '''
+        Draws num_packets packets in batches, encodes them and writes them into a PacketSink. Packets are tagged with their number,
+        so a CombinedFileSink orders packets of the same BC ID and region in the order they were drawn.
+
+        :return int: number of packets written
+        '''
+        first = self.num_packets
+        for batch in HitGenerator.batches(self, num_packets, batch_size):
+            encoded = HitGenerator.encode(batch)
+            number = first
+            for words, BCID, region in zip(encoded["Words"].tolist(), batch["BCID"].tolist(), batch["Region"].tolist()):
+                sink.write(BCID, region, GbtPacketMaker.GbtPacketMaker.format_words(words, region), str(number))
+                number += 1
+            first = number
+        return num_packets
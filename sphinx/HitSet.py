@@ -0,0 +1,116 @@
+'''
+HitSet is a compact class that holds the hits of one GBT packet. Each hit is packed into one small integer
+plane << 9 | vmm << 6 | channel, so hits are kept sorted by plane, vmm and channel without any float arithmetic, and the
+32-bit vmm hit bitmap (Hit Map) is computed once when the HitSet is made.
+
+GbtPacketMaker, GbtPacketChecker and the pattern generators accept a HitSet wherever they accept [plane.vmm, ...], [channel, ...] lists.
+For instance, HitSet([0, 0, 1, 2, 3], [0, 4, 5, 6, 7], [1, 2, 4, 8, 13]) holds the same hits as [0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13].
+'''
+import sys
+from array import array
+
+
+class HitSet:
+    '''
+    This is a class to hold hits as packed (plane, vmm, channel) integers.
+    '''
+    __slots__ = ('hits', 'vmm_bitmap')
+
+    def __init__(self, planes, vmms, channels):
+        '''
+        Initializes HitSet object from lists of planes (0 to 3), vmm's (0 to 7) and channels (0 to 63) of each hit.
+        '''
+        packed = []
+        for plane, vmm, channel in zip(planes, vmms, channels):
+            if not (0 <= plane <= 3 and 0 <= vmm <= 7 and 0 <= channel <= 63):
+                print("Hit (plane=%s, vmm=%s, channel=%s) is out of range." % (plane, vmm, channel))
+                sys.exit()
+            packed.append(plane << 9 | vmm << 6 | channel)
+        HitSet.set_packed(self, packed)
+
+    def set_packed(self, packed):
+        '''
+        Sorts packed hits and computes the vmm hit bitmap. Bit (plane * 8 + vmm) of the bitmap is set for each hit vmm.
+        '''
+        self.hits = array('H', sorted(packed))
+        bitmap = 0
+        for hit in self.hits:
+            bitmap |= 1 << (hit >> 6)           # hit >> 6 is plane * 8 + vmm
+        self.vmm_bitmap = bitmap
+
+    @staticmethod
+    def from_packed(packed):
+        '''
+        Makes a HitSet from packed hits plane << 9 | vmm << 6 | channel.
+        '''
+        hit_set = HitSet.__new__(HitSet)
+        HitSet.set_packed(hit_set, packed)
+        return hit_set
+
+    @staticmethod
+    def from_floats(vmm_list, channel_list):
+        '''
+        Makes a HitSet from the [plane.vmm, ...], [channel, ...] format. Plane and vmm are read from the value rounded to
+        one decimal so that e.g. 1.0000001 is read as plane 1, vmm 0.::
+
+
+            HitSet.from_floats([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13])
+
+
+        '''
+        planes = []
+        vmms = []
+        for vmm in vmm_list:
+            plane_int, vmm_int = divmod(int(round(vmm * 10)), 10)
+            planes.append(plane_int)
+            vmms.append(vmm_int)
+        return HitSet(planes, vmms, channel_list)
+
+    def planes(self):
+        '''
+        Returns a list of planes of the hits.
+        '''
+        return [hit >> 9 for hit in self.hits]
+
+    def vmms(self):
+        '''
+        Returns a list of vmm's of the hits.
+        '''
+        return [(hit >> 6) & 7 for hit in self.hits]
+
+    def channel_list(self):
+        '''
+        Returns a list of channels of the hits in the [channel, ...] format.
+        '''
+        return [hit & 63 for hit in self.hits]
+
+    def vmm_list(self):
+        '''
+        Returns a list of planes and vmm's of the hits in the [plane.vmm, ...] format.
+        '''
+        return [round((hit >> 9) + ((hit >> 6) & 7) * .1, 1) for hit in self.hits]
+
+    def plane_counts(self):
+        '''
+        Returns a list of the number of hits on each of the four planes.
+        '''
+        counts = [0, 0, 0, 0]
+        for hit in self.hits:
+            counts[hit >> 9] += 1
+        return counts
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __iter__(self):
+        for hit in self.hits:
+            yield hit >> 9, (hit >> 6) & 7, hit & 63
+
+    def __eq__(self, other):
+        return isinstance(other, HitSet) and self.hits == other.hits
+
+    def __hash__(self):
+        return hash(self.hits.tobytes())
+
+    def __repr__(self):
+        return "HitSet(%s, %s)" % (HitSet.vmm_list(self), HitSet.channel_list(self))
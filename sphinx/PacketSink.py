@@ -0,0 +1,213 @@
+'''
+PacketSink is a class that receives GBT packets from GbtPacketMaker.make_gbt() and the pattern functions and decides where they go.
+There are four kinds of sinks:
+
+CombinedFileSink buffers all packets and writes them into one combined file (and one more for packets of the second directory)
+in a single pass, ordered by BC number, region and hits in the same way GbtPacketMaker.combine_gbt() orders GBT packet files.
+DirectorySink writes one GBT packet file per packet like make_gbt() does without a sink.
+MemorySink keeps packets in a list, and NullSink only counts them.
+Every sink adds its packets, bytes of packet lines and files to the "write" stage of PacketStats (or the stage given to it).
+
+For instance::
+
+
+    with CombinedFileSink("combined_test") as sink:
+        GbtPacketMaker([0.0, 0.4, 1.5, 2.6, 3.7],[1,2,4,8,13]).make_gbt(32, 20, "test", sink=sink)
+'''
+import os
+import errno
+import re
+from PacketStats import stats
+
+
+class PacketSink:
+    '''
+    This is a base class of sinks. Subclasses override write() and close().
+    '''
+    def __init__(self, stage="write"):
+        self.num_packets = 0
+        self.stage = stage                      # stage of PacketStats the packets are counted in
+
+    @staticmethod
+    def file_name(BCID, region, tag):
+        '''
+        Returns the name of a GBT packet file, e.g. "GBT_packet_BC=32_region=20_[0.0][4]".
+        '''
+        return "GBT_packet_BC=%s_region=%s_%s" % (BCID, region, tag)
+
+    @staticmethod
+    def sort_key(BCID, region, tag):
+        '''
+        Returns a key that orders packets the same way GbtPacketMaker.sorted_alphanumeric() orders their file names.
+        '''
+        return [BCID, region] + [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', tag)]
+
+    def write(self, BCID, region, lines, tag="", second=False):
+        '''
+        Receives one GBT packet.
+
+        :param int BCID: BC number of the packet
+        :param int region: region of the packet
+        :param str lines: lines of the GBT packet e.g. "0000A020 20\\n00804020 20\\n..."
+        :param ""/str/optional tag: hits of the packet as in GBT packet file names e.g. "[0.0][4]"
+        :param False/bool/optional second: True if the packet belongs to the second directory (BC number above 4095)
+        '''
+        self.num_packets += 1
+        stats.add(self.stage, packets=1, bytes=len(lines))
+
+    def close(self):
+        '''
+        Finishes writing. Nothing is done for the base class.
+        '''
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CombinedFileSink(PacketSink):
+    '''
+    Buffers packets and writes them as a combined file when closed. If packets already arrive in the final order
+    (e.g. from GbtPacketMaker.vertical_hits()), ordered=True writes each packet into the file right away instead.
+    '''
+    def __init__(self, file_name, second_file_name=None, head="", add_line=True, ordered=False, stage="write"):
+        '''
+        :param str file_name: name of the combined file
+        :param None/str/optional second_file_name: name of the combined file of second directory packets. If None, they go into file_name.
+        :param ""/str/optional head: lines written before the packets, e.g. delay packets
+        :param True/bool/optional add_line: If True, the finish command line '00000001 01' is written at the end.
+        :param False/bool/optional ordered: If True, packets are written in the order they arrive without buffering.
+        :param "write"/str/optional stage: stage of PacketStats the packets and files are counted in
+        '''
+        PacketSink.__init__(self, stage)
+        self.file_name = file_name
+        self.second_file_name = second_file_name
+        self.head = head
+        self.add_line = add_line
+        self.ordered = ordered
+        self.num_second_packets = 0
+        self.packets = {}                       # keyed by file name so that a repeated packet replaces the earlier one
+        self.second_packets = {}
+        self.files = {}                         # files opened when ordered is True
+
+    def write(self, BCID, region, lines, tag="", second=False):
+        PacketSink.write(self, BCID, region, lines, tag, second)
+        if second and self.second_file_name is not None:
+            self.num_second_packets += 1
+            file_name, packets = self.second_file_name, self.second_packets
+        else:
+            file_name, packets = self.file_name, self.packets
+
+        if self.ordered:
+            if file_name not in self.files:
+                self.files[file_name] = self.start_file(file_name)
+                stats.add(self.stage, files=1)
+            self.write_lines(self.files[file_name], lines)
+        else:
+            packets[PacketSink.file_name(BCID, region, tag)] = (PacketSink.sort_key(BCID, region, tag), lines)
+
+    def close(self):
+        '''
+        Writes the combined file(s). No file is created for a group without packets.
+        '''
+        for file_name, packets in [(self.file_name, self.packets), (self.second_file_name, self.second_packets)]:
+            if len(packets) == 0:
+                continue
+            ordered = sorted(packets.values(), key=lambda packet: packet[0])
+            out_file = self.start_file(file_name)
+            stats.add(self.stage, files=1)
+            self.write_lines(out_file, "".join([lines for _, lines in ordered]))
+            self.end_file(out_file)
+            packets.clear()
+
+        for out_file in self.files.values():
+            self.end_file(out_file)
+        self.files = {}
+
+    def start_file(self, file_name):
+        '''
+        Opens a combined file and writes head. Subclasses override start_file(), write_lines() and end_file() to write other formats.
+        '''
+        out_file = open(file_name, 'w')
+        out_file.write(self.head)
+        return out_file
+
+    def write_lines(self, out_file, lines):
+        '''
+        Writes lines of packets into an opened combined file.
+        '''
+        out_file.write(lines)
+
+    def end_file(self, out_file):
+        '''
+        Writes the finish command line if add_line is True and closes the combined file.
+        '''
+        if self.add_line:
+            out_file.write('00000001 01')
+        out_file.close()
+
+
+class DirectorySink(PacketSink):
+    '''
+    Writes one GBT packet file per packet into "GBT_packet_dir_<directory_name>/"
+    or "GBT_packet_dir_<directory_name>_<second_dir>/" for packets of the second directory.
+    '''
+    def __init__(self, directory_name, second_dir="second", add_line=False):
+        PacketSink.__init__(self)
+        self.directory = "GBT_packet_dir_%s/" % directory_name
+        self.second_directory = "GBT_packet_dir_%s_%s/" % (directory_name, second_dir)
+        self.add_line = add_line
+        self.made = set()                       # directories already checked or created
+
+    def write(self, BCID, region, lines, tag="", second=False):
+        PacketSink.write(self, BCID, region, lines, tag, second)
+        directory = self.second_directory if second else self.directory
+        if directory not in self.made:
+            try:
+                os.makedirs(directory)          # creates a new directory if it doesn't exist already
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            self.made.add(directory)
+
+        with open(directory + PacketSink.file_name(BCID, region, tag), 'w') as f:
+            f.write(lines)
+            if self.add_line:
+                f.write('00000001 01')
+        stats.add(self.stage, files=1)
+
+
+class MemorySink(PacketSink):
+    '''
+    Keeps packets in a list of (BCID, region, lines, tag, second) in the order they were written.
+    '''
+    def __init__(self):
+        PacketSink.__init__(self)
+        self.packets = []
+
+    def write(self, BCID, region, lines, tag="", second=False):
+        PacketSink.write(self, BCID, region, lines, tag, second)
+        self.packets.append((BCID, region, lines, tag, second))
+
+    def getvalue(self):
+        '''
+        Returns lines of all packets in the order they were written.
+        '''
+        return "".join([packet[2] for packet in self.packets])
+
+    def stream(self):
+        '''
+        Yields (BC, region, lines) of the packets for GbtPacketMaker.merge_gbt(), where BC of second directory packets is BCID + 4095.
+        '''
+        for BCID, region, lines, tag, second in self.packets:
+            yield BCID + 4095 if second else BCID, region, lines
+
+
+class NullSink(PacketSink):
+    '''
+    Counts packets and discards them.
+    '''
+    pass
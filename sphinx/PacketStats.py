@@ -0,0 +1,130 @@
+'''
+PacketStats counts packets, bytes and files and adds up the wall time of each stage of making and checking GBT packets:
+
+"encode" turns hits into GBT packet lines, "write" writes them into GBT packet files or a sink, "combine" merges packets
+into combined files and "check" compares GBT packets with the intended hits.
+
+GbtPacketMaker, PacketSink and GbtPacketChecker add to the module-level PacketStats object stats, and report progress
+through the logger "GbtPacket" instead of print statements. Messages about every packet are logged at the DEBUG level and
+messages about whole patterns at the INFO level. The library only adds a NullHandler to the logger, so nothing is printed
+until the application configures logging, e.g. with PacketStats.configure_logging(). For instance::
+
+
+    from PacketStats import PacketStats, stats
+
+    PacketStats.configure_logging("WARNING")    # prints warnings to stdout
+    stats.reset()
+    GbtPacketMaker.vertical_pattern("upper", [20, 21], 4)
+    stats.as_dict()["encode"]               # {"packets": 512, "bytes": 0, "files": 0, "seconds": 0.01}
+    stats.dump_json("stats.json")
+'''
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("GbtPacket")
+logger.addHandler(logging.NullHandler())
+
+
+class PacketStats:
+    '''
+    This is a class of counters of packets, bytes, files and seconds for each stage.
+    '''
+    stages = ("encode", "write", "combine", "check")
+
+    def __init__(self):
+        self.enabled = True
+        PacketStats.reset(self)
+
+    def reset(self):
+        '''
+        Sets all counters to zero.
+        '''
+        self.counters = dict((stage, {"packets": 0, "bytes": 0, "files": 0, "seconds": 0.0}) for stage in PacketStats.stages)
+
+    def add(self, stage, packets=0, bytes=0, files=0, seconds=0.0):
+        '''
+        Adds to the counters of a stage. Nothing is counted if enabled is False.
+
+        :param "encode"/"write"/"combine"/"check" stage: stage to count
+        :param 0/int/optional packets: number of packets
+        :param 0/int/optional bytes: number of bytes written or read
+        :param 0/int/optional files: number of files written or read
+        :param 0.0/float/optional seconds: wall time in seconds
+        '''
+        if not self.enabled:
+            return
+        counter = self.counters[stage]
+        counter["packets"] += packets
+        counter["bytes"] += bytes
+        counter["files"] += files
+        counter["seconds"] += seconds
+
+    @contextmanager
+    def timer(self, stage):
+        '''
+        Adds the wall time of a with block to a stage.::
+
+
+            with stats.timer("combine"):
+                GbtPacketMaker.combine_gbt("GBT_packet_dir_test/", "all", 2, 0)
+
+
+        '''
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            PacketStats.add(self, stage, seconds=time.perf_counter() - start)
+
+    def as_dict(self):
+        '''
+        Returns a copy of the counters as {stage: {"packets": int, "bytes": int, "files": int, "seconds": float}, ...}.
+        '''
+        return dict((stage, dict(counter)) for stage, counter in self.counters.items())
+
+    def dump_json(self, file_name):
+        '''
+        Writes the counters into a JSON file.
+        '''
+        with open(file_name, 'w') as f:
+            json.dump(PacketStats.as_dict(self), f, indent=2, sort_keys=True)
+
+    def report(self):
+        '''
+        Returns a table of the counters and the packets per second of each stage.
+        '''
+        lines = ["%-8s %10s %12s %8s %10s %12s" % ("stage", "packets", "bytes", "files", "seconds", "packets/sec")]
+        for stage in PacketStats.stages:
+            counter = self.counters[stage]
+            rate = counter["packets"] / counter["seconds"] if counter["seconds"] > 0 else 0.0
+            lines.append("%-8s %10d %12d %8d %10.3f %12.0f" % (stage, counter["packets"], counter["bytes"], counter["files"], counter["seconds"], rate))
+        return "\n".join(lines)
+
+    @staticmethod
+    def set_log_level(level):
+        '''
+        Sets the level of the "GbtPacket" logger, e.g. "DEBUG" to see every packet, "INFO" to see patterns and
+        "WARNING" for quiet runs.
+        '''
+        logger.setLevel(level)
+
+    @staticmethod
+    def configure_logging(level="INFO", stream=None):
+        '''
+        Prints messages of the "GbtPacket" logger to stream (stdout by default) as plain lines and sets its level. Scripts call this once;
+        applications that configure logging themselves don't need it. Calling it again only changes the level and stream.
+        '''
+        for handler in list(logger.handlers):
+            if getattr(handler, "gbt_packet", False):
+                logger.removeHandler(handler)
+        handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler.gbt_packet = True                   # marks the handler added here
+        logger.addHandler(handler)
+        logger.setLevel(level)
+
+
+stats = PacketStats()